@@ -1,33 +1,60 @@
 import os
 import io
-import json
-import requests
+import orjson
 import logging
 import random
 import tempfile
+import textwrap
 import sqlite3
+import queue
+import atexit
+import bisect
+import threading
+import collections
+import itertools
+import functools
 import hashlib
+import hmac
 import secrets
 import time
 import re
 import asyncio
-import base64
-from datetime import datetime, timedelta
+from base64 import b64decode, urlsafe_b64encode
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime
+from urllib.parse import quote
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
-    ContextTypes, CallbackQueryHandler, ConversationHandler
+    ContextTypes, CallbackQueryHandler, ConversationHandler, AIORateLimiter
 )
 from groq import Groq
-from PIL import Image, ImageDraw, ImageFont
-from youtubesearchpython import VideosSearch
+from redis import Redis, asyncio as aioredis
+from cachetools import TTLCache
+from starlette.applications import Starlette
+from starlette.responses import Response, PlainTextResponse
+from starlette.routing import Route
+
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    uvloop = None  # Windows / local dev: fall back to the default asyncio loop
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: the webhook's single-worker lock is not enforced
 
 # ========================
 # SETUP & CONFIGURATION
 # ========================
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper()
 )
 logger = logging.getLogger(__name__)
 
@@ -36,6 +63,9 @@ logger = logging.getLogger(__name__)
 # ========================
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
+REDIS_URL = os.environ.get('REDIS_URL')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
 
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_TOKEN not set in environment variables")
@@ -46,15 +76,38 @@ if not GROQ_API_KEY:
 else:
     client = Groq(api_key=GROQ_API_KEY)
 
+if not REDIS_URL:
+    logger.warning("⚠️ REDIS_URL not found - conversation state kept in process memory")
+    redis_client = None
+    redis_sync_client = None
+else:
+    redis_client = aioredis.Redis.from_url(REDIS_URL)
+    # Blocking client for UserDB code that already runs in worker threads
+    redis_sync_client = Redis.from_url(REDIS_URL)
+
 # YOUR ADMIN IDs - SET IN ENVIRONMENT VARIABLES
 ADMIN_IDS_STR = os.environ.get('ADMIN_IDS', '8403840295,8500506791')
-ADMIN_IDS = [int(admin_id.strip()) for admin_id in ADMIN_IDS_STR.split(',') if admin_id.strip()]
+ADMIN_IDS = frozenset(int(admin_id) for admin_id in ADMIN_IDS_STR.split(',') if admin_id.strip().isdigit())
+ADMIN_ID_LIST = tuple(ADMIN_IDS)  # fixed iteration order for notification fan-out
 
-user_conversations = {}
-user_sessions = {}
-guest_usage_tracker = {}
+CONVERSATION_TTL = 3600  # seconds a conversation survives in Redis without activity
+LOCAL_CONVERSATION_LIMIT = 10_000  # users whose history the in-process fallback keeps
+
+# In-process fallback when REDIS_URL is not configured; bounded and expiring like the Redis keys
+user_conversations = TTLCache(maxsize=LOCAL_CONVERSATION_LIMIT, ttl=CONVERSATION_TTL)
 admin_chat_sessions = {}
 
+HISTORY_WINDOW = 8     # turns always sent to Groq alongside the system prompt and summary
+SUMMARY_INTERVAL = 8   # turns leaving the window between refreshes of the rolling summary
+# Turns kept per user: the window plus everything not yet summarized (a refresh can be one turn late)
+MAX_HISTORY = HISTORY_WINDOW + SUMMARY_INTERVAL + 1
+conversation_summaries = TTLCache(maxsize=LOCAL_CONVERSATION_LIMIT, ttl=CONVERSATION_TTL)
+
+AI_MODEL = "llama-3.1-8b-instant"
+AI_CACHE_TTL = 86400
+AI_CACHE_MAX_LOCAL = 1000
+ai_response_cache = {}
+
 # ========================
 # FAKE STATISTICS - ENHANCED
 # ========================
@@ -73,9 +126,12 @@ FAKE_STATS = {
 # CONVERSATION STATES
 # ========================
 NAME, PHONE, EMAIL, PASSWORD, CONFIRM_PASSWORD = range(5)
-CONTACT_SUPPORT, ADMIN_REPLY = range(5, 7)
 CHANGE_PASSWORD = 8
 
+# Input validation patterns
+PHONE_RE = re.compile(r'\+?[1-9]\d{1,14}')
+EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+
 # ========================
 # CHAT ROOM MANAGER
 # ========================
@@ -85,7 +141,7 @@ class ChatRoomManager:
         self.user_chats = {}    # {user_id: chat_id}
     
     def create_chat_room(self, admin_id, chat_name="Support Chat"):
-        chat_id = f"chat_{secrets.token_urlsafe(8)}"
+        chat_id = f"chat_{new_token(8)}"
         self.active_chats[chat_id] = {
             'name': chat_name,
             'admin': admin_id,
@@ -133,6 +189,135 @@ class ChatRoomManager:
 
 chat_manager = ChatRoomManager()
 
+def new_token(nbytes=32):
+    """URL-safe random token; same output as secrets.token_urlsafe without the extra wrapper"""
+    return urlsafe_b64encode(secrets.token_bytes(nbytes)).rstrip(b'=').decode('ascii')
+
+def truncate(text, limit):
+    """Preview text for listings: cut at limit chars and mark the cut with '...'"""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+# Password KDF cost (hashlib.scrypt, ~16 MB per hash)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_DKLEN = 32
+
+# ========================
+# DATABASE CONNECTION POOL
+# ========================
+class SQLitePool:
+    """Fixed set of long-lived SQLite connections shared by all handlers"""
+    def __init__(self, db_file, size=5):
+        self.db_file = db_file
+        self.connections = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self.connections.put(self._connect())
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=-64000')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+    
+    @contextmanager
+    def acquire(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+    
+    @contextmanager
+    def transaction(self):
+        """Pooled connection inside BEGIN IMMEDIATE ... COMMIT, rolled back on error"""
+        with self.acquire() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+USER_STAT_FIELDS = ('images_created', 'music_searches', 'ai_chats', 'commands_used', 'total_messages')
+
+# Hot-path statements kept as fixed strings so every call hits sqlite3's statement cache
+_SQL_STAT_INCREMENT = {
+    'images_created': 'UPDATE user_stats SET images_created = images_created + ? WHERE user_id = ?',
+    'music_searches': 'UPDATE user_stats SET music_searches = music_searches + ? WHERE user_id = ?',
+    'ai_chats': 'UPDATE user_stats SET ai_chats = ai_chats + ? WHERE user_id = ?',
+    'commands_used': 'UPDATE user_stats SET commands_used = commands_used + ? WHERE user_id = ?',
+    'total_messages': 'UPDATE user_stats SET total_messages = total_messages + ? WHERE user_id = ?',
+}
+
+_SQL_TOUCH_ACTIVE = 'UPDATE user_stats SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?'
+_SQL_GUEST_MESSAGES = 'UPDATE guest_tracking SET message_count = message_count + ?, last_seen = CURRENT_TIMESTAMP WHERE telegram_id = ?'
+
+_SQL_LOGIN_SELECT = '''
+    SELECT id, telegram_id, username, first_name, password_hash, salt,
+           account_type, is_active, is_verified, login_attempts,
+           COALESCE(last_login_attempt > datetime('now', '-30 minutes'), 0)
+    FROM users
+    WHERE telegram_id = ?
+'''
+
+_SQL_SESSION_SELECT = '''
+    SELECT u.id, u.telegram_id, u.username, u.first_name, u.account_type,
+           s.expires_at > datetime('now')
+    FROM sessions s
+    JOIN users u ON s.user_id = u.id
+    WHERE s.session_id = ? AND u.is_active = 1 AND s.is_active = 1
+'''
+
+# One fixed statement per editable column: the text never varies, so each stays in the
+# connection's statement cache, and nothing outside this set can be spliced into SQL
+_SQL_PROFILE_UPDATES = {
+    field: f'UPDATE users SET {field} = ? WHERE id = ?'
+    for field in ('first_name', 'last_name', 'phone', 'email')
+}
+
+DB_TABLES = ('users', 'donations', 'supporters', 'user_stats', 'sessions', 'guest_tracking', 'support_tickets', 'admin_messages')
+# Every table's row count in one statement instead of one round-trip per table
+_SQL_TABLE_COUNTS = "SELECT " + ", ".join(f"(SELECT COUNT(*) FROM {table})" for table in DB_TABLES)
+
+STATS_FLUSH_INTERVAL = 5  # seconds between write-behind flushes of user_stats
+SESSION_CACHE_SIZE = 10_000
+SESSION_CACHE_TTL = 60    # seconds a verified session is trusted before re-checking SQLite
+STATS_CACHE_TTL = 30      # seconds the dashboard aggregates are reused across /start and /donate
+ADMIN_PAGE_SIZE = 10         # rows per page of the admin user/donation listings
+KEYSET_START = 2 ** 63 - 1   # above any rowid: the cursor for a listing's first page
+OPEN_TICKETS_CACHE_TTL = 30  # safety net; ticket writes invalidate the cached list directly
+TABLE_COUNTS_CACHE_TTL = 60  # /admin dbstats row counts; admins glance, they don't poll
+PROFILE_CACHE_TTL = 30
+LOGIN_MAX_ATTEMPTS = 5
+LOGIN_LOCKOUT_WINDOW = 1800 # seconds failed logins are remembered (matches the SQL '-30 minutes')
+GUEST_STATE_TTL = 3600      # how long a guest's counter stays in memory between DB syncs
+GUEST_FOLLOWUP_GAP = 7200   # seconds between follow-up registration reminders
+PURGE_INTERVAL = 3600       # seconds between sweeps of dead sessions and idle guests
+SCHEMA_VERSION = 1          # bump whenever init_db's DDL changes so existing files pick it up
+
+# Donation totals at which each supporter level starts; anything above zero is at least a supporter
+SUPPORTER_THRESHOLDS = (5, 10, 20, 50)
+SUPPORTER_LEVELS = ('supporter', 'bronze', 'silver', 'gold', 'platinum')
+
+SUPPORTER_LEVEL_LABELS = {
+    'supporter': "Supporter 💝",
+    'bronze': "Bronze 🥉",
+    'silver': "Silver 🥈",
+    'gold': "Gold 🥇",
+    'platinum': "Platinum 🏆",
+}
+
+def supporter_level_for(total_donated):
+    if total_donated <= 0:
+        return "none"
+    return SUPPORTER_LEVELS[bisect.bisect_right(SUPPORTER_THRESHOLDS, total_donated)]
+
 # ========================
 # COMPLETE USER DATABASE
 # ========================
@@ -142,244 +327,330 @@ class UserDB:
             self.db_file = "/tmp/starai_users.db"
         else:
             self.db_file = "starai_users.db"
+        self.pool = SQLitePool(self.db_file)
         self.init_db()
+        self.check_foreign_keys()
+        
+        # Write-behind buffer for user_stats counters and last_active touches
+        self._stats_buf = collections.Counter()
+        self._active_buf = set()
+        self._guest_pending = collections.Counter()
+        self._guest_state = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=GUEST_STATE_TTL)
+        self._stats_lock = threading.Lock()
+        
+        # Short-lived read caches for the per-message session check and /profile
+        self._session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+        self._profile_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+        self._stats_cache = TTLCache(maxsize=1, ttl=STATS_CACHE_TTL)
+        self._table_counts_cache = TTLCache(maxsize=1, ttl=TABLE_COUNTS_CACHE_TTL)
+        self._open_tickets_cache = TTLCache(maxsize=1, ttl=OPEN_TICKETS_CACHE_TTL)
+        # Failed-login counters live in Redis when configured, else here; SQLite is only written once an account locks
+        self._login_failures = TTLCache(maxsize=100_000, ttl=LOGIN_LOCKOUT_WINDOW)
+        self._cache_lock = threading.Lock()
+        
+        # telegram_id never changes for an account, so the PK lookup lives for the whole process
+        self._tg_to_uid = {}
+        
+        # scrypt runs in OpenSSL with the GIL released, so a couple of threads keep it off the event loop
+        self._kdf_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="kdf")
+        threading.Thread(target=self._stats_flush_loop, name="stats-flush", daemon=True).start()
+        threading.Thread(target=self._purge_loop, name="db-purge", daemon=True).start()
+        atexit.register(self.flush_user_stats)
+    
+    def check_foreign_keys(self):
+        """Report child rows written before foreign keys were enforced; they stay readable and updatable"""
+        try:
+            with self.pool.acquire() as conn:
+                violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+        except Exception as e:
+            logger.error(f"Foreign key check error: {e}")
+            return
+        
+        if violations:
+            orphans = collections.Counter(table for table, *_ in violations)
+            logger.warning(f"⚠️ Rows pointing at missing users: {dict(orphans)}")
     
     def init_db(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    phone TEXT,
-                    email TEXT,
-                    password_hash TEXT NOT NULL,
-                    salt TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1,
-                    is_verified BOOLEAN DEFAULT 0,
-                    verification_code TEXT,
-                    account_type TEXT DEFAULT 'free',
-                    api_key TEXT UNIQUE,
-                    profile_pic TEXT,
-                    login_attempts INTEGER DEFAULT 0,
-                    last_login_attempt TIMESTAMP,
-                    account_status TEXT DEFAULT 'active',
-                    reset_token TEXT,
-                    reset_token_expiry TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS support_tickets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    telegram_id INTEGER,
-                    username TEXT,
-                    first_name TEXT,
-                    issue TEXT,
-                    status TEXT DEFAULT 'open',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    resolved_at TIMESTAMP,
-                    admin_notes TEXT,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS admin_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    from_admin_id INTEGER,
-                    to_user_id INTEGER,
-                    message TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_read BOOLEAN DEFAULT 0,
-                    FOREIGN KEY (to_user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS donations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    username TEXT,
-                    first_name TEXT,
-                    amount REAL,
-                    status TEXT DEFAULT 'pending',
-                    transaction_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    verified_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS supporters (
-                    user_id INTEGER PRIMARY KEY,
-                    total_donated REAL DEFAULT 0,
-                    first_donation TIMESTAMP,
-                    last_donation TIMESTAMP,
-                    supporter_level TEXT DEFAULT 'none',
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_stats (
-                    user_id INTEGER PRIMARY KEY,
-                    images_created INTEGER DEFAULT 0,
-                    music_searches INTEGER DEFAULT 0,
-                    ai_chats INTEGER DEFAULT 0,
-                    commands_used INTEGER DEFAULT 0,
-                    total_messages INTEGER DEFAULT 0,
-                    last_active TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sessions (
-                    session_id TEXT PRIMARY KEY,
-                    user_id INTEGER,
-                    telegram_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS guest_tracking (
-                    telegram_id INTEGER PRIMARY KEY,
-                    message_count INTEGER DEFAULT 0,
-                    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_seen TIMESTAMP,
-                    reminder_sent BOOLEAN DEFAULT 0,
-                    reminder_count INTEGER DEFAULT 0,
-                    last_reminder TIMESTAMP
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"✅ Database initialized: {self.db_file}")
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('PRAGMA user_version')
+                if cursor.fetchone()[0] >= SCHEMA_VERSION:
+                    logger.info(f"✅ Database ready: {self.db_file} (schema v{SCHEMA_VERSION})")
+                    return
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        telegram_id INTEGER UNIQUE,
+                        username TEXT,
+                        first_name TEXT,
+                        last_name TEXT,
+                        phone TEXT,
+                        email TEXT,
+                        password_hash TEXT NOT NULL,
+                        salt TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_login TIMESTAMP,
+                        is_active BOOLEAN DEFAULT 1 CHECK (is_active IN (0, 1)),
+                        is_verified BOOLEAN DEFAULT 0 CHECK (is_verified IN (0, 1)),
+                        verification_code TEXT,
+                        account_type TEXT DEFAULT 'free' CHECK (account_type IN ('free', 'premium', 'admin')),
+                        api_key TEXT UNIQUE,
+                        profile_pic TEXT,
+                        login_attempts INTEGER DEFAULT 0,
+                        last_login_attempt TIMESTAMP,
+                        account_status TEXT DEFAULT 'active',
+                        reset_token TEXT,
+                        reset_token_expiry TIMESTAMP
+                    )
+                ''')
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS support_tickets (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        telegram_id INTEGER,
+                        username TEXT,
+                        first_name TEXT,
+                        issue TEXT,
+                        status TEXT DEFAULT 'open' CHECK (status IN ('open', 'in_progress', 'resolved', 'closed')),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        resolved_at TIMESTAMP,
+                        admin_notes TEXT,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS admin_messages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        from_admin_id INTEGER,
+                        to_user_id INTEGER,
+                        message TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        is_read BOOLEAN DEFAULT 0,
+                        FOREIGN KEY (to_user_id) REFERENCES users (id)
+                    )
+                ''')
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS donations (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        username TEXT,
+                        first_name TEXT,
+                        amount REAL,
+                        status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'verified')),
+                        transaction_id TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        verified_at TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS supporters (
+                        user_id INTEGER PRIMARY KEY,
+                        total_donated REAL DEFAULT 0,
+                        first_donation TIMESTAMP,
+                        last_donation TIMESTAMP,
+                        supporter_level TEXT DEFAULT 'none'
+                            CHECK (supporter_level IN ('none', 'supporter', 'bronze', 'silver', 'gold', 'platinum')),
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS user_stats (
+                        user_id INTEGER PRIMARY KEY,
+                        images_created INTEGER DEFAULT 0,
+                        music_searches INTEGER DEFAULT 0,
+                        ai_chats INTEGER DEFAULT 0,
+                        commands_used INTEGER DEFAULT 0,
+                        total_messages INTEGER DEFAULT 0,
+                        last_active TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS sessions (
+                        session_id TEXT PRIMARY KEY,
+                        user_id INTEGER,
+                        telegram_id INTEGER,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        expires_at TIMESTAMP,
+                        is_active BOOLEAN DEFAULT 1,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS guest_tracking (
+                        telegram_id INTEGER PRIMARY KEY,
+                        message_count INTEGER DEFAULT 0,
+                        first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_seen TIMESTAMP,
+                        reminder_sent BOOLEAN DEFAULT 0,
+                        reminder_count INTEGER DEFAULT 0,
+                        last_reminder TIMESTAMP
+                    )
+                ''')
+                
+                # Indexes for the hot lookups; session_id is already the sessions primary key
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id) WHERE is_active = 1')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_guests_last_seen ON guest_tracking(last_seen)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_reset ON users(reset_token) WHERE reset_token IS NOT NULL')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_donations_txn ON donations(transaction_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_donations_user ON donations(user_id, status)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_donations_status ON donations(status, amount)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_admin_msg_to ON admin_messages(to_user_id, created_at DESC)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_tickets_status ON support_tickets(status, created_at DESC)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_tickets_telegram ON support_tickets(telegram_id, created_at DESC)')
+                cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                
+                logger.info(f"✅ Database initialized: {self.db_file}")
         except Exception as e:
             logger.error(f"❌ Database error: {e}")
     
+    async def run_kdf(self, method, *args):
+        """Await a password-hashing UserDB call on the KDF pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._kdf_pool, method, *args)
+    
     def hash_password(self, password, salt=None):
+        """scrypt$n$r$p$<hex>; the cost parameters travel with the hash so they can be raised later"""
         if salt is None:
             salt = secrets.token_hex(16)
-        hash_obj = hashlib.sha256()
-        hash_obj.update((password + salt).encode('utf-8'))
-        return hash_obj.hexdigest(), salt
+        derived = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(salt),
+                                 n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=SCRYPT_DKLEN)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${derived.hex()}", salt
+    
+    def password_needs_rehash(self, stored_hash):
+        return not stored_hash.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
     
     def verify_password(self, stored_hash, stored_salt, password):
         if not stored_hash or not stored_salt:
             return False
+        if stored_hash.startswith("scrypt$"):
+            parts = stored_hash.split("$")
+            if len(parts) == 5:
+                n, r, p, expected = int(parts[1]), int(parts[2]), int(parts[3]), parts[4]
+            else:
+                # Unversioned scrypt$<hex> hashes: default cost, 64-byte key
+                n, r, p, expected = 2 ** 14, 8, 1, parts[1]
+            derived = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(stored_salt),
+                                     n=n, r=r, p=p, dklen=len(expected) // 2)
+            return hmac.compare_digest(derived.hex(), expected)
+        # Accounts created before scrypt: plain sha256(password + salt)
         hash_obj = hashlib.sha256()
         hash_obj.update((password + stored_salt).encode('utf-8'))
-        return hash_obj.hexdigest() == stored_hash
+        return hmac.compare_digest(hash_obj.hexdigest(), stored_hash)
     
     def create_user(self, telegram_id, username, first_name, last_name="", phone="", email="", password=""):
+        if not password or len(password) < 6:
+            return None, "Password must be at least 6 characters"
+        
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-            if cursor.fetchone():
-                conn.close()
-                return None, "User already exists"
-            
-            if not password or len(password) < 6:
-                return None, "Password must be at least 6 characters"
-            
+            # scrypt runs before BEGIN IMMEDIATE so it never holds SQLite's write lock
             password_hash, salt = self.hash_password(password)
-            api_key = secrets.token_urlsafe(32)
-            verification_code = secrets.token_urlsafe(8)
+            api_key = new_token(32)
+            verification_code = new_token(8)
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO users (telegram_id, username, first_name, last_name, phone, email, 
-                                  password_hash, salt, verification_code, api_key)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (telegram_id, username, first_name, last_name, phone, email, 
-                  password_hash, salt, verification_code, api_key))
-            
-            user_id = cursor.lastrowid
-            cursor.execute('INSERT INTO user_stats (user_id) VALUES (?)', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            return user_id, "Account created successfully"
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                
+                if self._user_id_for(cursor, telegram_id):
+                    return None, "User already exists"
+                
+                # UPSERT rather than REPLACE: with foreign keys on, REPLACE would delete the old row under its children
+                cursor.execute('''
+                    INSERT INTO users (telegram_id, username, first_name, last_name, phone, email, 
+                                      password_hash, salt, verification_code, api_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(telegram_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name,
+                        phone = excluded.phone,
+                        email = excluded.email,
+                        password_hash = excluded.password_hash,
+                        salt = excluded.salt,
+                        verification_code = excluded.verification_code,
+                        api_key = excluded.api_key
+                ''', (telegram_id, username, first_name, last_name, phone, email, 
+                      password_hash, salt, verification_code, api_key))
+                
+                # lastrowid is not set when the conflict branch updates an existing row
+                cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
+                user_id = cursor.fetchone()[0]
+                cursor.execute('INSERT INTO user_stats (user_id) VALUES (?) ON CONFLICT(user_id) DO NOTHING', (user_id,))
+                
+                with self._cache_lock:
+                    self._tg_to_uid[telegram_id] = user_id
+                
+                return user_id, "Account created successfully"
         except Exception as e:
             logger.error(f"Create user error: {e}")
             return None, str(e)
     
     def login_user(self, telegram_id, password):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, telegram_id, username, first_name, password_hash, salt, 
-                       account_type, is_active, is_verified, login_attempts, last_login_attempt
-                FROM users 
-                WHERE telegram_id = ?
-            ''', (telegram_id,))
-            
-            user = cursor.fetchone()
+            # Read the row and run scrypt (verify and any rehash) without holding the write lock
+            with self.pool.acquire() as conn:
+                user = conn.execute(_SQL_LOGIN_SELECT, (telegram_id,)).fetchone()
             
             if not user:
-                conn.close()
                 return None, "User not found. Please register first."
             
-            user_id, telegram_id, username, first_name, password_hash, salt, account_type, is_active, is_verified, login_attempts, last_login_attempt = user
+            user_id, telegram_id, username, first_name, password_hash, salt, account_type, is_active, is_verified, login_attempts, recently_failed = user
             
-            if login_attempts >= 5:
-                if last_login_attempt:
-                    last_attempt_time = datetime.strptime(last_login_attempt, '%Y-%m-%d %H:%M:%S')
-                    if datetime.now() < last_attempt_time + timedelta(minutes=30):
-                        conn.close()
-                        return None, "Account locked. Too many failed attempts. Try again in 30 minutes."
-                    else:
-                        cursor.execute('UPDATE users SET login_attempts = 0 WHERE id = ?', (user_id,))
-                        conn.commit()
+            if login_attempts >= LOGIN_MAX_ATTEMPTS and recently_failed:
+                return None, "Account locked. Too many failed attempts. Try again in 30 minutes."
             
             if not is_active:
-                conn.close()
                 return None, "Account is suspended"
             
             if not self.verify_password(password_hash, salt, password):
-                cursor.execute('''
-                    UPDATE users 
-                    SET login_attempts = login_attempts + 1, 
-                        last_login_attempt = CURRENT_TIMESTAMP 
-                    WHERE id = ?
-                ''', (user_id,))
-                conn.commit()
-                conn.close()
+                failures = self.count_login_failure(telegram_id)
+                if failures >= LOGIN_MAX_ATTEMPTS:
+                    with self.pool.transaction() as conn:
+                        conn.execute('''
+                            UPDATE users 
+                            SET login_attempts = ?, 
+                                last_login_attempt = CURRENT_TIMESTAMP 
+                            WHERE id = ?
+                        ''', (failures, user_id))
+                    self.clear_login_failures(telegram_id)
                 return None, "Incorrect password. Please try again."
             
-            cursor.execute('UPDATE users SET login_attempts = 0 WHERE id = ?', (user_id,))
-            
-            session_id = secrets.token_urlsafe(32)
-            expires_at = datetime.now() + timedelta(days=30)
-            
-            cursor.execute('''
-                INSERT INTO sessions (session_id, user_id, telegram_id, expires_at)
-                VALUES (?, ?, ?, ?)
-            ''', (session_id, user_id, telegram_id, expires_at))
+            self.clear_login_failures(telegram_id)
+            rehashed = self.hash_password(password) if self.password_needs_rehash(password_hash) else None
+            session_id = new_token(32)
             
-            cursor.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                
+                # A reset or password change may have landed while scrypt ran
+                cursor.execute('SELECT password_hash FROM users WHERE id = ? AND is_active = 1', (user_id,))
+                current = cursor.fetchone()
+                if not current or current[0] != password_hash:
+                    return None, "Your password was just changed. Please log in again."
+                
+                if login_attempts:
+                    cursor.execute('UPDATE users SET login_attempts = 0 WHERE id = ?', (user_id,))
+                
+                if rehashed:
+                    cursor.execute('UPDATE users SET password_hash = ?, salt = ? WHERE id = ?', (*rehashed, user_id))
+                
+                cursor.execute('''
+                    INSERT INTO sessions (session_id, user_id, telegram_id, expires_at)
+                    VALUES (?, ?, ?, datetime('now', '+30 days'))
+                ''', (session_id, user_id, telegram_id))
+                
+                cursor.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user_id,))
             
             user_data = {
                 'user_id': user_id,
@@ -397,545 +668,847 @@ class UserDB:
             return None, str(e)
     
     def verify_session(self, session_id):
+        with self._cache_lock:
+            cached = self._session_cache.get(session_id)
+        if cached:
+            self.touch_last_active(cached['user_id'])
+            return dict(cached), "Session valid"
+        
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT u.id, u.telegram_id, u.username, u.first_name, u.account_type,
-                       s.expires_at, s.is_active
-                FROM sessions s
-                JOIN users u ON s.user_id = u.id
-                WHERE s.session_id = ? AND u.is_active = 1 AND s.is_active = 1
-            ''', (session_id,))
-            
-            session = cursor.fetchone()
-            
-            if not session:
-                conn.close()
-                return None, "Invalid or expired session"
-            
-            user_id, telegram_id, username, first_name, account_type, expires_at, is_active = session
-            
-            if datetime.now() > datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S'):
-                cursor.execute('UPDATE sessions SET is_active = 0 WHERE session_id = ?', (session_id,))
-                conn.commit()
-                conn.close()
-                return None, "Session expired"
-            
-            cursor.execute('UPDATE user_stats SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?', (user_id,))
-            conn.commit()
-            conn.close()
-            
-            user_data = {
-                'user_id': user_id,
-                'telegram_id': telegram_id,
-                'username': username,
-                'first_name': first_name,
-                'account_type': account_type,
-                'session_id': session_id
-            }
-            
-            return user_data, "Session valid"
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(_SQL_SESSION_SELECT, (session_id,))
+                
+                session = cursor.fetchone()
+                
+                if not session:
+                    return None, "Invalid or expired session"
+                
+                user_id, telegram_id, username, first_name, account_type, is_current = session
+                
+                if not is_current:
+                    cursor.execute('UPDATE sessions SET is_active = 0 WHERE session_id = ?', (session_id,))
+                    return None, "Session expired"
+                
+                self.touch_last_active(user_id)
+                
+                user_data = {
+                    'user_id': user_id,
+                    'telegram_id': telegram_id,
+                    'username': username,
+                    'first_name': first_name,
+                    'account_type': account_type,
+                    'session_id': session_id
+                }
+                
+                with self._cache_lock:
+                    self._session_cache[session_id] = dict(user_data)
+                return user_data, "Session valid"
         except Exception as e:
             logger.error(f"Session verify error: {e}")
             return None, str(e)
     
     def logout_user(self, session_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('UPDATE sessions SET is_active = 0 WHERE session_id = ?', (session_id,))
-            conn.commit()
-            conn.close()
-            return True, "Logged out successfully"
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                cursor.execute('UPDATE sessions SET is_active = 0 WHERE session_id = ?', (session_id,))
+                with self._cache_lock:
+                    self._session_cache.pop(session_id, None)
+                return True, "Logged out successfully"
         except Exception as e:
             logger.error(f"Logout error: {e}")
             return False, str(e)
     
     def get_user_profile(self, user_id):
+        with self._cache_lock:
+            cached = self._profile_cache.get(user_id)
+        if cached:
+            return self._with_pending_stats(dict(cached))
+        
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT u.id, u.telegram_id, u.username, u.first_name, u.last_name, 
-                       u.phone, u.email, u.created_at, u.account_type, u.is_verified,
-                       s.total_donated, s.supporter_level,
-                       st.images_created, st.music_searches, st.ai_chats, st.commands_used, st.total_messages
-                FROM users u
-                LEFT JOIN supporters s ON u.id = s.user_id
-                LEFT JOIN user_stats st ON u.id = st.user_id
-                WHERE u.id = ?
-            ''', (user_id,))
-            
-            user = cursor.fetchone()
-            conn.close()
-            
-            if not user:
-                return None
-            
-            profile = {
-                'id': user[0],
-                'telegram_id': user[1],
-                'username': user[2],
-                'first_name': user[3],
-                'last_name': user[4],
-                'phone': user[5],
-                'email': user[6],
-                'created_at': user[7],
-                'account_type': user[8],
-                'is_verified': bool(user[9]),
-                'total_donated': user[10] or 0,
-                'supporter_level': user[11] or 'none',
-                'images_created': user[12] or 0,
-                'music_searches': user[13] or 0,
-                'ai_chats': user[14] or 0,
-                'commands_used': user[15] or 0,
-                'total_messages': user[16] or 0
-            }
-            
-            return profile
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                
+                cursor.execute('''
+                    SELECT u.id AS id, u.telegram_id AS telegram_id, u.username AS username,
+                           u.first_name AS first_name, u.last_name AS last_name,
+                           u.phone AS phone, u.email AS email, u.created_at AS created_at,
+                           u.account_type AS account_type, u.is_verified AS is_verified,
+                           COALESCE(s.total_donated, 0) AS total_donated,
+                           COALESCE(s.supporter_level, 'none') AS supporter_level,
+                           COALESCE(st.images_created, 0) AS images_created,
+                           COALESCE(st.music_searches, 0) AS music_searches,
+                           COALESCE(st.ai_chats, 0) AS ai_chats,
+                           COALESCE(st.commands_used, 0) AS commands_used,
+                           COALESCE(st.total_messages, 0) AS total_messages
+                    FROM users u
+                    LEFT JOIN supporters s ON u.id = s.user_id
+                    LEFT JOIN user_stats st ON u.id = st.user_id
+                    WHERE u.id = ?
+                ''', (user_id,))
+                
+                user = cursor.fetchone()
+                
+                if not user:
+                    return None
+                
+                profile = dict(user)
+                profile['is_verified'] = bool(profile['is_verified'])
+                
+                with self._cache_lock:
+                    self._profile_cache[user_id] = dict(profile)
+                return self._with_pending_stats(profile)
         except Exception as e:
             logger.error(f"Get profile error: {e}")
             return None
     
-    def update_user_stats(self, user_id, stat_type):
+    def _with_pending_stats(self, profile):
+        """Add increments still sitting in the write-behind buffer, so reads never force a flush"""
+        with self._stats_lock:
+            for field in USER_STAT_FIELDS:
+                profile[field] += self._stats_buf.get((profile['id'], field), 0)
+        return profile
+    
+    def update_user_stats(self, user_id, *stat_types):
+        """Buffer one increment per stat in memory; flush_user_stats writes them out in batches"""
+        if not all(stat_type in USER_STAT_FIELDS for stat_type in stat_types):
+            return False
+        with self._stats_lock:
+            for stat_type in stat_types:
+                self._stats_buf[(user_id, stat_type)] += 1
+        return True
+    
+    def touch_last_active(self, user_id):
+        with self._stats_lock:
+            self._active_buf.add(user_id)
+    
+    def flush_user_stats(self):
+        with self._stats_lock:
+            pending, self._stats_buf = self._stats_buf, collections.Counter()
+            active, self._active_buf = self._active_buf, set()
+            guests, self._guest_pending = self._guest_pending, collections.Counter()
+        if not pending and not active and not guests:
+            return
+        
+        # Group by column in one pass, outside the write transaction
+        by_field = collections.defaultdict(list)
+        for (user_id, stat_type), count in pending.items():
+            by_field[stat_type].append((count, user_id))
+        
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            stat_fields = {
-                'images_created': 'images_created',
-                'music_searches': 'music_searches',
-                'ai_chats': 'ai_chats',
-                'commands_used': 'commands_used',
-                'total_messages': 'total_messages'
-            }
-            
-            if stat_type in stat_fields:
-                field = stat_fields[stat_type]
-                cursor.execute(f'UPDATE user_stats SET {field} = {field} + 1 WHERE user_id = ?', (user_id,))
-                conn.commit()
-            
-            conn.close()
-            return True
+            with self.pool.transaction() as conn:
+                for field, rows in by_field.items():
+                    conn.executemany(_SQL_STAT_INCREMENT[field], rows)
+                if active:
+                    conn.executemany(_SQL_TOUCH_ACTIVE, [(user_id,) for user_id in active])
+                if guests:
+                    conn.executemany(_SQL_GUEST_MESSAGES, [(count, telegram_id) for telegram_id, count in guests.items()])
+            
+            for user_id in {user_id for user_id, _ in pending}:
+                self.invalidate_profile(user_id)
         except Exception as e:
-            logger.error(f"Update stats error: {e}")
-            return False
+            logger.error(f"Flush stats error: {e}")
+            with self._stats_lock:
+                self._stats_buf.update(pending)
+                self._active_buf.update(active)
+                self._guest_pending.update(guests)
+    
+    def _user_id_for(self, cursor, telegram_id):
+        """Translate a telegram_id to users.id, hitting SQLite only on first sight"""
+        with self._cache_lock:
+            user_id = self._tg_to_uid.get(telegram_id)
+        if user_id:
+            return user_id
+        
+        cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
+        user = cursor.fetchone()
+        if not user:
+            return None
+        
+        with self._cache_lock:
+            self._tg_to_uid[telegram_id] = user[0]
+        return user[0]
+    
+    def get_user_id(self, telegram_id):
+        # Known users are a dict hit; don't check out a pooled connection for them
+        with self._cache_lock:
+            user_id = self._tg_to_uid.get(telegram_id)
+        if user_id:
+            return user_id
+        
+        try:
+            with self.pool.acquire() as conn:
+                return self._user_id_for(conn.cursor(), telegram_id)
+        except Exception as e:
+            logger.error(f"Get user id error: {e}")
+            return None
+    
+    def user_exists(self, telegram_id):
+        return self.get_user_id(telegram_id) is not None
+    
+    def count_login_failure(self, telegram_id):
+        """Add a failed login and return the count; Redis shares it across processes and restarts.
+        The window is fixed from the first failure: later failures never extend it."""
+        if redis_sync_client:
+            key = f"login_fail:{telegram_id}"
+            try:
+                with redis_sync_client.pipeline() as pipe:
+                    pipe.set(key, 0, nx=True, ex=LOGIN_LOCKOUT_WINDOW)
+                    pipe.incr(key)
+                    _, failures = pipe.execute()
+                return failures
+            except Exception as e:
+                logger.error(f"Login failure counter error: {e}")
+        
+        with self._cache_lock:
+            # Mutate in place: re-assigning would restart the TTLCache expiry
+            counter = self._login_failures.get(telegram_id)
+            if counter is None:
+                counter = self._login_failures[telegram_id] = [0]
+            counter[0] += 1
+            return counter[0]
+    
+    def clear_login_failures(self, telegram_id):
+        if redis_sync_client:
+            try:
+                redis_sync_client.delete(f"login_fail:{telegram_id}")
+            except Exception as e:
+                logger.error(f"Login failure counter error: {e}")
+        with self._cache_lock:
+            self._login_failures.pop(telegram_id, None)
+    
+    def invalidate_stats(self):
+        with self._cache_lock:
+            self._stats_cache.clear()
+    
+    def invalidate_open_tickets(self):
+        with self._cache_lock:
+            self._open_tickets_cache.clear()
+    
+    def invalidate_profile(self, user_id):
+        with self._cache_lock:
+            self._profile_cache.pop(user_id, None)
+    
+    def invalidate_user_sessions(self, user_id):
+        """Drop every cached session of a user (ban, password change/reset, deletion)"""
+        with self._cache_lock:
+            for session_id, cached in list(self._session_cache.items()):
+                if cached['user_id'] == user_id:
+                    self._session_cache.pop(session_id, None)
+    
+    def _stats_flush_loop(self):
+        while True:
+            time.sleep(STATS_FLUSH_INTERVAL)
+            self.flush_user_stats()
+    
+    def purge_stale_rows(self):
+        """Delete dead sessions and guests idle for 30 days so the hot tables stay small"""
+        try:
+            with self.pool.transaction() as conn:
+                sessions = conn.execute('''
+                    DELETE FROM sessions
+                    WHERE is_active = 0 OR expires_at < datetime('now', '-1 day')
+                ''').rowcount
+                guests = conn.execute(
+                    "DELETE FROM guest_tracking WHERE last_seen < datetime('now', '-30 days')"
+                ).rowcount
+            if sessions or guests:
+                logger.info(f"🧹 Purged {sessions} sessions and {guests} idle guests")
+        except Exception as e:
+            logger.error(f"Purge stale rows error: {e}")
+    
+    def _purge_loop(self):
+        while True:
+            time.sleep(PURGE_INTERVAL)
+            self.purge_stale_rows()
     
     def track_guest_activity(self, telegram_id):
         """Track guest activity and send reminders to register"""
+        with self._stats_lock:
+            guest = self._guest_state.get(telegram_id)
+            if guest:
+                guest['count'] += 1
+                self._guest_pending[telegram_id] += 1
+                if not self._guest_reminder_due(guest):
+                    return False, "no_reminder"
+            else:
+                self._guest_pending[telegram_id] += 1
+            delta = self._guest_pending.pop(telegram_id)
+        
+        # New to this process or a reminder threshold was crossed: settle with SQLite
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT message_count, reminder_sent, reminder_count, last_reminder FROM guest_tracking WHERE telegram_id = ?', (telegram_id,))
-            guest = cursor.fetchone()
-            
-            if not guest:
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
                 cursor.execute('''
                     INSERT INTO guest_tracking (telegram_id, message_count, last_seen, reminder_sent, reminder_count)
-                    VALUES (?, 1, CURRENT_TIMESTAMP, 0, 0)
-                ''', (telegram_id,))
-                conn.commit()
-                conn.close()
-                return False, "first_message"
-            else:
-                message_count, reminder_sent, reminder_count, last_reminder = guest
-                message_count += 1
+                    VALUES (?, ?, CURRENT_TIMESTAMP, 0, 0)
+                    ON CONFLICT(telegram_id) DO UPDATE SET
+                        message_count = message_count + excluded.message_count,
+                        last_seen = CURRENT_TIMESTAMP
+                    RETURNING message_count, reminder_sent, reminder_count,
+                              CAST((julianday('now') - julianday(last_reminder)) * 86400 AS INTEGER)
+                ''', (telegram_id, delta))
+                message_count, reminder_sent, reminder_count, since_reminder = cursor.fetchone()
                 
-                # Calculate if enough time has passed since last reminder
-                can_remind_again = True
-                if last_reminder:
-                    last_reminder_time = datetime.strptime(last_reminder, '%Y-%m-%d %H:%M:%S')
-                    if datetime.now() < last_reminder_time + timedelta(hours=2):
-                        can_remind_again = False
+                guest = {
+                    'count': message_count,
+                    'reminder_sent': reminder_sent,
+                    'reminder_count': reminder_count,
+                    'next_followup': time.time() + (GUEST_FOLLOWUP_GAP - since_reminder if since_reminder is not None else 0),
+                }
                 
-                should_remind = False
-                reminder_type = None
+                if message_count == 1:
+                    self._remember_guest(telegram_id, guest)
+                    return False, "first_message"
                 
-                if not reminder_sent and message_count >= 3:
-                    should_remind = True
-                    reminder_type = "first"
-                elif reminder_sent and reminder_count < 5 and message_count >= 8 and can_remind_again:
-                    should_remind = True
-                    reminder_type = "followup"
+                should_remind = self._guest_reminder_due(guest)
+                reminder_type = "followup" if reminder_sent else "first"
                 
                 if should_remind:
                     cursor.execute('''
                         UPDATE guest_tracking 
-                        SET message_count = ?, last_seen = CURRENT_TIMESTAMP, 
-                            reminder_sent = 1, reminder_count = reminder_count + 1,
+                        SET reminder_sent = 1, reminder_count = reminder_count + 1,
                             last_reminder = CURRENT_TIMESTAMP
                         WHERE telegram_id = ?
-                    ''', (message_count, telegram_id))
-                    conn.commit()
-                    conn.close()
-                    return True, reminder_type
-                else:
-                    cursor.execute('''
-                        UPDATE guest_tracking 
-                        SET message_count = ?, last_seen = CURRENT_TIMESTAMP 
-                        WHERE telegram_id = ?
-                    ''', (message_count, telegram_id))
-                    conn.commit()
-                    conn.close()
-                    return False, "no_reminder"
+                    ''', (telegram_id,))
+                    guest.update(reminder_sent=1, reminder_count=reminder_count + 1,
+                                 next_followup=time.time() + GUEST_FOLLOWUP_GAP)
+                
+                self._remember_guest(telegram_id, guest)
+                return (True, reminder_type) if should_remind else (False, "no_reminder")
         except Exception as e:
             logger.error(f"Track guest activity error: {e}")
+            with self._stats_lock:
+                self._guest_pending[telegram_id] += delta
             return False, "error"
     
+    def _guest_reminder_due(self, guest):
+        if not guest['reminder_sent']:
+            return guest['count'] >= 3
+        return guest['reminder_count'] < 5 and guest['count'] >= 8 and time.time() >= guest['next_followup']
+    
+    def _remember_guest(self, telegram_id, guest):
+        with self._stats_lock:
+            guest['count'] += self._guest_pending.get(telegram_id, 0)
+            self._guest_state[telegram_id] = guest
+    
+    def forget_guest(self, telegram_id):
+        with self._stats_lock:
+            self._guest_state.pop(telegram_id, None)
+            self._guest_pending.pop(telegram_id, None)
+    
     def reset_guest_tracking(self, telegram_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM guest_tracking WHERE telegram_id = ?', (telegram_id,))
-            conn.commit()
-            conn.close()
-            return True
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM guest_tracking WHERE telegram_id = ?', (telegram_id,))
+                self.forget_guest(telegram_id)
+                return True
         except Exception as e:
             logger.error(f"Reset guest tracking error: {e}")
             return False
     
     def generate_reset_token(self, telegram_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-            user = cursor.fetchone()
-            
-            if not user:
-                conn.close()
-                return None, "User not found"
-            
-            reset_token = secrets.token_urlsafe(32)
-            expiry = datetime.now() + timedelta(hours=24)
-            
-            cursor.execute('''
-                UPDATE users 
-                SET reset_token = ?, reset_token_expiry = ?
-                WHERE telegram_id = ?
-            ''', (reset_token, expiry, telegram_id))
-            
-            conn.commit()
-            conn.close()
-            return reset_token, "Reset token generated"
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                if not self._user_id_for(cursor, telegram_id):
+                    return None, "User not found"
+                
+                reset_token = new_token(32)
+                
+                cursor.execute('''
+                    UPDATE users 
+                    SET reset_token = ?, reset_token_expiry = datetime('now', '+24 hours')
+                    WHERE telegram_id = ?
+                ''', (reset_token, telegram_id))
+                
+                return reset_token, "Reset token generated"
         except Exception as e:
             logger.error(f"Reset token error: {e}")
             return None, str(e)
     
     def verify_reset_token(self, reset_token):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT telegram_id, reset_token_expiry FROM users WHERE reset_token = ?', (reset_token,))
-            result = cursor.fetchone()
-            
-            if not result:
-                conn.close()
-                return None, "Invalid reset token"
-            
-            telegram_id, expiry = result
-            
-            if datetime.now() > datetime.strptime(expiry, '%Y-%m-%d %H:%M:%S'):
-                conn.close()
-                return None, "Reset token expired"
-            
-            conn.close()
-            return telegram_id, "Token valid"
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT telegram_id, reset_token_expiry > datetime('now')
+                    FROM users WHERE reset_token = ?
+                ''', (reset_token,))
+                result = cursor.fetchone()
+                
+                if not result:
+                    return None, "Invalid reset token"
+                
+                telegram_id, is_current = result
+                
+                if not is_current:
+                    return None, "Reset token expired"
+                
+                return telegram_id, "Token valid"
         except Exception as e:
             logger.error(f"Verify reset token error: {e}")
             return None, str(e)
     
     def reset_password(self, telegram_id, new_password):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
             password_hash, salt = self.hash_password(new_password)
             
-            cursor.execute('''
-                UPDATE users 
-                SET password_hash = ?, salt = ?, reset_token = NULL, reset_token_expiry = NULL, login_attempts = 0
-                WHERE telegram_id = ?
-            ''', (password_hash, salt, telegram_id))
-            
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE users 
+                    SET password_hash = ?, salt = ?, reset_token = NULL, reset_token_expiry = NULL, login_attempts = 0
+                    WHERE telegram_id = ?
+                ''', (password_hash, salt, telegram_id))
+                user_id = self._user_id_for(cursor, telegram_id)
+                if user_id:
+                    self._end_sessions(cursor, user_id)
+            
+            # After COMMIT; the Redis round-trip stays off the pooled connection
+            if user_id:
+                self.invalidate_user_sessions(user_id)
+            self.clear_login_failures(telegram_id)
             return True, "Password reset successful"
         except Exception as e:
             logger.error(f"Reset password error: {e}")
             return False, str(e)
     
+    def _end_sessions(self, cursor, user_id, keep_session_id=None):
+        """Deactivate a user's sessions in SQLite after a password change; the caller drops the cache after COMMIT"""
+        cursor.execute('UPDATE sessions SET is_active = 0 WHERE user_id = ? AND session_id IS NOT ?', (user_id, keep_session_id))
+    
     def create_support_ticket(self, telegram_id, username, first_name, issue):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-            user = cursor.fetchone()
-            user_id = user[0] if user else None
-            
-            cursor.execute('''
-                INSERT INTO support_tickets (user_id, telegram_id, username, first_name, issue)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, telegram_id, username, first_name, issue))
-            
-            ticket_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            return ticket_id, "Support ticket created"
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                user_id = self._user_id_for(cursor, telegram_id)
+                
+                cursor.execute('''
+                    INSERT INTO support_tickets (user_id, telegram_id, username, first_name, issue)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, telegram_id, username, first_name, issue))
+                
+                ticket_id = cursor.lastrowid
+                self.invalidate_open_tickets()
+                return ticket_id, "Support ticket created"
         except Exception as e:
             logger.error(f"Create support ticket error: {e}")
             return None, str(e)
     
     def get_open_tickets(self):
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, user_id, telegram_id, username, first_name, issue, created_at
-                FROM support_tickets 
-                WHERE status = 'open'
-                ORDER BY created_at DESC
-            ''')
-            
-            tickets = cursor.fetchall()
-            conn.close()
+        with self._cache_lock:
+            tickets = self._open_tickets_cache.get("tickets")
+        if tickets is not None:
             return tickets
+        
+        try:
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT id, user_id, telegram_id, username, first_name, issue, created_at
+                    FROM support_tickets 
+                    WHERE status = 'open'
+                    ORDER BY created_at DESC
+                ''')
+                
+                tickets = cursor.fetchall()
+                with self._cache_lock:
+                    self._open_tickets_cache["tickets"] = tickets
+                return tickets
         except Exception as e:
             logger.error(f"Get open tickets error: {e}")
             return []
     
     def update_ticket_status(self, ticket_id, status, admin_notes=""):
+        return self.update_ticket_statuses([(status, admin_notes, ticket_id)])
+    
+    def update_ticket_statuses(self, items):
+        """Bulk update: items are (status, admin_notes, ticket_id) rows, applied in one transaction"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE support_tickets 
-                SET status = ?, resolved_at = CURRENT_TIMESTAMP, admin_notes = ?
-                WHERE id = ?
-            ''', (status, admin_notes, ticket_id))
+            with self.pool.transaction() as conn:
+                conn.executemany('''
+                    UPDATE support_tickets 
+                    SET status = ?, resolved_at = CURRENT_TIMESTAMP, admin_notes = ?
+                    WHERE id = ?
+                ''', items)
             
-            conn.commit()
-            conn.close()
+            self.invalidate_open_tickets()
             return True
         except Exception as e:
             logger.error(f"Update ticket status error: {e}")
             return False
     
     def send_admin_message(self, from_admin_id, to_user_id, message):
+        return self.send_admin_messages([(from_admin_id, to_user_id, message)])
+    
+    def send_admin_messages(self, rows):
+        """Bulk insert: rows are (from_admin_id, to_user_id, message), applied in one transaction"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO admin_messages (from_admin_id, to_user_id, message)
-                VALUES (?, ?, ?)
-            ''', (from_admin_id, to_user_id, message))
-            
-            conn.commit()
-            conn.close()
-            return True
+            with self.pool.transaction() as conn:
+                conn.executemany('''
+                    INSERT INTO admin_messages (from_admin_id, to_user_id, message)
+                    VALUES (?, ?, ?)
+                ''', rows)
+                
+                return True
         except Exception as e:
             logger.error(f"Send admin message error: {e}")
             return False
     
     def get_user_messages(self, user_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, from_admin_id, message, created_at, is_read
-                FROM admin_messages 
-                WHERE to_user_id = ?
-                ORDER BY created_at DESC
-                LIMIT 10
-            ''', (user_id,))
-            
-            messages = cursor.fetchall()
-            conn.close()
-            return messages
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT id, from_admin_id, message, created_at, is_read
+                    FROM admin_messages 
+                    WHERE to_user_id = ?
+                    ORDER BY created_at DESC
+                    LIMIT 10
+                ''', (user_id,))
+                
+                messages = cursor.fetchall()
+                return messages
         except Exception as e:
             logger.error(f"Get user messages error: {e}")
             return []
     
     def add_donation(self, user_id, username, first_name, amount, transaction_id=""):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO donations (user_id, username, first_name, amount, transaction_id)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, username, first_name, amount, transaction_id))
-            
-            conn.commit()
-            conn.close()
-            return True
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO donations (user_id, username, first_name, amount, transaction_id)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, username, first_name, amount, transaction_id))
+                
+                return True
         except Exception as e:
             logger.error(f"❌ Add donation error: {e}")
             return False
     
     def verify_donation(self, transaction_id):
+        return transaction_id in self.verify_donations([transaction_id])
+    
+    def verify_donations(self, transaction_ids):
+        """Verify several transaction IDs in one transaction; returns the IDs that matched a donation"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT user_id, amount FROM donations WHERE transaction_id = ?', (transaction_id,))
-            donation = cursor.fetchone()
-            
-            if donation:
-                user_id, amount = donation
-                
-                cursor.execute('UPDATE donations SET status = "verified", verified_at = CURRENT_TIMESTAMP WHERE transaction_id = ?', (transaction_id,))
-                
-                cursor.execute('SELECT COALESCE(SUM(amount), 0) FROM donations WHERE user_id = ? AND status = "verified"', (user_id,))
-                total_donated = cursor.fetchone()[0]
-                
-                supporter_level = "none"
-                if total_donated >= 50:
-                    supporter_level = "platinum"
-                elif total_donated >= 20:
-                    supporter_level = "gold"
-                elif total_donated >= 10:
-                    supporter_level = "silver"
-                elif total_donated >= 5:
-                    supporter_level = "bronze"
-                elif total_donated > 0:
-                    supporter_level = "supporter"
-                
-                cursor.execute('SELECT * FROM supporters WHERE user_id = ?', (user_id,))
-                supporter = cursor.fetchone()
-                
-                if supporter:
-                    cursor.execute('''
-                        UPDATE supporters 
-                        SET total_donated = ?, last_donation = CURRENT_TIMESTAMP, supporter_level = ?
-                        WHERE user_id = ?
-                    ''', (total_donated, supporter_level, user_id))
-                else:
-                    cursor.execute('''
-                        INSERT INTO supporters (user_id, total_donated, first_donation, last_donation, supporter_level)
-                        VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?)
-                    ''', (user_id, total_donated, supporter_level))
-                
-                if total_donated >= 10:
-                    cursor.execute('UPDATE users SET account_type = "premium" WHERE id = ?', (user_id,))
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                verified = []
+                touched_users = set()
                 
-                conn.commit()
-                conn.close()
-                return True
+                for transaction_id in transaction_ids:
+                    user_id = self._apply_donation_verification(cursor, transaction_id)
+                    if user_id is not None:
+                        verified.append(transaction_id)
+                        touched_users.add(user_id)
+            
+            # After COMMIT, so no reader can re-cache the pre-verification rows
+            for user_id in touched_users:
+                self.invalidate_profile(user_id)
+                self.invalidate_user_sessions(user_id)
+            if touched_users:
+                self.invalidate_stats()
+            
+            return verified
         except Exception as e:
             logger.error(f"❌ Verify donation error: {e}")
-        return False
+        return []
+    
+    def _apply_donation_verification(self, cursor, transaction_id):
+        """Mark one donation verified and refresh its supporter row; returns the donor's user_id"""
+        cursor.execute('SELECT user_id, amount FROM donations WHERE transaction_id = ?', (transaction_id,))
+        donation = cursor.fetchone()
+        
+        if not donation:
+            return None
+        
+        user_id, amount = donation
+        
+        cursor.execute('UPDATE donations SET status = "verified", verified_at = CURRENT_TIMESTAMP WHERE transaction_id = ?', (transaction_id,))
+        
+        cursor.execute('SELECT COALESCE(SUM(amount), 0) FROM donations WHERE user_id = ? AND status = "verified"', (user_id,))
+        total_donated = cursor.fetchone()[0]
+        
+        supporter_level = supporter_level_for(total_donated)
+        
+        cursor.execute('''
+            INSERT INTO supporters (user_id, total_donated, first_donation, last_donation, supporter_level)
+            VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                total_donated = excluded.total_donated,
+                last_donation = CURRENT_TIMESTAMP,
+                supporter_level = excluded.supporter_level
+        ''', (user_id, total_donated, supporter_level))
+        
+        if total_donated >= 10:
+            cursor.execute('UPDATE users SET account_type = "premium" WHERE id = ?', (user_id,))
+        
+        return user_id
     
     def get_user_donations(self, user_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM donations WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
-            rows = cursor.fetchall()
-            conn.close()
-            
-            donations = []
-            for row in rows:
-                donations.append({
-                    "id": row[0],
-                    "amount": row[4],
-                    "status": row[5],
-                    "transaction_id": row[6],
-                    "created_at": row[7],
-                    "verified_at": row[8]
-                })
-            return donations
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT id, amount, status, transaction_id, created_at, verified_at
+                    FROM donations WHERE user_id = ? ORDER BY created_at DESC
+                ''', (user_id,))
+                rows = cursor.fetchall()
+                
+                donations = []
+                for row in rows:
+                    donations.append({
+                        "id": row[0],
+                        "amount": row[1],
+                        "status": row[2],
+                        "transaction_id": row[3],
+                        "created_at": row[4],
+                        "verified_at": row[5]
+                    })
+                return donations
         except Exception as e:
             logger.error(f"❌ Get donations error: {e}")
             return []
     
+    def get_donation_summary(self, user_id):
+        """(donations, total) for /mydonations in one statement instead of two round-trips"""
+        try:
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT
+                        (SELECT total_donated FROM supporters WHERE user_id = ?1),
+                        (SELECT json_group_array(json_object(
+                                    'id', id, 'amount', amount, 'status', status,
+                                    'transaction_id', transaction_id,
+                                    'created_at', created_at, 'verified_at', verified_at))
+                         FROM (SELECT id, amount, status, transaction_id, created_at, verified_at
+                               FROM donations WHERE user_id = ?1 ORDER BY created_at DESC))
+                ''', (user_id,))
+                total, donations_json = cursor.fetchone()
+                return orjson.loads(donations_json), total or 0
+        except Exception as e:
+            logger.error(f"❌ Get donation summary error: {e}")
+            return [], 0
+    
     def get_user_total(self, user_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT total_donated FROM supporters WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result[0] if result else 0
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('SELECT total_donated FROM supporters WHERE user_id = ?', (user_id,))
+                result = cursor.fetchone()
+                return result[0] if result else 0
         except Exception as e:
             logger.error(f"❌ Get total error: {e}")
             return 0
     
     def get_stats(self):
+        with self._cache_lock:
+            stats = self._stats_cache.get("stats")
+        if stats is not None:
+            return stats
+        
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT SUM(amount) FROM donations WHERE status = "verified"')
-            total_verified = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT SUM(amount) FROM donations WHERE status = "pending"')
-            total_pending = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT COUNT(*) FROM supporters WHERE total_donated > 0')
-            supporters = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT COUNT(*) FROM guest_tracking')
-            active_guests = cursor.fetchone()[0] or 0
-            
-            conn.close()
-            return {
-                "total_verified": total_verified,
-                "total_pending": total_pending,
-                "supporters": supporters,
-                "total_users": total_users,
-                "active_guests": active_guests
-            }
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                # Both donation sums come from one pass over donations
+                cursor.execute('''
+                    WITH d AS (
+                        SELECT COALESCE(SUM(CASE WHEN status = 'verified' THEN amount END), 0) AS verified,
+                               COALESCE(SUM(CASE WHEN status = 'pending' THEN amount END), 0) AS pending
+                        FROM donations
+                    )
+                    SELECT
+                        d.verified,
+                        d.pending,
+                        (SELECT COUNT(*) FROM supporters WHERE total_donated > 0),
+                        (SELECT COUNT(*) FROM users),
+                        (SELECT COUNT(*) FROM guest_tracking)
+                    FROM d
+                ''')
+                total_verified, total_pending, supporters, total_users, active_guests = cursor.fetchone()
+                
+                stats = {
+                    "total_verified": total_verified,
+                    "total_pending": total_pending,
+                    "supporters": supporters,
+                    "total_users": total_users,
+                    "active_guests": active_guests
+                }
+                with self._cache_lock:
+                    self._stats_cache["stats"] = stats
+                return stats
         except Exception as e:
             logger.error(f"❌ Get stats error: {e}")
             return {"total_verified": 0, "total_pending": 0, "supporters": 0, "total_users": 0, "active_guests": 0}
     
+    def get_user_email(self, telegram_id):
+        try:
+            with self.pool.acquire() as conn:
+                row = conn.execute('SELECT email FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Get user email error: {e}")
+            return None
+    
+    def get_user_tickets(self, telegram_id, limit=5):
+        try:
+            with self.pool.acquire() as conn:
+                return conn.execute('''
+                    SELECT id, issue, status, created_at, admin_notes
+                    FROM support_tickets 
+                    WHERE telegram_id = ?
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                ''', (telegram_id, limit)).fetchall()
+        except Exception as e:
+            logger.error(f"Get user tickets error: {e}")
+            return []
+    
+    def get_ticket(self, ticket_id):
+        try:
+            with self.pool.acquire() as conn:
+                return conn.execute('''
+                    SELECT id, issue, status, created_at, resolved_at, admin_notes
+                    FROM support_tickets 
+                    WHERE id = ?
+                ''', (ticket_id,)).fetchone()
+        except Exception as e:
+            logger.error(f"Get ticket error: {e}")
+            return None
+    
+    def get_guest_message_count(self, telegram_id):
+        try:
+            with self.pool.acquire() as conn:
+                row = conn.execute('SELECT message_count FROM guest_tracking WHERE telegram_id = ?', (telegram_id,)).fetchone()
+                return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Get guest message count error: {e}")
+            return 0
+    
+    def list_users(self, limit=ADMIN_PAGE_SIZE, before_id=None):
+        """Admin: (users at or past the cursor, newest page of them); keyset-paged on the rowid"""
+        with self.pool.acquire() as conn:
+            rows = conn.execute('''
+                SELECT id, telegram_id, username, first_name, email, 
+                       created_at, account_type, is_active, COUNT(*) OVER ()
+                FROM users 
+                WHERE id < ?
+                ORDER BY id DESC 
+                LIMIT ?
+            ''', (before_id or KEYSET_START, limit)).fetchall()
+            
+            return (rows[0][-1] if rows else 0), [row[:-1] for row in rows]
+    
+    def search_users(self, search_query, limit=20):
+        """Admin: users whose username, first name or email contains search_query"""
+        pattern = f"%{search_query}%"
+        with self.pool.acquire() as conn:
+            return conn.execute('''
+                SELECT id, telegram_id, username, first_name, email, created_at, is_active
+                FROM users 
+                WHERE username LIKE ? OR first_name LIKE ? OR email LIKE ?
+                ORDER BY created_at DESC 
+                LIMIT ?
+            ''', (pattern, pattern, pattern, limit)).fetchall()
+    
+    def list_donations(self, limit=ADMIN_PAGE_SIZE, before_id=None):
+        """Admin: (donations at or past the cursor, newest page of them with donor names)"""
+        with self.pool.acquire() as conn:
+            rows = conn.execute('''
+                SELECT d.id, d.user_id, u.first_name, u.username, 
+                       d.amount, d.status, d.transaction_id, d.created_at, COUNT(*) OVER ()
+                FROM donations d
+                LEFT JOIN users u ON d.user_id = u.id
+                WHERE d.id < ?
+                ORDER BY d.id DESC 
+                LIMIT ?
+            ''', (before_id or KEYSET_START, limit)).fetchall()
+            
+            return (rows[0][-1] if rows else 0), [row[:-1] for row in rows]
+    
+    def get_pending_donations(self, limit=ADMIN_PAGE_SIZE, before_id=None):
+        """Admin: (pending donations at or past the cursor, newest page of them)"""
+        try:
+            with self.pool.acquire() as conn:
+                rows = conn.execute('''
+                    SELECT id, user_id, first_name, amount, transaction_id, created_at, COUNT(*) OVER ()
+                    FROM donations WHERE status = 'pending' AND id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (before_id or KEYSET_START, limit)).fetchall()
+                return (rows[0][-1] if rows else 0), [row[:-1] for row in rows]
+        except Exception as e:
+            logger.error(f"Get pending donations error: {e}")
+            return 0, []
+    
+    def get_table_counts(self):
+        """Admin: [(table, row count)] for every table, for /admin dbstats"""
+        with self._cache_lock:
+            counts = self._table_counts_cache.get("counts")
+        if counts is not None:
+            return counts
+        
+        with self.pool.acquire() as conn:
+            row = conn.execute(_SQL_TABLE_COUNTS).fetchone()
+        counts = list(zip(DB_TABLES, row))
+        with self._cache_lock:
+            self._table_counts_cache["counts"] = counts
+        return counts
+    
     # NEW METHODS FOR USER MANAGEMENT
     def delete_user(self, user_id):
         """Admin: Delete user account"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            # Get telegram_id first
-            cursor.execute('SELECT telegram_id FROM users WHERE id = ?', (user_id,))
-            result = cursor.fetchone()
-            if not result:
-                conn.close()
-                return False, "User not found"
-            
-            telegram_id = result[0]
-            
-            # Delete from all tables
-            cursor.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
-            cursor.execute('DELETE FROM user_stats WHERE user_id = ?', (user_id,))
-            cursor.execute('DELETE FROM supporters WHERE user_id = ?', (user_id,))
-            cursor.execute('DELETE FROM donations WHERE user_id = ?', (user_id,))
-            cursor.execute('DELETE FROM support_tickets WHERE user_id = ?', (user_id,))
-            cursor.execute('DELETE FROM admin_messages WHERE to_user_id = ?', (user_id,))
-            cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            
-            # Also clear guest tracking
-            cursor.execute('DELETE FROM guest_tracking WHERE telegram_id = ?', (telegram_id,))
-            
-            conn.commit()
-            conn.close()
-            return True, f"User account (ID: {user_id}) deleted successfully"
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                
+                # Get telegram_id first
+                cursor.execute('SELECT telegram_id FROM users WHERE id = ?', (user_id,))
+                result = cursor.fetchone()
+                if not result:
+                    return False, "User not found"
+                
+                telegram_id = result[0]
+                
+                # Delete from all tables
+                cursor.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM user_stats WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM supporters WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM donations WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM support_tickets WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM admin_messages WHERE to_user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+                
+                # Also clear guest tracking
+                cursor.execute('DELETE FROM guest_tracking WHERE telegram_id = ?', (telegram_id,))
+                self.forget_guest(telegram_id)
+                with self._cache_lock:
+                    self._tg_to_uid.pop(telegram_id, None)
+                self.invalidate_profile(user_id)
+                self.invalidate_user_sessions(user_id)
+                self.invalidate_open_tickets()
+                
+                return True, f"User account (ID: {user_id}) deleted successfully"
         except Exception as e:
             logger.error(f"Delete user error: {e}")
             return False, str(e)
@@ -943,21 +1516,21 @@ class UserDB:
     def admin_reset_password(self, user_id):
         """Admin: Reset user password"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
             # Generate new password
-            new_password = secrets.token_urlsafe(8)
+            new_password = new_token(8)
             password_hash, salt = self.hash_password(new_password)
             
-            cursor.execute('''
-                UPDATE users 
-                SET password_hash = ?, salt = ?, login_attempts = 0, reset_token = NULL
-                WHERE id = ?
-            ''', (password_hash, salt, user_id))
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE users 
+                    SET password_hash = ?, salt = ?, login_attempts = 0, reset_token = NULL
+                    WHERE id = ?
+                ''', (password_hash, salt, user_id))
+                self._end_sessions(cursor, user_id)
             
-            conn.commit()
-            conn.close()
+            self.invalidate_user_sessions(user_id)
             return True, f"Password reset to: {new_password}"
         except Exception as e:
             logger.error(f"Admin reset password error: {e}")
@@ -966,16 +1539,16 @@ class UserDB:
     def ban_user(self, user_id, action="ban"):
         """Admin: Ban or unban user"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            is_active = 0 if action == "ban" else 1
-            cursor.execute('UPDATE users SET is_active = ? WHERE id = ?', (is_active, user_id))
-            
-            conn.commit()
-            conn.close()
-            action_text = "banned" if action == "ban" else "unbanned"
-            return True, f"User {action_text} successfully"
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                is_active = 0 if action == "ban" else 1
+                cursor.execute('UPDATE users SET is_active = ? WHERE id = ?', (is_active, user_id))
+                self.invalidate_user_sessions(user_id)
+                self.invalidate_profile(user_id)
+                
+                action_text = "banned" if action == "ban" else "unbanned"
+                return True, f"User {action_text} successfully"
         except Exception as e:
             logger.error(f"Ban user error: {e}")
             return False, str(e)
@@ -983,51 +1556,50 @@ class UserDB:
     def update_user_profile(self, user_id, field, value):
         """User: Update profile field"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute(f'UPDATE users SET {field} = ? WHERE id = ?', (value, user_id))
-            
-            conn.commit()
-            conn.close()
-            return True
+            with self.pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(_SQL_PROFILE_UPDATES[field], (value, user_id))
+                self.invalidate_profile(user_id)
+                
+                return True
         except Exception as e:
             logger.error(f"Update profile error: {e}")
             return False
     
-    def change_user_password(self, user_id, old_password, new_password):
-        """User: Change their own password"""
+    def change_user_password(self, user_id, old_password, new_password, keep_session_id=None):
+        """User: Change their own password; every other session of theirs is logged out"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT password_hash, salt FROM users WHERE id = ?', (user_id,))
-            result = cursor.fetchone()
+            with self.pool.acquire() as conn:
+                result = conn.execute('SELECT password_hash, salt FROM users WHERE id = ?', (user_id,)).fetchone()
             
             if not result:
-                conn.close()
                 return False, "User not found"
             
             stored_hash, salt = result
             
             if not self.verify_password(stored_hash, salt, old_password):
-                conn.close()
                 return False, "Current password is incorrect"
             
             if len(new_password) < 6:
-                conn.close()
                 return False, "New password must be at least 6 characters"
             
             new_hash, new_salt = self.hash_password(new_password)
             
-            cursor.execute('''
-                UPDATE users 
-                SET password_hash = ?, salt = ?, login_attempts = 0
-                WHERE id = ?
-            ''', (new_hash, new_salt, user_id))
-            
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                
+                # Only apply if nothing else changed the password while scrypt ran
+                cursor.execute('''
+                    UPDATE users 
+                    SET password_hash = ?, salt = ?, login_attempts = 0
+                    WHERE id = ? AND password_hash = ?
+                ''', (new_hash, new_salt, user_id, stored_hash))
+                if not cursor.rowcount:
+                    return False, "Password was changed elsewhere; please try again"
+                self._end_sessions(cursor, user_id, keep_session_id)
+            
+            self.invalidate_user_sessions(user_id)
             return True, "Password changed successfully"
         except Exception as e:
             logger.error(f"Change password error: {e}")
@@ -1039,12 +1611,10 @@ user_db = UserDB()
 # ========================
 # CONVERSATION MANAGEMENT
 # ========================
-def get_user_conversation(user_id):
-    if user_id not in user_conversations:
-        user_conversations[user_id] = [
-            {
-                "role": "system",
-                "content": """You are StarAI, a friendly, intelligent AI assistant with personality.
+# Shared by every conversation; treat as read-only
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": """You are StarAI, a friendly, intelligent AI assistant with personality.
                 
 PERSONALITY: Warm, empathetic, knowledgeable, engaging, supportive.
 
@@ -1057,120 +1627,509 @@ CAPABILITIES:
 6. Remember conversation context
 
 Current Date: December 2024"""
-            }
-        ]
-    return user_conversations[user_id]
+}
 
-def update_conversation(user_id, role, content):
-    conversation = get_user_conversation(user_id)
-    conversation.append({"role": role, "content": content})
-    if len(conversation) > 16:
-        conversation = [conversation[0]] + conversation[-15:]
+def new_conversation():
+    """System prompt pinned beside a bounded deque, so appending a turn evicts the oldest one"""
+    return {
+        "system": SYSTEM_MESSAGE,
+        "history": collections.deque(maxlen=MAX_HISTORY),
+        "total": 0,  # turns ever appended; the newest turn's sequence number
+    }
+
+def new_summary():
+    """Summary text plus the sequence number of the last turn folded into it"""
+    return {"text": "", "through": 0}
+
+async def load_chat_state(user_id):
+    """Conversation and rolling summary in one round-trip (MGET) instead of two GETs"""
+    if redis_client:
+        cached_conversation, cached_summary = await redis_client.mget(f"conv:{user_id}", f"summary:{user_id}")
+        conversation = new_conversation()
+        if cached_conversation:
+            stored = orjson.loads(cached_conversation)
+            if isinstance(stored, list):  # written before turns were numbered
+                stored = {"history": stored, "total": len(stored)}
+            conversation["history"].extend(stored["history"])
+            conversation["total"] = stored["total"]
+        summary = orjson.loads(cached_summary) if cached_summary else new_summary()
+        return conversation, summary
+    
+    conversation = user_conversations.get(user_id) or new_conversation()
+    summary = conversation_summaries.get(user_id) or new_summary()
+    return conversation, summary
+
+async def save_chat_state(user_id, conversation, summary, cache_key=None, ai_response=None):
+    """Write history, summary and the cached reply in a single pipelined round-trip"""
+    if redis_client:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            stored = {"history": list(conversation["history"]), "total": conversation["total"]}
+            pipe.set(f"conv:{user_id}", orjson.dumps(stored), ex=CONVERSATION_TTL)
+            pipe.set(f"summary:{user_id}", orjson.dumps(summary), ex=CONVERSATION_TTL)
+            if cache_key and ai_response:
+                pipe.set(f"ai:{cache_key}", ai_response, ex=AI_CACHE_TTL)
+            await pipe.execute()
+    else:
+        user_conversations[user_id] = conversation
+        conversation_summaries[user_id] = summary
+        if cache_key and ai_response:
+            if len(ai_response_cache) >= AI_CACHE_MAX_LOCAL:
+                ai_response_cache.pop(next(iter(ai_response_cache)))
+            ai_response_cache[cache_key] = ai_response
+
+def update_conversation(conversation, role, content):
+    conversation["history"].append({"role": role, "content": content})
+    conversation["total"] += 1
+    return conversation
+
+async def clear_conversation(user_id):
+    if redis_client:
+        await redis_client.delete(f"conv:{user_id}", f"summary:{user_id}")
+    else:
+        user_conversations.pop(user_id, None)
+        conversation_summaries.pop(user_id, None)
 
-def clear_conversation(user_id):
-    if user_id in user_conversations:
-        del user_conversations[user_id]
+SUMMARY_PROMPT = (
+    "Summarize the following chat turns in at most 120 words, preserving key facts, "
+    "names and user preferences. Fold in the previous summary if one is given."
+)
+
+def extractive_summary(messages):
+    """Fallback when the model is unavailable: first 150 chars of each turn"""
+    lines = [f"- {message['role'].title()}: {message['content'][:150]}" for message in messages]
+    return "Earlier in this conversation:\n" + "\n".join(lines)
+
+async def summarize_turns(messages, previous=""):
+    """Condense the turns outside the prompt window (plus the last summary) with the chat model"""
+    messages = list(messages)
+    if not client:
+        return extractive_summary(messages)
+    
+    transcript = "\n".join(f"{message['role'].title()}: {message['content']}" for message in messages)
+    if previous:
+        transcript = f"Previous summary:\n{previous}\n\nNew turns:\n{transcript}"
+    
+    try:
+        response = await asyncio.to_thread(
+            client.chat.completions.create,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript}
+            ],
+            model=AI_MODEL,
+            temperature=0.2,
+            max_tokens=200
+        )
+        return "PRIOR CONVERSATION SUMMARY: " + response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.error(f"Conversation summary error: {e}")
+        return extractive_summary(messages)
+
+async def build_chat_messages(conversation, summary):
+    """System prompt + rolling summary + every turn it does not cover yet (at least HISTORY_WINDOW)"""
+    history = conversation["history"]
+    older_count = len(history) - HISTORY_WINDOW
+    if older_count <= 0:
+        return [conversation["system"], *history], summary
+    
+    # Sequence numbers: history[0] is turn `first`, the window starts at turn `window_start`
+    first = conversation["total"] - len(history)
+    window_start = first + older_count
+    through = max(summary.get("through", 0), first)
+    if window_start - through >= SUMMARY_INTERVAL:
+        unsummarized = itertools.islice(history, through - first, older_count)
+        summary = {"text": await summarize_turns(unsummarized, summary["text"]), "through": window_start}
+        through = window_start
+    
+    # Turns that left the window since the last refresh stay in the prompt until they are summarized
+    recent_turns = itertools.islice(history, through - first, None)
+    if not summary["text"]:
+        return [conversation["system"], *recent_turns], summary
+    messages = [conversation["system"], {"role": "system", "content": summary["text"]}, *recent_turns]
+    return messages, summary
+
+def build_state_key(model, conversation):
+    """Hash everything that determines the reply: model, persona, recent turns and the new message"""
+    payload = [model, conversation[0]["content"], conversation[-7:]]
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+async def get_cached_ai_response(key):
+    if redis_client:
+        cached = await redis_client.get(f"ai:{key}")
+        return cached.decode('utf-8') if cached else None
+    return ai_response_cache.get(key)
 
 # ========================
 # IMAGE GENERATION
 # ========================
-def create_fallback_image(prompt):
+# Content-addressed PNG cache: fallback tiles and seeded (deterministic) generations only
+IMAGE_CACHE_DIR = os.path.join(tempfile.gettempdir(), "starai_imgcache")
+IMAGE_CACHE_MAX_BYTES = 500 * 1024 * 1024
+IMAGE_CACHE_SWEEP_INTERVAL = 600  # seconds between size checks of the cache directory
+IMAGE_FILE_ID_CACHE_SIZE = 2_000
+IMAGE_FILE_ID_TTL = 86400          # Telegram file_ids outlive this; the TTL just bounds staleness
+
+# cached image path -> Telegram file_id of its first upload
+image_file_ids = TTLCache(maxsize=IMAGE_FILE_ID_CACHE_SIZE, ttl=IMAGE_FILE_ID_TTL)
+
+def image_cache_path(*parts):
+    key = hashlib.sha256("|".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, f"{key}.png")
+
+def cached_image(path):
+    """Return path on a hit and bump its mtime so eviction is least-recently-used"""
     try:
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-            img = Image.new('RGB', (512, 512), color=(60, 60, 100))
+        os.utime(path)
+        return path
+    except OSError:
+        return None
+
+def store_cached_image(path, data):
+    # Write beside the target and rename so concurrent readers never see a partial file
+    with tempfile.NamedTemporaryFile(suffix='.tmp', dir=IMAGE_CACHE_DIR, delete=False) as tmp:
+        tmp.write(data)
+    os.replace(tmp.name, path)
+    return path
+
+def prune_image_cache():
+    entries = []
+    total = 0
+    with os.scandir(IMAGE_CACHE_DIR) as it:
+        for entry in it:
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    
+    for _, size, path in sorted(entries):
+        if total <= IMAGE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+            total -= size
+        except OSError:
+            pass
+
+async def image_cache_janitor():
+    while True:
+        await asyncio.sleep(IMAGE_CACHE_SWEEP_INTERVAL)
+        try:
+            await asyncio.to_thread(prune_image_cache)
+        except Exception as e:
+            logger.error(f"Image cache prune error: {e}")
+
+_image_assets_lock = threading.Lock()
+
+def _load_image_assets(bot_data):
+    """Font and watermarked canvas for fallback images, built on first use"""
+    with _image_assets_lock:
+        if "fallback_canvas" not in bot_data:
+            # Deferred so processes that never draw a fallback image don't load Pillow
+            from PIL import Image, ImageDraw, ImageFont
+            bot_data["fallback_font"] = ImageFont.load_default()
+            canvas = Image.new('RGB', (512, 512), color=(60, 60, 100))
+            ImageDraw.Draw(canvas).text((10, 480), "✨ Created by StarAI", fill=(200, 200, 255))
+            bot_data["fallback_canvas"] = canvas
+    return bot_data["fallback_font"], bot_data["fallback_canvas"]
+
+def create_fallback_image(bot_data, prompt):
+    path = image_cache_path("fallback", prompt)
+    if cached_image(path):
+        return path
+    
+    try:
+        font, canvas = _load_image_assets(bot_data)
+        from PIL import ImageDraw
+        
+        with tempfile.NamedTemporaryFile(suffix='.tmp', dir=IMAGE_CACHE_DIR, delete=False) as tmp:
+            img = canvas.copy()
             draw = ImageDraw.Draw(img)
-            font = ImageFont.load_default()
-            
-            lines = []
-            words = prompt.split()
-            current_line = ""
-            
-            for word in words:
-                if len(current_line + " " + word) <= 30:
-                    current_line = current_line + " " + word if current_line else word
-                else:
-                    if current_line:
-                        lines.append(current_line)
-                    current_line = word
-            if current_line:
-                lines.append(current_line)
             
-            text = "\n".join(lines[:5])
-            if len(lines) > 5:
-                text += "\n..."
+            # The default bitmap font has no ellipsis glyph, hence the ASCII placeholder
+            lines = textwrap.wrap(prompt, width=30, max_lines=5, placeholder=" ...", break_long_words=False)
+            text = "\n".join(lines)
             
             draw.text((50, 200), f"StarAI:\n{text}", fill=(255, 255, 255), font=font)
-            draw.text((10, 480), "✨ Created by StarAI", fill=(200, 200, 255))
-            img.save(tmp.name, 'PNG')
-            return tmp.name
+            img.save(tmp, 'PNG')
+        os.replace(tmp.name, path)
+        return path
     except Exception as e:
         logger.error(f"Fallback image error: {e}")
         return None
 
-def generate_image(prompt):
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.3  # seconds, doubled on each retry
+HTTP_RETRY_STATUSES = frozenset({502, 503, 504})
+
+async def http_fetch(http, method, url, **kwargs):
+    """(status, body) over the shared session, retrying gateway errors and dropped connections"""
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            async with http.request(method, url, **kwargs) as response:
+                if response.status not in HTTP_RETRY_STATUSES or attempt == HTTP_RETRIES:
+                    return response.status, await response.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == HTTP_RETRIES:
+                raise
+        await asyncio.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt)
+
+async def generate_image(bot_data, prompt, seed=None):
+    """Cache path for seeded (deterministic) results and fallbacks; raw bytes for one-off images"""
+    http = bot_data["http"]
+    cache_path = image_cache_path(prompt, 512, 512, seed) if seed is not None else None
+    if cache_path and cached_image(cache_path):
+        return cache_path
+    
+    async def save(data):
+        # One-off images go straight to the upload; a temp file would only be read back
+        if cache_path:
+            return await asyncio.to_thread(store_cached_image, cache_path, data)
+        return data
+    
     try:
         logger.info(f"Generating image for: {prompt}")
         
         try:
-            clean_prompt = prompt.strip().replace(" ", "%20")
+            clean_prompt = quote(prompt.strip(), safe="")
             poll_url = f"https://image.pollinations.ai/prompt/{clean_prompt}"
             params = {
                 "width": "512",
                 "height": "512",
-                "seed": str(random.randint(1, 1000000)),
+                "seed": str(seed if seed is not None else random.randrange(1, 1_000_001)),
                 "nofilter": "true"
             }
-            response = requests.get(poll_url, params=params, timeout=30)
+            status, content = await http_fetch(http, "GET", poll_url, params=params, timeout=aiohttp.ClientTimeout(total=30))
             
-            if response.status_code == 200 and len(response.content) > 1000:
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                    tmp.write(response.content)
-                    return tmp.name
+            if status == 200 and len(content) > 1000:
+                return await save(content)
         except Exception as e:
             logger.error(f"Pollinations.ai error: {e}")
         
         try:
             craiyon_url = "https://api.craiyon.com/v3"
-            response = requests.post(craiyon_url, json={"prompt": prompt}, timeout=60)
-            
-            if response.status_code == 200:
-                data = response.json()
+            # Pre-encoded body: skips json_serialize's bytes -> str -> bytes round-trip
+            status, content = await http_fetch(
+                http, "POST", craiyon_url,
+                data=orjson.dumps({"prompt": prompt}),
+                headers={"Content-Type": "application/json"},
+                timeout=aiohttp.ClientTimeout(total=60)
+            )
+            if status == 200:
+                try:
+                    data = orjson.loads(content)
+                except orjson.JSONDecodeError:
+                    logger.error(f"Craiyon returned invalid JSON ({len(content)} bytes)")
+                    data = {}
                 if data.get("images") and len(data["images"]) > 0:
                     image_data = data["images"][0]
                     if image_data.startswith('data:image'):
                         image_data = image_data.split(',')[1]
-                    image_bytes = base64.b64decode(image_data)
-                    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                        tmp.write(image_bytes)
-                        return tmp.name
+                    image_bytes = b64decode(image_data)
+                    return await save(image_bytes)
         except Exception as e:
             logger.error(f"Craiyon API error: {e}")
         
-        return create_fallback_image(prompt)
+        # Pillow rendering and the PNG write block; keep them off the event loop
+        return await asyncio.to_thread(create_fallback_image, bot_data, prompt)
     except Exception as e:
         logger.error(f"Image generation error: {e}")
-        return create_fallback_image(prompt)
+        return await asyncio.to_thread(create_fallback_image, bot_data, prompt)
 
 # ========================
 # MUSIC SEARCH
 # ========================
-def search_music(query):
+YOUTUBE_SEARCH_URL = "https://www.youtube.com/youtubei/v1/search"
+YOUTUBE_CLIENT_CONTEXT = {"client": {"clientName": "WEB", "clientVersion": "2.20240101"}}
+
+def extract_video_renderers(data):
+    """Walk the innertube search response down to the videoRenderer entries"""
+    sections = (data.get("contents", {})
+                    .get("twoColumnSearchResultsRenderer", {})
+                    .get("primaryContents", {})
+                    .get("sectionListRenderer", {})
+                    .get("contents", []))
+    for section in sections:
+        for item in section.get("itemSectionRenderer", {}).get("contents", []):
+            if "videoRenderer" in item:
+                yield item["videoRenderer"]
+
+async def search_music(http, query):
     try:
-        videos_search = VideosSearch(query, limit=3)
-        results = videos_search.result()['result']
+        payload = {"context": YOUTUBE_CLIENT_CONTEXT, "query": query}
+        async with http.post(YOUTUBE_SEARCH_URL, json=payload, timeout=aiohttp.ClientTimeout(total=15)) as response:
+            data = await response.json(loads=orjson.loads, content_type=None)
         
         music_list = []
-        for i, video in enumerate(results[:3], 1):
-            title = video['title'][:50] + "..." if len(video['title']) > 50 else video['title']
-            url = video['link']
-            duration = video.get('duration', 'N/A')
-            views = video.get('viewCount', {}).get('short', 'N/A')
+        for i, video in enumerate(extract_video_renderers(data), 1):
+            if i > 3:
+                break
+            title = "".join(run.get("text", "") for run in video.get("title", {}).get("runs", []))
+            title = truncate(title, 50)
+            url = f"https://www.youtube.com/watch?v={video['videoId']}"
+            duration = video.get('lengthText', {}).get('simpleText', 'N/A')
+            views = video.get('shortViewCountText', {}).get('simpleText', 'N/A')
             music_list.append(f"{i}. 🎵 {title}\n   ⏱️ {duration} | 👁️ {views}\n   🔗 {url}")
         return music_list
     except Exception as e:
         logger.error(f"Music search error: {e}")
         return ["🎵 Use: `/music <song or artist>`", "Example: `/music Bohemian Rhapsody`"]
 
+# ========================
+# MEDIA JOB QUEUE
+# ========================
+MEDIA_WORKERS = 4
+media_queues = [asyncio.Queue() for _ in range(MEDIA_WORKERS)]
+
+# (burst, seconds to refill it) per user for each media job type
+MEDIA_RATE_LIMITS = {
+    "image": (3, 60),
+    "music": (10, 60),
+}
+MEDIA_BUCKETS_SIZE = 10_000
+RATE_LIMITED_TEXT = "🚦 *Slow down!* You're sending requests too fast. Try again in a minute."
+
+class TokenBucket:
+    __slots__ = ("tokens", "last", "rate", "cap")
+    
+    def __init__(self, cap, rate):
+        self.tokens = cap
+        self.last = time.monotonic()
+        self.rate = rate
+        self.cap = cap
+    
+    def allow(self):
+        now = time.monotonic()
+        self.tokens = min(self.cap, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+# An idle bucket refills completely within its period, so expiring it then loses nothing
+media_buckets = {
+    task_type: TTLCache(maxsize=MEDIA_BUCKETS_SIZE, ttl=period)
+    for task_type, (_, period) in MEDIA_RATE_LIMITS.items()
+}
+
+def allow_media_request(telegram_id, task_type):
+    """Per-user throttle in front of the external image/music APIs"""
+    buckets = media_buckets[task_type]
+    bucket = buckets.get(telegram_id)
+    if bucket is None:
+        cap, period = MEDIA_RATE_LIMITS[task_type]
+        bucket = TokenBucket(cap, cap / period)
+    allowed = bucket.allow()
+    buckets[telegram_id] = bucket  # re-insert so the TTL counts from the last request
+    return allowed
+
+async def enqueue_media_job(chat_id, message_id, task_type, args):
+    """Hand slow image/music work to a worker; jobs for one chat always land on the same queue"""
+    await media_queues[chat_id % MEDIA_WORKERS].put((chat_id, message_id, task_type, args))
+
+def read_file_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+async def send_image_file(bot, chat_id, image, caption):
+    """Bytes are uploaded as-is; cached files are uploaded once, then re-sent by file_id"""
+    if isinstance(image, bytes):
+        await bot.send_photo(chat_id=chat_id, photo=image, caption=caption, parse_mode="Markdown")
+        return
+    
+    file_id = image_file_ids.get(image)
+    if file_id:
+        try:
+            await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, parse_mode="Markdown")
+            return
+        except Exception as e:
+            logger.warning(f"Cached file_id rejected, re-uploading: {e}")
+            image_file_ids.pop(image, None)
+    
+    photo = await asyncio.to_thread(read_file_bytes, image)
+    message = await bot.send_photo(chat_id=chat_id, photo=photo, caption=caption, parse_mode="Markdown")
+    if message.photo:
+        image_file_ids[image] = message.photo[-1].file_id
+
+async def deliver_image(application, chat_id, message_id, prompt, caption, failed_text, seed=None):
+    bot = application.bot
+    image = await generate_image(application.bot_data, prompt, seed)
+    
+    if isinstance(image, bytes):
+        usable = len(image) > 1000
+    else:
+        try:
+            usable = (await asyncio.to_thread(os.stat, image)).st_size > 1000
+        except (TypeError, OSError):
+            usable = False
+    
+    if usable:
+        try:
+            await send_image_file(bot, chat_id, image, caption)
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except TelegramError:
+                pass
+        except Exception as e:
+            logger.error(f"Send image error: {e}")
+            await bot.edit_message_text("❌ Error sending image. Try again!", chat_id=chat_id, message_id=message_id)
+    else:
+        await bot.edit_message_text(failed_text, chat_id=chat_id, message_id=message_id, parse_mode="Markdown")
+
+async def deliver_music(application, chat_id, message_id, query, note, empty_text):
+    bot = application.bot
+    results = await search_music(application.bot_data["http"], query)
+    
+    if len(results) > 0 and "Use:" not in results[0]:
+        response = "🎶 *Music Results:*\n\n"
+        for result in results:
+            response += f"{result}\n\n"
+        response += note
+    else:
+        response = empty_text
+    
+    await bot.edit_message_text(response, chat_id=chat_id, message_id=message_id, parse_mode="Markdown")
+
+MEDIA_HANDLERS = {
+    "image": deliver_image,
+    "music": deliver_music,
+}
+
+async def media_worker(application, jobs):
+    while True:
+        chat_id, message_id, task_type, args = await jobs.get()
+        try:
+            await MEDIA_HANDLERS[task_type](application, chat_id, message_id, *args)
+        except Exception as e:
+            logger.error(f"Media job error ({task_type}): {e}")
+        finally:
+            jobs.task_done()
+
+async def start_media_workers(application):
+    application.bot_data["media_workers"] = [
+        asyncio.create_task(media_worker(application, jobs)) for jobs in media_queues
+    ]
+
+# ========================
+# APPLICATION LIFECYCLE
+# ========================
+async def _setup_http(application):
+    """One keep-alive HTTP session shared by every outbound call"""
+    application.bot_data["http"] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=50, ttl_dns_cache=300, keepalive_timeout=60),
+        json_serialize=lambda obj: orjson.dumps(obj).decode('utf-8'),
+    )
+
+async def post_init(application):
+    await _setup_http(application)
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    application.bot_data["image_cache_janitor"] = asyncio.create_task(image_cache_janitor())
+    await start_media_workers(application)
+
+async def post_shutdown(application):
+    http = application.bot_data.get("http")
+    if http:
+        await http.close()
+
 # ========================
 # FUN CONTENT
 # ========================
@@ -1201,6 +2160,32 @@ QUOTES = [
     "✨ 'Success is not final, failure is not fatal: it is the courage to continue that counts.' - Winston Churchill",
 ]
 
+# Fully rendered replies, built once so handlers only pick one
+JOKE_REPLIES = tuple(f"😂 *Joke of the Day:*\n\n{joke}" for joke in JOKES)
+FACT_REPLIES = tuple(f"💡 *Did You Know?*\n\n{fact}" for fact in FACTS)
+QUOTE_REPLIES = tuple(f"📜 *Inspirational Quote:*\n\n{quote}" for quote in QUOTES)
+JOKE_BUTTON_REPLIES = tuple(f"😂 *JOKE OF THE DAY*\n\n{joke}" for joke in JOKES)
+FACT_BUTTON_REPLIES = tuple(f"💡 *DID YOU KNOW?*\n\n{fact}" for fact in FACTS)
+QUOTE_BUTTON_REPLIES = tuple(f"📜 *INSPIRATIONAL QUOTE*\n\n{quote}" for quote in QUOTES)
+
+class ShuffledDeck:
+    """Deals every index once in random order, then reshuffles; no repeats within a pass"""
+    __slots__ = ("size", "deck")
+    
+    def __init__(self, size):
+        self.size = size
+        self.deck = []
+    
+    def deal(self):
+        if not self.deck:
+            self.deck = random.sample(range(self.size), self.size)
+        return self.deck.pop()
+
+# Shared by the command and its button, so neither repeats what the other just showed
+joke_deck = ShuffledDeck(len(JOKES))
+fact_deck = ShuffledDeck(len(FACTS))
+quote_deck = ShuffledDeck(len(QUOTES))
+
 # ========================
 # GUEST REGISTRATION REMINDERS
 # ========================
@@ -1220,21 +2205,15 @@ GUEST_REMINDERS = {
 # ========================
 # ENHANCED STATISTICS
 # ========================
-def get_enhanced_stats():
-    real_stats = user_db.get_stats()
+def get_enhanced_stats(real_stats=None):
+    """Public-facing figures; pass real_stats when the caller already has them"""
+    if real_stats is None:
+        real_stats = user_db.get_stats()
     
-    # Start with fake stats as base
+    # Start with fake stats as base and add real data on top
     stats = FAKE_STATS.copy()
-    
-    # Add real data on top
-    if real_stats.get("total_users", 0) > 0:
-        stats["total_users"] += real_stats["total_users"]
-    
-    if real_stats.get("supporters", 0) > 0:
-        stats["supporters"] += real_stats["supporters"]
-    
-    if real_stats.get("total_verified", 0) > 0:
-        stats["total_verified"] += real_stats["total_verified"]
+    for key in ("total_users", "supporters", "total_verified"):
+        stats[key] += real_stats.get(key, 0)
     
     # Add some random variation to make it look dynamic
     variation = random.randint(1, 1000)
@@ -1261,154 +2240,173 @@ async def notify_user(user_id, message, context):
 # ========================
 # REGISTRATION CONVERSATION
 # ========================
+# Fixed replies of the /register flow, shared instead of rebuilt in each handler
+ALREADY_REGISTERED_TEXT = (
+    "❌ *You already have an account!*\n\n"
+    "Use `/login` to access your account."
+)
+
+REGISTER_NAME_PROMPT = (
+    "🌟 *CREATE YOUR STARAI ACCOUNT*\n\n"
+    "Let's create your account step by step!\n\n"
+    "First, what's your full name?\n"
+    "*Format:* First Name Last Name\n\n"
+    "*Example:* John Doe"
+)
+
+NAME_INVALID_TEXT = (
+    "❌ Please enter both your first and last name.\n"
+    "*Example:* John Doe\n\n"
+    "What's your full name?"
+)
+
+PHONE_PROMPT = (
+    "📱 *Step 2: Phone Number*\n\n"
+    "Please provide your phone number:\n"
+    "*Format:* +1234567890\n\n"
+    "*Example:* +1234567890\n\n"
+    "This helps us secure your account and provide better support."
+)
+
+PHONE_INVALID_TEXT = (
+    "❌ Invalid phone number format.\n"
+    "Please enter a valid phone number:\n"
+    "*Format:* +1234567890\n\n"
+    "*Example:* +1234567890"
+)
+
+EMAIL_PROMPT = (
+    "📧 *Step 3: Email Address*\n\n"
+    "Please provide your email address:\n"
+    "*Format:* your.email@example.com\n\n"
+    "*Example:* john.doe@example.com\n\n"
+    "We'll use this for account verification and important updates."
+)
+
+EMAIL_INVALID_TEXT = (
+    "❌ Invalid email format.\n"
+    "Please enter a valid email address:\n"
+    "*Format:* your.email@example.com\n\n"
+    "*Example:* john.doe@example.com"
+)
+
+PASSWORD_PROMPT = (
+    "🔐 *Step 4: Create Password*\n\n"
+    "Create a strong password for your account:\n"
+    "• At least 6 characters\n"
+    "• Use letters and numbers\n"
+    "• Don't use common passwords\n\n"
+    "*Example:* MySecurePass123"
+)
+
+PASSWORD_INVALID_TEXT = (
+    "❌ Password must be at least 6 characters.\n"
+    "Please create a stronger password:\n"
+    "*Example:* MySecurePass123"
+)
+
+CONFIRM_PASSWORD_PROMPT = (
+    "🔐 *Step 5: Confirm Password*\n\n"
+    "Please re-enter your password to confirm:"
+)
+
+PASSWORD_MISMATCH_TEXT = (
+    "❌ Passwords don't match!\n\n"
+    "Please start over with `/register`"
+)
+
+REGISTRATION_CANCELLED_TEXT = (
+    "❌ Registration cancelled.\n\n"
+    "You can register anytime with `/register`"
+)
+
+# Scratchpad keys the /register conversation keeps in user_data
+REGISTRATION_KEYS = ('first_name', 'last_name', 'phone', 'email', 'password')
+
+def clear_registration(user_data):
+    for key in REGISTRATION_KEYS:
+        user_data.pop(key, None)
+
 async def start_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
-    conn = sqlite3.connect(user_db.db_file)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (user.id,))
-    existing_user = cursor.fetchone()
-    conn.close()
-    
-    if existing_user:
-        await update.message.reply_text(
-            "❌ *You already have an account!*\n\n"
-            "Use `/login` to access your account.",
-            parse_mode="Markdown"
-        )
+    if await asyncio.to_thread(user_db.user_exists, user.id):
+        await update.message.reply_text(ALREADY_REGISTERED_TEXT, parse_mode="Markdown")
         return ConversationHandler.END
     
-    await update.message.reply_text(
-        "🌟 *CREATE YOUR STARAI ACCOUNT*\n\n"
-        "Let's create your account step by step!\n\n"
-        "First, what's your full name?\n"
-        "*Format:* First Name Last Name\n\n"
-        "*Example:* John Doe",
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(REGISTER_NAME_PROMPT, parse_mode="Markdown")
     return NAME
 
 async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name_parts = update.message.text.strip().split()
     if len(name_parts) < 2:
-        await update.message.reply_text(
-            "❌ Please enter both your first and last name.\n"
-            "*Example:* John Doe\n\n"
-            "What's your full name?",
-            parse_mode="Markdown"
-        )
+        await update.message.reply_text(NAME_INVALID_TEXT, parse_mode="Markdown")
         return NAME
     
     context.user_data['first_name'] = name_parts[0]
     context.user_data['last_name'] = ' '.join(name_parts[1:]) if len(name_parts) > 1 else ""
     
-    await update.message.reply_text(
-        "📱 *Step 2: Phone Number*\n\n"
-        "Please provide your phone number:\n"
-        "*Format:* +1234567890\n\n"
-        "*Example:* +1234567890\n\n"
-        "This helps us secure your account and provide better support.",
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(PHONE_PROMPT, parse_mode="Markdown")
     return PHONE
 
 async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     phone = update.message.text.strip()
     
-    if not re.match(r'^\+?[1-9]\d{1,14}$', phone):
-        await update.message.reply_text(
-            "❌ Invalid phone number format.\n"
-            "Please enter a valid phone number:\n"
-            "*Format:* +1234567890\n\n"
-            "*Example:* +1234567890",
-            parse_mode="Markdown"
-        )
+    if not PHONE_RE.fullmatch(phone):
+        await update.message.reply_text(PHONE_INVALID_TEXT, parse_mode="Markdown")
         return PHONE
     
     context.user_data['phone'] = phone
     
-    await update.message.reply_text(
-        "📧 *Step 3: Email Address*\n\n"
-        "Please provide your email address:\n"
-        "*Format:* your.email@example.com\n\n"
-        "*Example:* john.doe@example.com\n\n"
-        "We'll use this for account verification and important updates.",
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(EMAIL_PROMPT, parse_mode="Markdown")
     return EMAIL
 
 async def get_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
     email = update.message.text.strip()
     
-    if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email):
-        await update.message.reply_text(
-            "❌ Invalid email format.\n"
-            "Please enter a valid email address:\n"
-            "*Format:* your.email@example.com\n\n"
-            "*Example:* john.doe@example.com",
-            parse_mode="Markdown"
-        )
+    if not EMAIL_RE.fullmatch(email):
+        await update.message.reply_text(EMAIL_INVALID_TEXT, parse_mode="Markdown")
         return EMAIL
     
     context.user_data['email'] = email
     
-    await update.message.reply_text(
-        "🔐 *Step 4: Create Password*\n\n"
-        "Create a strong password for your account:\n"
-        "• At least 6 characters\n"
-        "• Use letters and numbers\n"
-        "• Don't use common passwords\n\n"
-        "*Example:* MySecurePass123",
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(PASSWORD_PROMPT, parse_mode="Markdown")
     return PASSWORD
 
 async def get_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
     password = update.message.text.strip()
     
     if len(password) < 6:
-        await update.message.reply_text(
-            "❌ Password must be at least 6 characters.\n"
-            "Please create a stronger password:\n"
-            "*Example:* MySecurePass123",
-            parse_mode="Markdown"
-        )
+        await update.message.reply_text(PASSWORD_INVALID_TEXT, parse_mode="Markdown")
         return PASSWORD
     
     context.user_data['password'] = password
     
-    await update.message.reply_text(
-        "🔐 *Step 5: Confirm Password*\n\n"
-        "Please re-enter your password to confirm:",
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(CONFIRM_PASSWORD_PROMPT, parse_mode="Markdown")
     return CONFIRM_PASSWORD
 
 async def confirm_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
     confirm_password_text = update.message.text.strip()
     
-    if confirm_password_text != context.user_data.get('password', ''):
-        await update.message.reply_text(
-            "❌ Passwords don't match!\n\n"
-            "Please start over with `/register`",
-            parse_mode="Markdown"
-        )
+    if not hmac.compare_digest(confirm_password_text.encode('utf-8'), context.user_data.get('password', '').encode('utf-8')):
+        await update.message.reply_text(PASSWORD_MISMATCH_TEXT, parse_mode="Markdown")
         return ConversationHandler.END
     
     user = update.effective_user
     
-    user_id, message = user_db.create_user(
-        telegram_id=user.id,
-        username=user.username or "",
-        first_name=context.user_data['first_name'],
-        last_name=context.user_data.get('last_name', ''),
-        phone=context.user_data['phone'],
-        email=context.user_data['email'],
-        password=context.user_data['password']
+    user_id, message = await user_db.run_kdf(
+        user_db.create_user,
+        user.id,
+        user.username or "",
+        context.user_data['first_name'],
+        context.user_data.get('last_name', ''),
+        context.user_data['phone'],
+        context.user_data['email'],
+        context.user_data['password']
     )
     
     if user_id:
-        user_data, login_msg = user_db.login_user(user.id, context.user_data['password'])
+        user_data, login_msg = await user_db.run_kdf(user_db.login_user, user.id, context.user_data['password'])
         
         if user_data:
             context.user_data.update(user_data)
@@ -1442,26 +2440,14 @@ async def confirm_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="Markdown"
         )
     
-    context.user_data.pop('first_name', None)
-    context.user_data.pop('last_name', None)
-    context.user_data.pop('phone', None)
-    context.user_data.pop('email', None)
-    context.user_data.pop('password', None)
+    clear_registration(context.user_data)
     
     return ConversationHandler.END
 
 async def cancel_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "❌ Registration cancelled.\n\n"
-        "You can register anytime with `/register`",
-        parse_mode="Markdown"
-    )
+    await update.message.reply_text(REGISTRATION_CANCELLED_TEXT, parse_mode="Markdown")
     
-    context.user_data.pop('first_name', None)
-    context.user_data.pop('last_name', None)
-    context.user_data.pop('phone', None)
-    context.user_data.pop('email', None)
-    context.user_data.pop('password', None)
+    clear_registration(context.user_data)
     
     return ConversationHandler.END
 
@@ -1495,7 +2481,7 @@ async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     password = ' '.join(args)
-    user_data, message = user_db.login_user(user.id, password)
+    user_data, message = await user_db.run_kdf(user_db.login_user, user.id, password)
     
     if user_data:
         context.user_data.update(user_data)
@@ -1536,7 +2522,7 @@ async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def logout_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if 'session_id' in context.user_data:
         session_id = context.user_data['session_id']
-        success, message = user_db.logout_user(session_id)
+        success, message = await asyncio.to_thread(user_db.logout_user, session_id)
         
         context.user_data.clear()
         
@@ -1567,13 +2553,7 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if 'user_id' not in context.user_data:
-        conn = sqlite3.connect(user_db.db_file)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (user.id,))
-        db_user = cursor.fetchone()
-        conn.close()
-        
-        if db_user:
+        if await asyncio.to_thread(user_db.user_exists, user.id):
             await update.message.reply_text(
                 "🔒 *Authentication Required*\n\n"
                 "Please login to view your profile:\n"
@@ -1598,7 +2578,7 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user_id = context.user_data['user_id']
-    profile = user_db.get_user_profile(user_id)
+    profile = await asyncio.to_thread(user_db.get_user_profile, user_id)
     
     if profile:
         join_date = profile['created_at'][:10] if profile['created_at'] else "Unknown"
@@ -1663,16 +2643,40 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ========================
 # START COMMAND
 # ========================
+# The /start menu only comes in two variants, so both markups are built once and shared
+START_ACTION_ROWS = [
+    [InlineKeyboardButton("🎨 Create Image", callback_data='create_image'),
+     InlineKeyboardButton("🎵 Find Music", callback_data='find_music')],
+    [InlineKeyboardButton("😂 Get Joke", callback_data='get_joke'),
+     InlineKeyboardButton("💡 Get Fact", callback_data='get_fact')],
+    [InlineKeyboardButton("📜 Get Quote", callback_data='get_quote'),
+     InlineKeyboardButton("💬 Chat", callback_data='chat')],
+    [InlineKeyboardButton("💰 Donate Now", callback_data='donate'),
+     InlineKeyboardButton("ℹ️ About", callback_data='about')]
+]
+
+START_KEYBOARD_AUTH = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👤 Profile", callback_data='profile'),
+     InlineKeyboardButton("💰 Donate", callback_data='donate')],
+    [InlineKeyboardButton("📨 Messages", callback_data='messages'),
+     InlineKeyboardButton("🆘 Support", callback_data='support')],
+    *START_ACTION_ROWS
+])
+
+START_KEYBOARD_GUEST = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Register", callback_data='register'),
+     InlineKeyboardButton("🔐 Login", callback_data='login')],
+    [InlineKeyboardButton("🔓 Forgot Password", callback_data='forgot_password'),
+     InlineKeyboardButton("🆘 Help", callback_data='help')],
+    *START_ACTION_ROWS
+])
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
-    conn = sqlite3.connect(user_db.db_file)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, first_name FROM users WHERE telegram_id = ?', (user.id,))
-    user_data = cursor.fetchone()
-    conn.close()
+    has_account = await asyncio.to_thread(user_db.user_exists, user.id)
     
-    stats = get_enhanced_stats()
+    stats = await asyncio.to_thread(get_enhanced_stats)
     
     # Format stats with commas
     total_users = f"{stats['total_users']:,}"
@@ -1725,7 +2729,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if 'user_id' in context.user_data:
         welcome += f"\n✅ *Logged in as:* {context.user_data.get('first_name', user.first_name)}"
-    elif user_data:
+    elif has_account:
         welcome += f"\n🔓 *Account detected:* Login with `/login`"
     else:
         welcome += f"\n👤 *Guest Mode:* Register with `/register` for full features!"
@@ -1743,53 +2747,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 *Click buttons below or type commands!* 😊
 """
     
-    buttons = []
-    
-    if 'user_id' in context.user_data:
-        buttons.append([
-            InlineKeyboardButton("👤 Profile", callback_data='profile'),
-            InlineKeyboardButton("💰 Donate", callback_data='donate')
-        ])
-        buttons.append([
-            InlineKeyboardButton("📨 Messages", callback_data='messages'),
-            InlineKeyboardButton("🆘 Support", callback_data='support')
-        ])
-    else:
-        buttons.append([
-            InlineKeyboardButton("📝 Register", callback_data='register'),
-            InlineKeyboardButton("🔐 Login", callback_data='login')
-        ])
-        buttons.append([
-            InlineKeyboardButton("🔓 Forgot Password", callback_data='forgot_password'),
-            InlineKeyboardButton("🆘 Help", callback_data='help')
-        ])
-    
-    buttons.extend([
-        [InlineKeyboardButton("🎨 Create Image", callback_data='create_image'),
-         InlineKeyboardButton("🎵 Find Music", callback_data='find_music')],
-        [InlineKeyboardButton("😂 Get Joke", callback_data='get_joke'),
-         InlineKeyboardButton("💡 Get Fact", callback_data='get_fact')],
-        [InlineKeyboardButton("📜 Get Quote", callback_data='get_quote'),
-         InlineKeyboardButton("💬 Chat", callback_data='chat')],
-        [InlineKeyboardButton("💰 Donate Now", callback_data='donate'),
-         InlineKeyboardButton("ℹ️ About", callback_data='about')]
-    ])
-    
-    reply_markup = InlineKeyboardMarkup(buttons)
+    reply_markup = START_KEYBOARD_AUTH if 'user_id' in context.user_data else START_KEYBOARD_GUEST
     await update.message.reply_text(welcome, parse_mode="Markdown", reply_markup=reply_markup)
 
 # ========================
 # DONATION COMMANDS
 # ========================
-async def donate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    stats = get_enhanced_stats()
-    user_total = 0
-    
-    if 'user_id' in context.user_data:
-        user_total = user_db.get_user_total(context.user_data['user_id'])
-    
-    donate_text = f"""
+# Static parts of /donate; only the three figures change between calls
+DONATE_TEMPLATE = """
 💰 *SUPPORT STARAI DEVELOPMENT* 💰
 
 Running StarAI costs money for:
@@ -1804,31 +2769,44 @@ Running StarAI costs money for:
 • Get supporter perks
 
 *Community Stats:*
-👥 Supporters: {stats['supporters']:,}
-💰 Total Raised: ${stats['total_verified']:,.2f}
+👥 Supporters: {supporters:,}
+💰 Total Raised: ${total_verified:,.2f}
 
 *Your Donations:* ${user_total:.2f}
 
 *Choose amount:*
 """
+
+DONATE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("☕ Tea - $3", callback_data='donate_3'),
+     InlineKeyboardButton("☕ Coffee - $5", callback_data='donate_5')],
+    [InlineKeyboardButton("🥤 Smoothie - $10", callback_data='donate_10'),
+     InlineKeyboardButton("🍰 Cake - $20", callback_data='donate_20')],
+    [InlineKeyboardButton("💰 Custom Amount", callback_data='donate_custom'),
+     InlineKeyboardButton("✅ Check Payment", callback_data='i_donated')],
+    [InlineKeyboardButton("📊 My Donations", callback_data='my_donations'),
+     InlineKeyboardButton("🔙 Back", callback_data='back_to_menu')]
+])
+
+async def donate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = await asyncio.to_thread(get_enhanced_stats)
+    user_total = 0
     
-    keyboard = [
-        [InlineKeyboardButton("☕ Tea - $3", callback_data='donate_3'),
-         InlineKeyboardButton("☕ Coffee - $5", callback_data='donate_5')],
-        [InlineKeyboardButton("🥤 Smoothie - $10", callback_data='donate_10'),
-         InlineKeyboardButton("🍰 Cake - $20", callback_data='donate_20')],
-        [InlineKeyboardButton("💰 Custom Amount", callback_data='donate_custom'),
-         InlineKeyboardButton("✅ Check Payment", callback_data='i_donated')],
-        [InlineKeyboardButton("📊 My Donations", callback_data='my_donations'),
-         InlineKeyboardButton("🔙 Back", callback_data='back_to_menu')]
-    ]
+    if 'user_id' in context.user_data:
+        user_total = await asyncio.to_thread(user_db.get_user_total, context.user_data['user_id'])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    donate_text = DONATE_TEMPLATE.format(
+        supporters=stats['supporters'],
+        total_verified=stats['total_verified'],
+        user_total=user_total
+    )
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(donate_text, parse_mode="Markdown", reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(donate_text, parse_mode="Markdown", reply_markup=DONATE_KEYBOARD)
     else:
-        await update.message.reply_text(donate_text, parse_mode="Markdown", reply_markup=reply_markup)
+        await update.message.reply_text(donate_text, parse_mode="Markdown", reply_markup=DONATE_KEYBOARD)
+
+BACK_TO_DONATE_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Donate", callback_data='donate')]])
 
 async def mydonations_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -1845,38 +2823,28 @@ async def mydonations_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     user_id = context.user_data['user_id']
-    donations = user_db.get_user_donations(user_id)
-    total = user_db.get_user_total(user_id)
+    donations, total = await asyncio.to_thread(user_db.get_donation_summary, user_id)
     
     if donations:
-        response = f"""
+        parts = [f"""
 📊 *YOUR DONATIONS*
 
 *Total Verified:* ${total:.2f}
 *Total Transactions:* {len(donations)}
 
 *Recent Donations:*
-"""
+"""]
         for i, donation in enumerate(donations[:5], 1):
             status_icon = "✅" if donation["status"] == "verified" else "⏳"
-            response += f"\n{i}. {status_icon} ${donation['amount']:.2f} - {donation['created_at'][:10]}"
+            parts.append(f"{i}. {status_icon} ${donation['amount']:.2f} - {donation['created_at'][:10]}")
             if donation["transaction_id"]:
-                response += f"\n   📎 {donation['transaction_id'][:20]}..."
+                parts.append(f"   📎 {donation['transaction_id'][:20]}...")
         
         if total > 0:
-            response += f"\n\n🎖️ *Supporter Level:* "
-            if total >= 50:
-                response += "Platinum 🏆"
-            elif total >= 20:
-                response += "Gold 🥇"
-            elif total >= 10:
-                response += "Silver 🥈"
-            elif total >= 5:
-                response += "Bronze 🥉"
-            else:
-                response += "Supporter 💝"
-            
-            response += f"\n❤️ Thank you for your support!"
+            parts.append(f"\n🎖️ *Supporter Level:* {SUPPORTER_LEVEL_LABELS[supporter_level_for(total)]}")
+            parts.append("❤️ Thank you for your support!")
+        
+        response = "\n".join(parts)
     else:
         response = """
 💸 *NO DONATIONS YET*
@@ -1889,19 +2857,22 @@ Use `/donate` to see how you can help!
 *Thank you for being part of the community!* 😊
 """
     
-    keyboard = [[InlineKeyboardButton("🔙 Back to Donate", callback_data='donate')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     if update.callback_query:
-        await update.callback_query.edit_message_text(response, parse_mode="Markdown", reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(response, parse_mode="Markdown", reply_markup=BACK_TO_DONATE_KEYBOARD)
     else:
-        await update.message.reply_text(response, parse_mode="Markdown", reply_markup=reply_markup)
+        await update.message.reply_text(response, parse_mode="Markdown", reply_markup=BACK_TO_DONATE_KEYBOARD)
 
 # ========================
 # OTHER BOT COMMANDS
 # ========================
 async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    prompt = ' '.join(context.args)
+    args = context.args
+    seed = None
+    # "/image seed:42 <description>" pins the seed so the same request returns the same (cached) image
+    if args and args[0].startswith("seed:") and args[0][5:].isdigit():
+        seed = int(args[0][5:])
+        args = args[1:]
+    prompt = ' '.join(args)
     
     if not prompt:
         await update.message.reply_text(
@@ -1910,35 +2881,18 @@ async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    if not allow_media_request(update.effective_user.id, "image"):
+        await update.message.reply_text(RATE_LIMITED_TEXT, parse_mode="Markdown")
+        return
+    
     if 'user_id' in context.user_data:
         user_db.update_user_stats(context.user_data['user_id'], 'images_created')
     
     msg = await update.message.reply_text(f"✨ *Creating Image:*\n`{prompt}`\n\n⏳ Please wait...", parse_mode="Markdown")
-    image_path = generate_image(prompt)
-    
-    if image_path and os.path.exists(image_path) and os.path.getsize(image_path) > 1000:
-        try:
-            with open(image_path, 'rb') as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=f"🎨 *Generated:* `{prompt}`\n\n✨ Created by StarAI",
-                    parse_mode="Markdown"
-                )
-            try:
-                await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=msg.message_id)
-            except:
-                pass
-        except Exception as e:
-            logger.error(f"Send image error: {e}")
-            await msg.edit_text("❌ Error sending image. Try again!")
-        finally:
-            try:
-                if os.path.exists(image_path):
-                    os.unlink(image_path)
-            except:
-                pass
-    else:
-        await msg.edit_text("❌ Image creation failed. Try a simpler description.")
+    await enqueue_media_job(
+        update.effective_chat.id, msg.message_id, "image",
+        (prompt, f"🎨 *Generated:* `{prompt}`\n\n✨ Created by StarAI", "❌ Image creation failed. Try a simpler description.", seed)
+    )
 
 async def music_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = ' '.join(context.args)
@@ -1950,41 +2904,35 @@ async def music_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    if not allow_media_request(update.effective_user.id, "music"):
+        await update.message.reply_text(RATE_LIMITED_TEXT, parse_mode="Markdown")
+        return
+    
     if 'user_id' in context.user_data:
         user_db.update_user_stats(context.user_data['user_id'], 'music_searches')
     
-    await update.message.reply_text(f"🔍 *Searching:* `{query}`", parse_mode="Markdown")
-    results = search_music(query)
-    
-    if len(results) > 0 and "Use:" not in results[0]:
-        response = "🎶 *Music Results:*\n\n"
-        for result in results:
-            response += f"{result}\n\n"
-        response += "💡 *Note:* These are YouTube links for listening."
-    else:
-        response = "❌ *No results found.* Try different search terms."
-    
-    await update.message.reply_text(response, parse_mode="Markdown")
+    msg = await update.message.reply_text(f"🔍 *Searching:* `{query}`", parse_mode="Markdown")
+    await enqueue_media_job(
+        update.effective_chat.id, msg.message_id, "music",
+        (query, "💡 *Note:* These are YouTube links for listening.", "❌ *No results found.* Try different search terms.")
+    )
 
 async def joke_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    joke = random.choice(JOKES)
-    await update.message.reply_text(f"😂 *Joke of the Day:*\n\n{joke}", parse_mode="Markdown")
+    await update.message.reply_text(JOKE_REPLIES[joke_deck.deal()], parse_mode="Markdown")
 
 async def fact_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    fact = random.choice(FACTS)
-    await update.message.reply_text(f"💡 *Did You Know?*\n\n{fact}", parse_mode="Markdown")
+    await update.message.reply_text(FACT_REPLIES[fact_deck.deal()], parse_mode="Markdown")
 
 async def quote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    quote = random.choice(QUOTES)
-    await update.message.reply_text(f"📜 *Inspirational Quote:*\n\n{quote}", parse_mode="Markdown")
+    await update.message.reply_text(QUOTE_REPLIES[quote_deck.deal()], parse_mode="Markdown")
 
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    clear_conversation(user.id)
+    await clear_conversation(user.id)
     await update.message.reply_text("🧹 *Conversation cleared!* Let's start fresh! 😊", parse_mode="Markdown")
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = """
+# Fixed /help payload, built once at import
+HELP_TEXT = """
 🆘 *STARAI HELP CENTER*
 
 👤 **ACCOUNT COMMANDS:**
@@ -2022,12 +2970,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 *Just talk to me naturally!* 😊
 """
-    await update.message.reply_text(help_text, parse_mode="Markdown")
 
-async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    stats = get_enhanced_stats()
-    
-    about_text = f"""
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(HELP_TEXT, parse_mode="Markdown")
+
+# Static parts of /about; only the community figures change between calls
+ABOUT_TEMPLATE = """
 🌟 *ABOUT STARAI*
 
 StarAI is your complete AI companion powered by cutting-edge technology.
@@ -2040,10 +2988,10 @@ StarAI is your complete AI companion powered by cutting-edge technology.
 • Support & Community Features
 
 📊 **COMMUNITY GROWTH:**
-• 🎯 Total Users: {stats['total_users']:,}
-• ⭐ Supporters: {stats['supporters']:,}
-• 💰 Funds Raised: ${stats['total_verified']:,.2f}
-• 🎨 Images Created: {stats['images_created']:,}
+• 🎯 Total Users: {total_users:,}
+• ⭐ Supporters: {supporters:,}
+• 💰 Funds Raised: ${total_verified:,.2f}
+• 🎨 Images Created: {images_created:,}
 
 👥 **OUR TEAM:**
 • Dedicated developers
@@ -2062,17 +3010,30 @@ Use `/donate` to contribute.
 
 *Thank you for being part of our community!* ❤️
 """
+
+@functools.lru_cache(maxsize=1)
+def render_about_text(total_users, supporters, total_verified, images_created):
+    """Format /about; re-rendered only when the figures change"""
+    return ABOUT_TEMPLATE.format(
+        total_users=total_users,
+        supporters=supporters,
+        total_verified=total_verified,
+        images_created=images_created,
+    )
+
+async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = await asyncio.to_thread(get_enhanced_stats)
+    about_text = render_about_text(
+        stats['total_users'], stats['supporters'], stats['total_verified'], stats['images_created']
+    )
     
     await update.message.reply_text(about_text, parse_mode="Markdown")
 
 # ========================
 # PAYMENT SELECTION
 # ========================
-async def show_payment_options(update: Update, context: ContextTypes.DEFAULT_TYPE, amount):
-    query = update.callback_query
-    context.user_data[f"selected_amount_{query.from_user.id}"] = amount
-    
-    payment_text = f"""
+# Shared by the preset-amount buttons and the custom-amount reply; only the amount varies
+PAYMENT_TEMPLATE = """
 ✅ *Selected: ${amount}*
 
 Now choose your payment method:
@@ -2082,30 +3043,30 @@ Now choose your payment method:
 
 *After payment, click "✅ I've Paid" below and send your Transaction ID.*
 """
+
+PAYMENT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💳 PayPal Payment", url='https://www.paypal.com/ncp/payment/HCPVDSSXRL4K8'),
+     InlineKeyboardButton("☕ Buy Me Coffee", url='https://www.buymeacoffee.com/StarAI')],
+    [InlineKeyboardButton("✅ I've Paid", callback_data='i_donated'),
+     InlineKeyboardButton("🔙 Change Amount", callback_data='donate')]
+])
+
+async def show_payment_options(update: Update, context: ContextTypes.DEFAULT_TYPE, amount):
+    query = update.callback_query
+    context.user_data["selected_amount"] = amount
     
-    keyboard = [
-        [InlineKeyboardButton("💳 PayPal Payment", url='https://www.paypal.com/ncp/payment/HCPVDSSXRL4K8'),
-         InlineKeyboardButton("☕ Buy Me Coffee", url='https://www.buymeacoffee.com/StarAI')],
-        [InlineKeyboardButton("✅ I've Paid", callback_data='i_donated'),
-         InlineKeyboardButton("🔙 Change Amount", callback_data='donate')]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(payment_text, parse_mode="Markdown", reply_markup=reply_markup, disable_web_page_preview=True)
+    payment_text = PAYMENT_TEMPLATE.format(amount=amount)
+    await query.edit_message_text(payment_text, parse_mode="Markdown", reply_markup=PAYMENT_KEYBOARD, disable_web_page_preview=True)
 
 # ========================
 # PASSWORD RESET
 # ========================
+RESET_CHOICE_TIMEOUT = 300  # seconds /forgotpassword waits for the "1" or "2" reply
+
 async def forgot_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
-    conn = sqlite3.connect(user_db.db_file)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (user.id,))
-    existing_user = cursor.fetchone()
-    conn.close()
-    
-    if not existing_user:
+    if not await asyncio.to_thread(user_db.user_exists, user.id):
         await update.message.reply_text(
             "❌ *No Account Found*\n\n"
             "You don't have an account yet.\n"
@@ -2113,7 +3074,7 @@ async def forgot_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "`/register`",
             parse_mode="Markdown"
         )
-        return ConversationHandler.END
+        return
     
     await update.message.reply_text(
         "🔐 *PASSWORD RESET*\n\n"
@@ -2125,27 +3086,27 @@ async def forgot_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
     
-    return CONTACT_SUPPORT
+    # handle_message routes the next reply here while the deadline holds
+    context.user_data["reset_choice_until"] = time.monotonic() + RESET_CHOICE_TIMEOUT
 
 async def handle_contact_support(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     choice = update.message.text.strip()
     
+    if choice in ("1", "2"):
+        context.user_data.pop("reset_choice_until", None)
+    
     if choice == "1":
-        reset_token, message = user_db.generate_reset_token(user.id)
+        reset_token, message = await asyncio.to_thread(user_db.generate_reset_token, user.id)
         
         if reset_token:
-            conn = sqlite3.connect(user_db.db_file)
-            cursor = conn.cursor()
-            cursor.execute('SELECT email FROM users WHERE telegram_id = ?', (user.id,))
-            user_email = cursor.fetchone()
-            conn.close()
+            user_email = await asyncio.to_thread(user_db.get_user_email, user.id)
             
-            if user_email and user_email[0]:
+            if user_email:
                 await update.message.reply_text(
                     f"✅ *Reset Link Generated*\n\n"
                     f"A password reset link has been sent to:\n"
-                    f"📧 {user_email[0]}\n\n"
+                    f"📧 {user_email}\n\n"
                     f"*Note:* Check your email for reset instructions.\n"
                     f"The link expires in 24 hours.",
                     parse_mode="Markdown"
@@ -2183,9 +3144,6 @@ async def handle_contact_support(update: Update, context: ContextTypes.DEFAULT_T
             "2. Contact support",
             parse_mode="Markdown"
         )
-        return CONTACT_SUPPORT
-    
-    return ConversationHandler.END
 
 async def reset_password_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle password reset with token"""
@@ -2200,11 +3158,11 @@ async def reset_password_command(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     reset_token = args[0]
-    telegram_id, message = user_db.verify_reset_token(reset_token)
+    telegram_id, message = await asyncio.to_thread(user_db.verify_reset_token, reset_token)
     
     if telegram_id:
-        context.user_data[f"reset_in_progress_{update.effective_user.id}"] = True
-        context.user_data[f"reset_token_{update.effective_user.id}"] = reset_token
+        context.user_data["reset_in_progress"] = True
+        context.user_data["reset_token"] = reset_token
         await update.message.reply_text(
             "✅ *Token Verified!*\n\n"
             "Please enter your new password (minimum 6 characters):",
@@ -2218,7 +3176,8 @@ async def reset_password_command(update: Update, context: ContextTypes.DEFAULT_T
 # ========================
 async def create_support_ticket_with_notification(update, context, user, issue):
     """Create support ticket and notify admins"""
-    ticket_id, message = user_db.create_support_ticket(
+    ticket_id, message = await asyncio.to_thread(
+        user_db.create_support_ticket,
         user.id,
         user.username or "No username",
         user.first_name,
@@ -2240,74 +3199,67 @@ async def create_support_ticket_with_notification(update, context, user, issue):
             parse_mode="Markdown"
         )
         
-        # Notify all admins
-        for admin_id in ADMIN_IDS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=f"🆘 *NEW SUPPORT TICKET #{ticket_id}*\n\n"
-                         f"👤 *User:* {user.first_name} (@{user.username or 'No username'})\n"
-                         f"🆔 *Telegram ID:* {user.id}\n"
-                         f"📝 *Issue:* {issue}\n\n"
-                         f"💬 *Quick Actions:*\n"
-                         f"• `/reply {user.id} <message>` - Reply directly\n"
-                         f"• `/admin support` - View all tickets\n"
-                         f"• `/ticket {ticket_id}` - View this ticket\n\n"
-                         f"⏰ *Created:* {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                    parse_mode="Markdown"
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify admin {admin_id}: {e}")
+        # Notify all admins concurrently; the text is the same for each
+        admin_text = (
+            f"🆘 *NEW SUPPORT TICKET #{ticket_id}*\n\n"
+            f"👤 *User:* {user.first_name} (@{user.username or 'No username'})\n"
+            f"🆔 *Telegram ID:* {user.id}\n"
+            f"📝 *Issue:* {issue}\n\n"
+            f"💬 *Quick Actions:*\n"
+            f"• `/reply {user.id} <message>` - Reply directly\n"
+            f"• `/admin support` - View all tickets\n"
+            f"• `/ticket {ticket_id}` - View this ticket\n\n"
+            f"⏰ *Created:* {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        )
+        results = await asyncio.gather(
+            *(context.bot.send_message(chat_id=admin_id, text=admin_text, parse_mode="Markdown") for admin_id in ADMIN_ID_LIST),
+            return_exceptions=True
+        )
+        for admin_id, result in zip(ADMIN_ID_LIST, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to notify admin {admin_id}: {result}")
     else:
         await update.message.reply_text(
             f"❌ *Failed to create ticket*\n\n{message}",
             parse_mode="Markdown"
         )
 
+# Interactive /support menu, shown when no message is given
+SUPPORT_MENU_TEXT = (
+    "🆘 *STARAI SUPPORT CENTER*\n\n"
+    "Need help? Choose your issue type below or type:\n"
+    "`/support <your message>`\n\n"
+    "*Example:* `/support I can't login to my account`\n\n"
+    "📞 *We respond within 24 hours!*"
+)
+SUPPORT_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔐 Password Reset", callback_data='support_password')],
+    [InlineKeyboardButton("👤 Account Issues", callback_data='support_account')],
+    [InlineKeyboardButton("💰 Donation Help", callback_data='support_donation')],
+    [InlineKeyboardButton("🐛 Bug Report", callback_data='support_bug')],
+    [InlineKeyboardButton("💬 Other Issue", callback_data='support_other')]
+])
+
 async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     args = context.args
     if not args:
-        # Show interactive support menu
-        keyboard = [
-            [InlineKeyboardButton("🔐 Password Reset", callback_data='support_password')],
-            [InlineKeyboardButton("👤 Account Issues", callback_data='support_account')],
-            [InlineKeyboardButton("💰 Donation Help", callback_data='support_donation')],
-            [InlineKeyboardButton("🐛 Bug Report", callback_data='support_bug')],
-            [InlineKeyboardButton("💬 Other Issue", callback_data='support_other')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            "🆘 *STARAI SUPPORT CENTER*\n\n"
-            "Need help? Choose your issue type below or type:\n"
-            "`/support <your message>`\n\n"
-            "*Example:* `/support I can't login to my account`\n\n"
-            "📞 *We respond within 24 hours!*",
-            parse_mode="Markdown",
-            reply_markup=reply_markup
-        )
+        await update.message.reply_text(SUPPORT_MENU_TEXT, parse_mode="Markdown", reply_markup=SUPPORT_MENU_KEYBOARD)
         return
     
     issue = ' '.join(args)
     await create_support_ticket_with_notification(update, context, user, issue)
 
+# Row templates for the ticket/message listings; rows are joined once instead of grown with +=
+TICKET_ROW = "{status_icon} *Ticket #{ticket_id}*\n📝 *Issue:* {issue}\n📅 *Created:* {created}\n🔄 *Status:* {status}\n{note}\n"
+TICKET_NOTE_LINE = "💬 *Admin Note:* {note}\n"
+MESSAGE_ROW = "{read_icon} *Message #{msg_id}*\n📅 *Date:* {created}\n💬 *Message:* {message}\n\n"
+
 async def mytickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
-    conn = sqlite3.connect(user_db.db_file)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, issue, status, created_at, admin_notes
-        FROM support_tickets 
-        WHERE telegram_id = ?
-        ORDER BY created_at DESC
-        LIMIT 5
-    ''', (user.id,))
-    
-    tickets = cursor.fetchall()
-    conn.close()
+    tickets = await asyncio.to_thread(user_db.get_user_tickets, user.id)
     
     if not tickets:
         await update.message.reply_text(
@@ -2319,22 +3271,21 @@ async def mytickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    response = "📋 *YOUR SUPPORT TICKETS*\n\n"
-    for ticket in tickets:
-        ticket_id, issue, status, created_at, admin_notes = ticket
-        status_icon = "✅" if status == "resolved" else "⏳" if status == "in_progress" else "🆕"
-        
-        response += f"{status_icon} *Ticket #{ticket_id}*\n"
-        response += f"📝 *Issue:* {issue[:50]}...\n" if len(issue) > 50 else f"📝 *Issue:* {issue}\n"
-        response += f"📅 *Created:* {created_at[:16]}\n"
-        response += f"🔄 *Status:* {status.title()}\n"
-        
+    parts = ["📋 *YOUR SUPPORT TICKETS*\n\n"]
+    for ticket_id, issue, status, created_at, admin_notes in tickets:
+        note = ""
         if admin_notes:
-            response += f"💬 *Admin Note:* {admin_notes[:50]}...\n" if len(admin_notes) > 50 else f"💬 *Admin Note:* {admin_notes}\n"
-        
-        response += "\n"
-    
-    await update.message.reply_text(response, parse_mode="Markdown")
+            note = TICKET_NOTE_LINE.format(note=truncate(admin_notes, 50))
+        parts.append(TICKET_ROW.format(
+            status_icon="✅" if status == "resolved" else "⏳" if status == "in_progress" else "🆕",
+            ticket_id=ticket_id,
+            issue=truncate(issue, 50),
+            created=created_at[:16],
+            status=status.title(),
+            note=note,
+        ))
+    
+    await update.message.reply_text("".join(parts), parse_mode="Markdown")
 
 async def messages_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -2349,7 +3300,7 @@ async def messages_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user_id = context.user_data['user_id']
-    messages = user_db.get_user_messages(user_id)
+    messages = await asyncio.to_thread(user_db.get_user_messages, user_id)
     
     if not messages:
         await update.message.reply_text(
@@ -2361,18 +3312,18 @@ async def messages_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    response = "📨 *MESSAGES FROM SUPPORT*\n\n"
-    for msg in messages:
-        msg_id, from_admin_id, message, created_at, is_read = msg
-        read_icon = "📖" if is_read else "📬"
-        
-        response += f"{read_icon} *Message #{msg_id}*\n"
-        response += f"📅 *Date:* {created_at[:16]}\n"
-        response += f"💬 *Message:* {message[:100]}...\n" if len(message) > 100 else f"💬 *Message:* {message}\n"
-        response += "\n"
-    
-    response += "\n*Need to reply?* Use `/support <your message>`"
-    await update.message.reply_text(response, parse_mode="Markdown")
+    parts = ["📨 *MESSAGES FROM SUPPORT*\n\n"]
+    parts.extend(
+        MESSAGE_ROW.format(
+            read_icon="📖" if is_read else "📬",
+            msg_id=msg_id,
+            created=created_at[:16],
+            message=truncate(message, 100),
+        )
+        for msg_id, from_admin_id, message, created_at, is_read in messages
+    )
+    parts.append("\n*Need to reply?* Use `/support <your message>`")
+    await update.message.reply_text("".join(parts), parse_mode="Markdown")
 
 async def ticket_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """View specific ticket details"""
@@ -2388,16 +3339,7 @@ async def ticket_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         ticket_id = int(args[0])
         
-        conn = sqlite3.connect(user_db.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, issue, status, created_at, resolved_at, admin_notes
-            FROM support_tickets 
-            WHERE id = ?
-        ''', (ticket_id,))
-        
-        ticket = cursor.fetchone()
-        conn.close()
+        ticket = await asyncio.to_thread(user_db.get_ticket, ticket_id)
         
         if not ticket:
             await update.message.reply_text(f"❌ Ticket #{ticket_id} not found.", parse_mode="Markdown")
@@ -2457,14 +3399,9 @@ async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             # Save to database
-            conn = sqlite3.connect(user_db.db_file)
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (target_user_id,))
-            user_info = cursor.fetchone()
-            conn.close()
-            
-            if user_info:
-                user_db.send_admin_message(user.id, user_info[0], message)
+            target_db_id = await asyncio.to_thread(user_db.get_user_id, target_user_id)
+            if target_db_id:
+                await asyncio.to_thread(user_db.send_admin_message, user.id, target_db_id, message)
             
             await update.message.reply_text(
                 f"✅ *Message sent successfully!*\n\n"
@@ -2486,6 +3423,44 @@ async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ========================
 # ADMIN COMMANDS - FIXED
 # ========================
+# Row templates for the admin listings; each response is built as a list and joined once
+ADMIN_TICKET_ROW = (
+    "{i}. *Ticket #{ticket_id}*\n"
+    "   👤 *User:* {first_name}{username_display}\n"
+    "   🆔 *Telegram ID:* {telegram_id}\n"
+    "   📝 *Issue:* {issue}\n"
+    "   📅 *Created:* {created}\n"
+    "   💬 *Reply:* `/reply {telegram_id} <message>`\n\n"
+)
+ADMIN_USER_ROW = (
+    "*{i}. {first_name}{username_display}*\n"
+    "   ├─ ID: `{user_id}`\n"
+    "   ├─ Status: {status}\n"
+    "   ├─ Type: {account_type}\n"
+    "   └─ Joined: {joined}\n\n"
+)
+ADMIN_SEARCH_ROW = (
+    "*{i}. {first_name}{username_display}*\n"
+    "   ├─ ID: `{user_id}`\n"
+    "   ├─ Telegram: `{telegram_id}`\n"
+    "   ├─ Status: {status}\n"
+    "{email_line}"
+    "   └─ Joined: {joined}\n\n"
+)
+ADMIN_DONATION_ROW = (
+    "{i}. {status_icon} *${amount:.2f}*\n"
+    "   ├─ By: {donor}{username_display}\n"
+    "   ├─ User ID: {user_id}\n"
+    "   ├─ TXID: {txid}\n"
+    "   └─ Date: {created}\n\n"
+)
+PENDING_DONATION_ROW = (
+    "{i}. User {user_id} ({first_name})\n"
+    "   Amount: ${amount:.2f}\n"
+    "   TXID: {txid}\n"
+    "   Date: {created}\n\n"
+)
+
 async def admin_support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """View support tickets - FIXED"""
     user = update.effective_user
@@ -2494,197 +3469,167 @@ async def admin_support_command(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("⛔ Unauthorized. Admin only.", parse_mode="Markdown")
         return
     
-    tickets = user_db.get_open_tickets()
+    tickets = await asyncio.to_thread(user_db.get_open_tickets)
     
     if not tickets:
         await update.message.reply_text("✅ No open support tickets.", parse_mode="Markdown")
         return
     
-    response = "🆘 *OPEN SUPPORT TICKETS*\n\n"
-    for i, ticket in enumerate(tickets, 1):
-        ticket_id, user_id, telegram_id, username, first_name, issue, created_at = ticket
-        
-        username_display = f" (@{username})" if username else ""
-        
-        response += f"{i}. *Ticket #{ticket_id}*\n"
-        response += f"   👤 *User:* {first_name}{username_display}\n"
-        response += f"   🆔 *Telegram ID:* {telegram_id}\n"
-        issue_preview = issue[:50] + "..." if len(issue) > 50 else issue
-        response += f"   📝 *Issue:* {issue_preview}\n"
-        response += f"   📅 *Created:* {created_at[:16]}\n"
-        response += f"   💬 *Reply:* `/reply {telegram_id} <message>`\n\n"
+    parts = ["🆘 *OPEN SUPPORT TICKETS*\n\n"]
+    parts.extend(
+        ADMIN_TICKET_ROW.format(
+            i=i,
+            ticket_id=ticket_id,
+            first_name=first_name,
+            username_display=f" (@{username})" if username else "",
+            telegram_id=telegram_id,
+            issue=truncate(issue, 50),
+            created=created_at[:16],
+        )
+        for i, (ticket_id, user_id, telegram_id, username, first_name, issue, created_at) in enumerate(tickets, 1)
+    )
     
-    await update.message.reply_text(response, parse_mode="Markdown")
+    await update.message.reply_text("".join(parts), parse_mode="Markdown")
+
+ADMIN_PAGE_PREFIX = "admin_page:"
+
+def admin_next_keyboard(kind, rows, remaining, start):
+    """'Next' button carrying the keyset cursor (last row's id) and numbering, or None on the last page"""
+    if remaining <= len(rows):
+        return None
+    cursor = f"{ADMIN_PAGE_PREFIX}{kind}:{rows[-1][0]}:{start + len(rows)}"
+    return InlineKeyboardMarkup([[InlineKeyboardButton("➡️ Next", callback_data=cursor)]])
+
+async def send_admin_page(update, text, reply_markup=None):
+    """Commands and menu buttons get a new message; 'Next' presses replace the page in place"""
+    query = update.callback_query
+    if query and query.data.startswith(ADMIN_PAGE_PREFIX):
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=reply_markup)
+    else:
+        await update.effective_message.reply_text(text, parse_mode="Markdown", reply_markup=reply_markup)
 
-async def admin_list_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def admin_list_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE, before_id=None, start=1):
     """List all users - FIXED"""
     try:
-        conn = sqlite3.connect(user_db.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT id, telegram_id, username, first_name, email, 
-                   created_at, account_type, is_active
-            FROM users 
-            ORDER BY created_at DESC 
-            LIMIT 50
-        ''')
-        
-        users = cursor.fetchall()
-        conn.close()
+        total_users, users = await asyncio.to_thread(user_db.list_users, ADMIN_PAGE_SIZE, before_id)
         
         if not users:
             response = "📭 *No registered users yet.*"
         else:
-            response = f"👥 *REGISTERED USERS*\n"
-            response += f"*Total Users:* {total_users}\n\n"
-            
-            for i, user_data in enumerate(users, 1):
-                user_id, telegram_id, username, first_name, email, created_at, account_type, is_active = user_data
-                
-                status = "✅ Active" if is_active else "❌ Banned"
-                username_display = f" (@{username})" if username else ""
-                
-                response += f"*{i}. {first_name}{username_display}*\n"
-                response += f"   ├─ ID: `{user_id}`\n"
-                response += f"   ├─ Status: {status}\n"
-                response += f"   ├─ Type: {account_type.title()}\n"
-                response += f"   └─ Joined: {created_at[:10]}\n\n"
+            label = "Total Users" if start == 1 else "Remaining"
+            parts = [f"👥 *REGISTERED USERS*\n*{label}:* {total_users}\n\n"]
+            parts.extend(
+                ADMIN_USER_ROW.format(
+                    i=i,
+                    first_name=first_name,
+                    username_display=f" (@{username})" if username else "",
+                    user_id=user_id,
+                    status="✅ Active" if is_active else "❌ Banned",
+                    account_type=account_type.title(),
+                    joined=created_at[:10],
+                )
+                for i, (user_id, telegram_id, username, first_name, email, created_at, account_type, is_active) in enumerate(users, start)
+            )
+            response = "".join(parts)
         
-        await update.message.reply_text(response, parse_mode="Markdown")
+        await send_admin_page(update, response, admin_next_keyboard("users", users, total_users, start))
     except Exception as e:
         logger.error(f"Admin users list error: {e}")
-        await update.message.reply_text("❌ Error fetching users.", parse_mode="Markdown")
+        await update.effective_message.reply_text("❌ Error fetching users.", parse_mode="Markdown")
 
 async def admin_search_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE, search_query: str):
     """Search users - FIXED"""
     try:
-        conn = sqlite3.connect(user_db.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, telegram_id, username, first_name, email, created_at, is_active
-            FROM users 
-            WHERE username LIKE ? OR first_name LIKE ? OR email LIKE ?
-            ORDER BY created_at DESC 
-            LIMIT 20
-        ''', (f"%{search_query}%", f"%{search_query}%", f"%{search_query}%"))
-        
-        users = cursor.fetchall()
-        conn.close()
+        users = await asyncio.to_thread(user_db.search_users, search_query)
         
         if not users:
             await update.message.reply_text(f"❌ No users found for '{search_query}'", parse_mode="Markdown")
         else:
-            response = f"🔍 *SEARCH RESULTS: '{search_query}'*\n\n"
-            for i, user_data in enumerate(users, 1):
-                user_id, telegram_id, username, first_name, email, created_at, is_active = user_data
-                
-                status = "✅ Active" if is_active else "❌ Banned"
-                username_display = f" (@{username})" if username else ""
-                
-                response += f"*{i}. {first_name}{username_display}*\n"
-                response += f"   ├─ ID: `{user_id}`\n"
-                response += f"   ├─ Telegram: `{telegram_id}`\n"
-                response += f"   ├─ Status: {status}\n"
-                if email:
-                    response += f"   ├─ Email: {email}\n"
-                response += f"   └─ Joined: {created_at[:10]}\n\n"
+            parts = [f"🔍 *SEARCH RESULTS: '{search_query}'*\n\n"]
+            parts.extend(
+                ADMIN_SEARCH_ROW.format(
+                    i=i,
+                    first_name=first_name,
+                    username_display=f" (@{username})" if username else "",
+                    user_id=user_id,
+                    telegram_id=telegram_id,
+                    status="✅ Active" if is_active else "❌ Banned",
+                    email_line=f"   ├─ Email: {email}\n" if email else "",
+                    joined=created_at[:10],
+                )
+                for i, (user_id, telegram_id, username, first_name, email, created_at, is_active) in enumerate(users, 1)
+            )
             
-            await update.message.reply_text(response, parse_mode="Markdown")
+            await update.message.reply_text("".join(parts), parse_mode="Markdown")
     except Exception as e:
         logger.error(f"Admin search error: {e}")
         await update.message.reply_text("❌ Error searching users.", parse_mode="Markdown")
 
-async def admin_donations_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def admin_donations_command(update: Update, context: ContextTypes.DEFAULT_TYPE, before_id=None, start=1):
     """View all donations - FIXED"""
     try:
-        conn = sqlite3.connect(user_db.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM donations')
-        total_donations = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT d.id, d.user_id, u.first_name, u.username, 
-                   d.amount, d.status, d.transaction_id, d.created_at
-            FROM donations d
-            LEFT JOIN users u ON d.user_id = u.id
-            ORDER BY d.created_at DESC 
-            LIMIT 20
-        ''')
-        
-        donations = cursor.fetchall()
-        conn.close()
+        total_donations, donations = await asyncio.to_thread(user_db.list_donations, ADMIN_PAGE_SIZE, before_id)
         
         if not donations:
             response = "💸 *No donations yet.*"
         else:
-            response = f"💰 *ALL DONATIONS*\n"
-            response += f"*Total Donations:* {total_donations}\n\n"
-            
-            for i, donation in enumerate(donations, 1):
-                donation_id, user_id, first_name, username, amount, status, txid, created_at = donation
-                
-                status_icon = "✅" if status == "verified" else "⏳"
-                username_display = f" (@{username})" if username else ""
-                
-                response += f"{i}. {status_icon} *${amount:.2f}*\n"
-                response += f"   ├─ By: {first_name or 'Guest'}{username_display}\n"
-                response += f"   ├─ User ID: {user_id}\n"
-                response += f"   ├─ TXID: {txid[:15]}..." if txid else "\n   ├─ TXID: Not provided"
-                response += f"\n   └─ Date: {created_at[:16]}\n\n"
+            label = "Total Donations" if start == 1 else "Remaining"
+            parts = [f"💰 *ALL DONATIONS*\n*{label}:* {total_donations}\n\n"]
+            parts.extend(
+                ADMIN_DONATION_ROW.format(
+                    i=i,
+                    status_icon="✅" if status == "verified" else "⏳",
+                    amount=amount,
+                    donor=first_name or 'Guest',
+                    username_display=f" (@{username})" if username else "",
+                    user_id=user_id,
+                    txid=f"{txid[:15]}..." if txid else "Not provided",
+                    created=created_at[:16],
+                )
+                for i, (donation_id, user_id, first_name, username, amount, status, txid, created_at) in enumerate(donations, start)
+            )
+            response = "".join(parts)
         
-        await update.message.reply_text(response, parse_mode="Markdown")
+        await send_admin_page(update, response, admin_next_keyboard("donations", donations, total_donations, start))
     except Exception as e:
         logger.error(f"Admin donations error: {e}")
-        await update.message.reply_text("❌ Error fetching donations.", parse_mode="Markdown")
+        await update.effective_message.reply_text("❌ Error fetching donations.", parse_mode="Markdown")
 
-async def admin_pending_donations_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def admin_pending_donations_command(update: Update, context: ContextTypes.DEFAULT_TYPE, before_id=None, start=1):
     """View pending donations - FIXED"""
-    conn = sqlite3.connect(user_db.db_file)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM donations WHERE status = "pending" ORDER BY created_at DESC')
-    pending = cursor.fetchall()
-    conn.close()
+    remaining, pending = await asyncio.to_thread(user_db.get_pending_donations, ADMIN_PAGE_SIZE, before_id)
     
     if not pending:
-        await update.message.reply_text("✅ No pending donations.", parse_mode="Markdown")
+        await send_admin_page(update, "✅ No pending donations.")
         return
     
-    response = "⏳ *PENDING DONATIONS*\n\n"
-    for i, donation in enumerate(pending):
-        response += f"{i+1}. User {donation[1]} ({donation[3]})\n"
-        response += f"   Amount: ${donation[4]:.2f}\n"
-        response += f"   TXID: {donation[6]}\n"
-        response += f"   Date: {donation[7][:16]}\n\n"
-    
-    response += "*To verify:* `/admin verify TXID`"
-    await update.message.reply_text(response, parse_mode="Markdown")
+    parts = ["⏳ *PENDING DONATIONS*\n\n"]
+    parts.extend(
+        PENDING_DONATION_ROW.format(i=i, user_id=user_id, first_name=first_name, amount=amount, txid=txid, created=created_at[:16])
+        for i, (donation_id, user_id, first_name, amount, txid, created_at) in enumerate(pending, start)
+    )
+    parts.append("*To verify:* `/admin verify TXID`")
+    await send_admin_page(update, "".join(parts), admin_next_keyboard("pending", pending, remaining, start))
+
+# Listing behind each 'Next' button's kind
+ADMIN_PAGE_HANDLERS = {
+    "users": admin_list_users_command,
+    "donations": admin_donations_command,
+    "pending": admin_pending_donations_command,
+}
 
 async def admin_dbstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Database statistics - FIXED"""
     try:
-        conn = sqlite3.connect(user_db.db_file)
-        cursor = conn.cursor()
-        
-        tables = ['users', 'donations', 'supporters', 'user_stats', 'sessions', 'guest_tracking', 'support_tickets', 'admin_messages']
-        stats = []
+        table_counts = await asyncio.to_thread(user_db.get_table_counts)
+        stats = [f"• {table}: {count} rows" for table, count in table_counts]
         
-        for table in tables:
-            cursor.execute(f'SELECT COUNT(*) FROM {table}')
-            count = cursor.fetchone()[0]
-            stats.append(f"• {table}: {count} rows")
-        
-        import os
-        db_size = os.path.getsize(user_db.db_file) if os.path.exists(user_db.db_file) else 0
+        try:
+            db_size = (await asyncio.to_thread(os.stat, user_db.db_file)).st_size
+        except OSError:
+            db_size = 0
         db_size_mb = db_size / (1024 * 1024)
         
-        conn.close()
-        
         response = f"""
 🗄️ *DATABASE STATISTICS*
 
@@ -2710,6 +3655,15 @@ async def admin_dbstats_command(update: Update, context: ContextTypes.DEFAULT_TY
 # ========================
 # ADMIN USER MANAGEMENT - FIXED VERSION
 # ========================
+ADMIN_USERS_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👥 List Users", callback_data='admin_list_users'),
+     InlineKeyboardButton("🔍 Search User", callback_data='admin_search_user')],
+    [InlineKeyboardButton("🗑️ Delete User", callback_data='admin_delete_user'),
+     InlineKeyboardButton("🔄 Reset Password", callback_data='admin_reset_password')],
+    [InlineKeyboardButton("🔒 Ban/Unban", callback_data='admin_ban_user'),
+     InlineKeyboardButton("📊 User Stats", callback_data='admin_user_stats')]
+])
+
 async def admin_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin command to list and manage users - FIXED"""
     user = update.effective_user
@@ -2723,16 +3677,6 @@ async def admin_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     if not args:
         # Show user management menu
-        keyboard = [
-            [InlineKeyboardButton("👥 List Users", callback_data='admin_list_users'),
-             InlineKeyboardButton("🔍 Search User", callback_data='admin_search_user')],
-            [InlineKeyboardButton("🗑️ Delete User", callback_data='admin_delete_user'),
-             InlineKeyboardButton("🔄 Reset Password", callback_data='admin_reset_password')],
-            [InlineKeyboardButton("🔒 Ban/Unban", callback_data='admin_ban_user'),
-             InlineKeyboardButton("📊 User Stats", callback_data='admin_user_stats')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             "👑 *USER MANAGEMENT*\n\n"
             "Manage user accounts with these options:\n\n"
@@ -2744,7 +3688,7 @@ async def admin_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             "• `/adminusers info <user_id>` - User details\n\n"
             "Or click buttons below:",
             parse_mode="Markdown",
-            reply_markup=reply_markup
+            reply_markup=ADMIN_USERS_MENU_KEYBOARD
         )
         return
     
@@ -2756,7 +3700,7 @@ async def admin_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif cmd == "delete" and len(args) > 1:
         try:
             target_user_id = int(args[1])
-            success, message = user_db.delete_user(target_user_id)
+            success, message = await asyncio.to_thread(user_db.delete_user, target_user_id)
             await update.message.reply_text(f"{'✅' if success else '❌'} {message}", parse_mode="Markdown")
         except ValueError:
             await update.message.reply_text("❌ Invalid user ID.", parse_mode="Markdown")
@@ -2764,7 +3708,7 @@ async def admin_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif cmd == "reset" and len(args) > 1:
         try:
             target_user_id = int(args[1])
-            success, message = user_db.admin_reset_password(target_user_id)
+            success, message = await user_db.run_kdf(user_db.admin_reset_password, target_user_id)
             await update.message.reply_text(f"{'✅' if success else '❌'} {message}", parse_mode="Markdown")
         except ValueError:
             await update.message.reply_text("❌ Invalid user ID.", parse_mode="Markdown")
@@ -2773,7 +3717,7 @@ async def admin_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         try:
             target_user_id = int(args[1])
             action = args[2] if len(args) > 2 else "ban"
-            success, message = user_db.ban_user(target_user_id, action)
+            success, message = await asyncio.to_thread(user_db.ban_user, target_user_id, action)
             await update.message.reply_text(f"{'✅' if success else '❌'} {message}", parse_mode="Markdown")
         except ValueError:
             await update.message.reply_text("❌ Invalid user ID.", parse_mode="Markdown")
@@ -2781,7 +3725,7 @@ async def admin_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif cmd == "info" and len(args) > 1:
         try:
             target_user_id = int(args[1])
-            profile = user_db.get_user_profile(target_user_id)
+            profile = await asyncio.to_thread(user_db.get_user_profile, target_user_id)
             
             if profile:
                 response = f"""
@@ -2877,8 +3821,8 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await admin_list_users_command(update, context)
     
     elif cmd == "stats":
-        stats = get_enhanced_stats()
-        real_stats = user_db.get_stats()
+        real_stats = await asyncio.to_thread(user_db.get_stats)
+        stats = get_enhanced_stats(real_stats)
         
         response = f"""
 📊 *SYSTEM STATISTICS*
@@ -2910,16 +3854,23 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif cmd == "verify":
         if len(args) < 2:
-            await update.message.reply_text("❌ Usage: `/admin verify TXID`", parse_mode="Markdown")
+            await update.message.reply_text("❌ Usage: `/admin verify TXID [TXID ...]`", parse_mode="Markdown")
             return
         
-        transaction_id = args[1]
-        success = user_db.verify_donation(transaction_id)
+        transaction_ids = args[1:]
+        verified = await asyncio.to_thread(user_db.verify_donations, transaction_ids)
+        failed = [txid for txid in transaction_ids if txid not in verified]
         
-        if success:
-            await update.message.reply_text(f"✅ Donation `{transaction_id}` verified!", parse_mode="Markdown")
-        else:
-            await update.message.reply_text(f"❌ Could not verify donation `{transaction_id}`", parse_mode="Markdown")
+        if verified:
+            await update.message.reply_text(
+                "✅ Verified: " + ", ".join(f"`{txid}`" for txid in verified),
+                parse_mode="Markdown"
+            )
+        if failed:
+            await update.message.reply_text(
+                "❌ Could not verify: " + ", ".join(f"`{txid}`" for txid in failed),
+                parse_mode="Markdown"
+            )
     
     elif cmd == "dbstats":
         await admin_dbstats_command(update, context)
@@ -2938,6 +3889,15 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ========================
 # USER PROFILE EDITING
 # ========================
+EDIT_PROFILE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Change Name", callback_data='edit_name'),
+     InlineKeyboardButton("📱 Change Phone", callback_data='edit_phone')],
+    [InlineKeyboardButton("📧 Change Email", callback_data='edit_email'),
+     InlineKeyboardButton("🔐 Change Password", callback_data='edit_password')],
+    [InlineKeyboardButton("👤 View Profile", callback_data='profile'),
+     InlineKeyboardButton("❌ Cancel", callback_data='cancel_edit')]
+])
+
 async def editprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Allow users to edit their profile"""
     user = update.effective_user
@@ -2955,16 +3915,6 @@ async def editprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     if not args:
         # Show edit menu
-        keyboard = [
-            [InlineKeyboardButton("📝 Change Name", callback_data='edit_name'),
-             InlineKeyboardButton("📱 Change Phone", callback_data='edit_phone')],
-            [InlineKeyboardButton("📧 Change Email", callback_data='edit_email'),
-             InlineKeyboardButton("🔐 Change Password", callback_data='edit_password')],
-            [InlineKeyboardButton("👤 View Profile", callback_data='profile'),
-             InlineKeyboardButton("❌ Cancel", callback_data='cancel_edit')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             "⚙️ *EDIT YOUR PROFILE*\n\n"
             "What would you like to change?\n\n"
@@ -2974,7 +3924,7 @@ async def editprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             "• `/editprofile password` (will ask for new password)\n\n"
             "Or click buttons below:",
             parse_mode="Markdown",
-            reply_markup=reply_markup
+            reply_markup=EDIT_PROFILE_KEYBOARD
         )
         return
     
@@ -2983,7 +3933,7 @@ async def editprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     field = args[0].lower()
     
     if field == "password":
-        context.user_data[f"change_password_{user.id}"] = True
+        context.user_data["change_password"] = True
         await update.message.reply_text(
             "🔐 *CHANGE PASSWORD*\n\n"
             "Please enter your current password:",
@@ -3001,9 +3951,9 @@ async def editprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             return
         
-        success = user_db.update_user_profile(user_id, 'first_name', name_parts[0])
+        success = await asyncio.to_thread(user_db.update_user_profile, user_id, 'first_name', name_parts[0])
         if len(name_parts) > 1:
-            user_db.update_user_profile(user_id, 'last_name', ' '.join(name_parts[1:]))
+            await asyncio.to_thread(user_db.update_user_profile, user_id, 'last_name', ' '.join(name_parts[1:]))
         
         if success:
             context.user_data['first_name'] = name_parts[0]
@@ -3013,8 +3963,8 @@ async def editprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     elif field == "phone" and len(args) > 1:
         new_phone = args[1]
-        if re.match(r'^\+?[1-9]\d{1,14}$', new_phone):
-            success = user_db.update_user_profile(user_id, 'phone', new_phone)
+        if PHONE_RE.fullmatch(new_phone):
+            success = await asyncio.to_thread(user_db.update_user_profile, user_id, 'phone', new_phone)
             if success:
                 await update.message.reply_text(f"✅ Phone updated to: {new_phone}", parse_mode="Markdown")
             else:
@@ -3029,8 +3979,8 @@ async def editprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     elif field == "email" and len(args) > 1:
         new_email = args[1]
-        if re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', new_email):
-            success = user_db.update_user_profile(user_id, 'email', new_email)
+        if EMAIL_RE.fullmatch(new_email):
+            success = await asyncio.to_thread(user_db.update_user_profile, user_id, 'email', new_email)
             if success:
                 await update.message.reply_text(f"✅ Email updated to: {new_email}", parse_mode="Markdown")
             else:
@@ -3056,6 +4006,13 @@ async def editprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 # ========================
 # CHAT ROOM COMMANDS
 # ========================
+CHATROOM_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Create Chat Room", callback_data='create_chat'),
+     InlineKeyboardButton("🔗 Join Chat Room", callback_data='join_chat')],
+    [InlineKeyboardButton("👥 My Chats", callback_data='my_chats'),
+     InlineKeyboardButton("❌ Leave Chat", callback_data='leave_chat')]
+])
+
 async def chatroom_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Create or join a chat room"""
     user = update.effective_user
@@ -3063,14 +4020,6 @@ async def chatroom_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = context.args
     
     if not args:
-        keyboard = [
-            [InlineKeyboardButton("➕ Create Chat Room", callback_data='create_chat'),
-             InlineKeyboardButton("🔗 Join Chat Room", callback_data='join_chat')],
-            [InlineKeyboardButton("👥 My Chats", callback_data='my_chats'),
-             InlineKeyboardButton("❌ Leave Chat", callback_data='leave_chat')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             "💬 *CHAT ROOMS*\n\n"
             "Connect with other users or support in real-time!\n\n"
@@ -3082,7 +4031,7 @@ async def chatroom_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• `/chatroom list` - List your active chats\n\n"
             "Or click buttons below:",
             parse_mode="Markdown",
-            reply_markup=reply_markup
+            reply_markup=CHATROOM_MENU_KEYBOARD
         )
         return
     
@@ -3118,7 +4067,7 @@ async def chatroom_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             chat_id=u_id,
                             text=f"👋 *{user.first_name} has joined the chat!*"
                         )
-                    except:
+                    except TelegramError:
                         pass
             
             await update.message.reply_text(
@@ -3145,7 +4094,7 @@ async def chatroom_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         chat_id=u_id,
                         text=f"👋 *{user.first_name} has left the chat.*"
                     )
-                except:
+                except TelegramError:
                     pass
             
             await update.message.reply_text("✅ Left the chat room", parse_mode="Markdown")
@@ -3167,7 +4116,7 @@ async def chatroom_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     user_info = await context.bot.get_chat(u_id)
                     prefix = "👑 " if u_id == chat_info.get('admin') else "👤 "
                     response += f"{prefix}{user_info.first_name}\n"
-                except:
+                except TelegramError:
                     response += f"👤 User {u_id}\n"
             
             await update.message.reply_text(response, parse_mode="Markdown")
@@ -3196,320 +4145,296 @@ async def chatroom_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ========================
 # BUTTON HANDLERS
 # ========================
+# Buttons that only swap the menu text for a fixed message
+CALLBACK_TEXTS = {
+    'register': (
+        "📝 *START REGISTRATION*\n\n"
+        "Start creating your account with:\n"
+        "`/register`\n\n"
+        "Follow the 5-step process:\n"
+        "1. Your name\n"
+        "2. Phone number\n"
+        "3. Email address\n"
+        "4. Create password\n"
+        "5. Confirm password\n\n"
+        "*Start now:* `/register`"
+    ),
+    'login': (
+        "🔐 *LOGIN TO ACCOUNT*\n\n"
+        "Login to your account with:\n"
+        "`/login yourpassword`\n\n"
+        "*Example:* `/login MySecurePass123`\n\n"
+        "Forgot password? Use `/forgotpassword`"
+    ),
+    'forgot_password': (
+        "🔓 *FORGOT PASSWORD*\n\n"
+        "Need help with your password?\n\n"
+        "Use the command:\n"
+        "`/forgotpassword`\n\n"
+        "This will start the password reset process."
+    ),
+    'support': (
+        "🆘 *SUPPORT CENTER*\n\n"
+        "Need help? We're here for you!\n\n"
+        "*Quick Options:*\n"
+        "• `/support <message>` - Contact support\n"
+        "• `/mytickets` - View your tickets\n"
+        "• `/forgotpassword` - Password help\n"
+        "• `/help` - All commands\n\n"
+        "We respond within 24 hours! ⏰"
+    ),
+    'i_donated': (
+        "✅ *PAYMENT CONFIRMATION*\n\n"
+        "Please send your transaction ID as a message.\n\n"
+        "*Format:* `TXID123456789`\n\n"
+        "We'll verify your payment and update your supporter status!"
+    ),
+    'create_image': (
+        "🎨 *IMAGE CREATION*\n\n"
+        "Create amazing images with AI!\n\n"
+        "*Usage:* `/image <description>`\n\n"
+        "*Examples:*\n"
+        "• `/image sunset over mountains`\n"
+        "• `/image cyberpunk city at night`\n"
+        "• `/image cute cat wearing glasses`\n\n"
+        "Try it now!"
+    ),
+    'find_music': (
+        "🎵 *MUSIC SEARCH*\n\n"
+        "Find songs and artists on YouTube!\n\n"
+        "*Usage:* `/music <song or artist>`\n\n"
+        "*Examples:*\n"
+        "• `/music Bohemian Rhapsody`\n"
+        "• `/music Taylor Swift`\n"
+        "• `/music chill lofi beats`\n\n"
+        "Get direct YouTube links to listen!"
+    ),
+    'chat': (
+        "💬 *LET'S CHAT!*\n\n"
+        "I'm here to talk about anything! 😊\n\n"
+        "*Just type your message and I'll respond naturally!*\n\n"
+        "What's on your mind? 🎭"
+    ),
+    'cancel_edit': "❌ Profile edit cancelled.",
+}
+
+# Buttons that arm a user_data flag and ask for the next message
+CALLBACK_PROMPTS = {
+    'admin_search_user': (
+        "admin_search",
+        "🔍 *SEARCH USER*\n\n"
+        "Please enter search query (username, name, email, or ID):"
+    ),
+    'admin_delete_user': (
+        "admin_delete",
+        "🗑️ *DELETE USER*\n\n"
+        "Please enter user ID to delete:"
+    ),
+    'admin_reset_password': (
+        "admin_reset",
+        "🔄 *RESET PASSWORD*\n\n"
+        "Please enter user ID to reset password:"
+    ),
+    'admin_ban_user': (
+        "admin_ban",
+        "🔒 *BAN/UNBAN USER*\n\n"
+        "Please enter user ID to ban/unban:\n\n"
+        "*Format:* `<user_id> <ban/unban>`\n"
+        "*Example:* `123456789 ban`"
+    ),
+    'donate_custom': (
+        "waiting_custom",
+        "💰 *CUSTOM DONATION AMOUNT*\n\n"
+        "Please enter the amount you want to donate (in USD):\n\n"
+        "*Examples:*\n"
+        "• `7.50` (for $7.50)\n"
+        "• `15` (for $15)\n"
+        "• `25` (for $25)\n\n"
+        "Enter amount:"
+    ),
+    'create_chat': (
+        "waiting_chat_name",
+        "💬 *CREATE CHAT ROOM*\n\n"
+        "Please enter a name for your chat room:\n\n"
+        "*Examples:*\n"
+        "• StarAI Support\n"
+        "• Tech Discussion\n"
+        "• Casual Chat\n\n"
+        "Enter chat room name:"
+    ),
+    'join_chat': (
+        "waiting_chat_code",
+        "🔗 *JOIN CHAT ROOM*\n\n"
+        "Please enter the chat room code:\n\n"
+        "*Format:* `chat_xxxxxxxx`\n\n"
+        "Enter chat room code:"
+    ),
+    'edit_name': (
+        "waiting_new_name",
+        "📝 *CHANGE NAME*\n\n"
+        "Please enter your new full name:\n\n"
+        "*Format:* First Name Last Name\n"
+        "*Example:* John Doe\n\n"
+        "Enter new name:"
+    ),
+    'edit_phone': (
+        "waiting_new_phone",
+        "📱 *CHANGE PHONE*\n\n"
+        "Please enter your new phone number:\n\n"
+        "*Format:* +1234567890\n"
+        "*Example:* +1234567890\n\n"
+        "Enter new phone:"
+    ),
+    'edit_email': (
+        "waiting_new_email",
+        "📧 *CHANGE EMAIL*\n\n"
+        "Please enter your new email address:\n\n"
+        "*Format:* your.email@example.com\n"
+        "*Example:* john.doe@example.com\n\n"
+        "Enter new email:"
+    ),
+}
+
+SUPPORT_ISSUE_EXAMPLES = {
+    'password': "I need help with my password",
+    'account': "I'm having account issues",
+    'donation': "I need help with donations",
+    'bug': "I found a bug or problem",
+    'other': "I have another issue"
+}
+
+UNKNOWN_CALLBACK_TEXT = (
+    "🤔 *Not sure what you clicked!*\n\n"
+    "Try these commands:\n"
+    "• `/image` - Create images\n"
+    "• `/music` - Find songs\n"
+    "• `/joke` - Get a laugh\n"
+    "• `/donate` - Support bot\n\n"
+    "Or just chat with me! 💬"
+)
+
+async def joke_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(JOKE_BUTTON_REPLIES[joke_deck.deal()], parse_mode="Markdown")
+
+async def fact_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(FACT_BUTTON_REPLIES[fact_deck.deal()], parse_mode="Markdown")
+
+async def quote_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(QUOTE_BUTTON_REPLIES[quote_deck.deal()], parse_mode="Markdown")
+
+async def leave_chat_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.from_user.id in chat_manager.user_chats:
+        chat_id = chat_manager.user_chats[query.from_user.id]
+        chat_manager.remove_user(chat_id, query.from_user.id)
+        await query.edit_message_text("✅ Left the chat room", parse_mode="Markdown")
+    else:
+        await query.edit_message_text("❌ You're not in any chat room", parse_mode="Markdown")
+
+async def edit_password_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if 'user_id' not in context.user_data:
+        await query.edit_message_text("🔒 Please login first: `/login`", parse_mode="Markdown")
+        return
+    
+    context.user_data["change_password"] = True
+    await query.edit_message_text(
+        "🔐 *CHANGE PASSWORD*\n\n"
+        "Please enter your current password:",
+        parse_mode="Markdown"
+    )
+
+async def admin_page_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.from_user.id in ADMIN_IDS:
+        kind, before_id, start = query.data[len(ADMIN_PAGE_PREFIX):].split(":")
+        await ADMIN_PAGE_HANDLERS[kind](update, context, int(before_id), int(start))
+
+async def support_type_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    issue_type = query.data.replace('support_', '')
+    
+    context.user_data["support_type"] = issue_type
+    await query.edit_message_text(
+        f"📝 *{issue_type.upper()} SUPPORT*\n\n"
+        f"Please describe your issue in detail:\n\n"
+        f"*Example:* '{SUPPORT_ISSUE_EXAMPLES[issue_type]} because...'\n\n"
+        f"Type your message now:",
+        parse_mode="Markdown"
+    )
+
+async def donate_amount_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    amount = int(update.callback_query.data.split('_')[1])
+    await show_payment_options(update, context, amount)
+
+# Buttons that run a handler
+CALLBACK_HANDLERS = {
+    'admin_list_users': admin_list_users_command,
+    'admin_user_stats': admin_command,
+    'profile': profile_command,
+    'messages': messages_command,
+    'donate': donate_command,
+    'my_donations': mydonations_command,
+    'back_to_menu': start,
+    'get_joke': joke_button,
+    'get_fact': fact_button,
+    'get_quote': quote_button,
+    'my_chats': chatroom_command,
+    'leave_chat': leave_chat_button,
+    'edit_password': edit_password_button,
+    'help': help_command,
+    'about': about_command,
+}
+
+# Parameterised callback_data, tried only when no exact entry matches
+CALLBACK_PREFIX_HANDLERS = (
+    (ADMIN_PAGE_PREFIX, admin_page_button),
+    ('support_', support_type_button),
+    ('donate_', donate_amount_button),
+)
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    logger.info(f"Button pressed: {query.data}")
-    
-    # Admin callbacks - ADD THESE
-    if query.data == 'admin_list_users':
-        await admin_list_users_command(update, context)
-        
-    elif query.data == 'admin_search_user':
-        context.user_data[f"admin_search_{query.from_user.id}"] = True
-        await query.edit_message_text(
-            "🔍 *SEARCH USER*\n\n"
-            "Please enter search query (username, name, email, or ID):",
-            parse_mode="Markdown"
-        )
-        
-    elif query.data == 'admin_delete_user':
-        context.user_data[f"admin_delete_{query.from_user.id}"] = True
-        await query.edit_message_text(
-            "🗑️ *DELETE USER*\n\n"
-            "Please enter user ID to delete:",
-            parse_mode="Markdown"
-        )
-        
-    elif query.data == 'admin_reset_password':
-        context.user_data[f"admin_reset_{query.from_user.id}"] = True
-        await query.edit_message_text(
-            "🔄 *RESET PASSWORD*\n\n"
-            "Please enter user ID to reset password:",
-            parse_mode="Markdown"
-        )
-        
-    elif query.data == 'admin_ban_user':
-        context.user_data[f"admin_ban_{query.from_user.id}"] = True
-        await query.edit_message_text(
-            "🔒 *BAN/UNBAN USER*\n\n"
-            "Please enter user ID to ban/unban:\n\n"
-            "*Format:* `<user_id> <ban/unban>`\n"
-            "*Example:* `123456789 ban`",
-            parse_mode="Markdown"
-        )
-        
-    elif query.data == 'admin_user_stats':
-        await admin_command(update, context)
-    
-    # Existing button handlers...
-    elif query.data == 'register':
-        await query.edit_message_text(
-            "📝 *START REGISTRATION*\n\n"
-            "Start creating your account with:\n"
-            "`/register`\n\n"
-            "Follow the 5-step process:\n"
-            "1. Your name\n"
-            "2. Phone number\n"
-            "3. Email address\n"
-            "4. Create password\n"
-            "5. Confirm password\n\n"
-            "*Start now:* `/register`",
-            parse_mode="Markdown"
-        )
-    
-    elif query.data == 'login':
-        await query.edit_message_text(
-            "🔐 *LOGIN TO ACCOUNT*\n\n"
-            "Login to your account with:\n"
-            "`/login yourpassword`\n\n"
-            "*Example:* `/login MySecurePass123`\n\n"
-            "Forgot password? Use `/forgotpassword`",
-            parse_mode="Markdown"
-        )
-    
-    elif query.data == 'forgot_password':
-        await query.edit_message_text(
-            "🔓 *FORGOT PASSWORD*\n\n"
-            "Need help with your password?\n\n"
-            "Use the command:\n"
-            "`/forgotpassword`\n\n"
-            "This will start the password reset process.",
-            parse_mode="Markdown"
-        )
-    
-    elif query.data == 'profile':
-        await profile_command(update, context)
-    
-    elif query.data == 'messages':
-        await messages_command(update, context)
-    
-    elif query.data == 'support':
-        await query.edit_message_text(
-            "🆘 *SUPPORT CENTER*\n\n"
-            "Need help? We're here for you!\n\n"
-            "*Quick Options:*\n"
-            "• `/support <message>` - Contact support\n"
-            "• `/mytickets` - View your tickets\n"
-            "• `/forgotpassword` - Password help\n"
-            "• `/help` - All commands\n\n"
-            "We respond within 24 hours! ⏰",
-            parse_mode="Markdown"
-        )
-    
-    # Support callbacks
-    elif query.data.startswith('support_'):
-        issue_type = query.data.replace('support_', '')
-        issue_types = {
-            'password': "I need help with my password",
-            'account': "I'm having account issues",
-            'donation': "I need help with donations",
-            'bug': "I found a bug or problem",
-            'other': "I have another issue"
-        }
-        
-        context.user_data[f"support_type_{query.from_user.id}"] = issue_type
-        await query.edit_message_text(
-            f"📝 *{issue_type.upper()} SUPPORT*\n\n"
-            f"Please describe your issue in detail:\n\n"
-            f"*Example:* '{issue_types[issue_type]} because...'\n\n"
-            f"Type your message now:",
-            parse_mode="Markdown"
-        )
-    
-    # Donation callbacks
-    elif query.data == 'donate':
-        await donate_command(update, context)
-    
-    elif query.data.startswith('donate_'):
-        if query.data == 'donate_custom':
-            context.user_data[f"waiting_custom_{query.from_user.id}"] = True
-            await query.edit_message_text(
-                "💰 *CUSTOM DONATION AMOUNT*\n\n"
-                "Please enter the amount you want to donate (in USD):\n\n"
-                "*Examples:*\n"
-                "• `7.50` (for $7.50)\n"
-                "• `15` (for $15)\n"
-                "• `25` (for $25)\n\n"
-                "Enter amount:",
-                parse_mode="Markdown"
-            )
-        else:
-            amount = int(query.data.split('_')[1])
-            await show_payment_options(update, context, amount)
-    
-    elif query.data == 'i_donated':
-        await query.edit_message_text(
-            "✅ *PAYMENT CONFIRMATION*\n\n"
-            "Please send your transaction ID as a message.\n\n"
-            "*Format:* `TXID123456789`\n\n"
-            "We'll verify your payment and update your supporter status!",
-            parse_mode="Markdown"
-        )
-    
-    elif query.data == 'my_donations':
-        await mydonations_command(update, context)
-    
-    elif query.data == 'back_to_menu':
-        await start(update, context)
-    
-    # Feature callbacks
-    elif query.data == 'create_image':
-        await query.edit_message_text(
-            "🎨 *IMAGE CREATION*\n\n"
-            "Create amazing images with AI!\n\n"
-            "*Usage:* `/image <description>`\n\n"
-            "*Examples:*\n"
-            "• `/image sunset over mountains`\n"
-            "• `/image cyberpunk city at night`\n"
-            "• `/image cute cat wearing glasses`\n\n"
-            "Try it now!",
-            parse_mode="Markdown"
-        )
-    
-    elif query.data == 'find_music':
-        await query.edit_message_text(
-            "🎵 *MUSIC SEARCH*\n\n"
-            "Find songs and artists on YouTube!\n\n"
-            "*Usage:* `/music <song or artist>`\n\n"
-            "*Examples:*\n"
-            "• `/music Bohemian Rhapsody`\n"
-            "• `/music Taylor Swift`\n"
-            "• `/music chill lofi beats`\n\n"
-            "Get direct YouTube links to listen!",
-            parse_mode="Markdown"
-        )
-    
-    elif query.data == 'get_joke':
-        joke = random.choice(JOKES)
-        await query.edit_message_text(f"😂 *JOKE OF THE DAY*\n\n{joke}", parse_mode="Markdown")
-    
-    elif query.data == 'get_fact':
-        fact = random.choice(FACTS)
-        await query.edit_message_text(f"💡 *DID YOU KNOW?*\n\n{fact}", parse_mode="Markdown")
-    
-    elif query.data == 'get_quote':
-        quote = random.choice(QUOTES)
-        await query.edit_message_text(f"📜 *INSPIRATIONAL QUOTE*\n\n{quote}", parse_mode="Markdown")
-    
-    elif query.data == 'chat':
-        await query.edit_message_text(
-            "💬 *LET'S CHAT!*\n\n"
-            "I'm here to talk about anything! 😊\n\n"
-            "*Just type your message and I'll respond naturally!*\n\n"
-            "What's on your mind? 🎭",
-            parse_mode="Markdown"
-        )
-    
-    # Chat room callbacks
-    elif query.data == 'create_chat':
-        context.user_data[f"waiting_chat_name_{query.from_user.id}"] = True
-        await query.edit_message_text(
-            "💬 *CREATE CHAT ROOM*\n\n"
-            "Please enter a name for your chat room:\n\n"
-            "*Examples:*\n"
-            "• StarAI Support\n"
-            "• Tech Discussion\n"
-            "• Casual Chat\n\n"
-            "Enter chat room name:",
-            parse_mode="Markdown"
-        )
-    
-    elif query.data == 'join_chat':
-        context.user_data[f"waiting_chat_code_{query.from_user.id}"] = True
-        await query.edit_message_text(
-            "🔗 *JOIN CHAT ROOM*\n\n"
-            "Please enter the chat room code:\n\n"
-            "*Format:* `chat_xxxxxxxx`\n\n"
-            "Enter chat room code:",
-            parse_mode="Markdown"
-        )
-    
-    elif query.data == 'my_chats':
-        await chatroom_command(update, context)
-    
-    elif query.data == 'leave_chat':
-        if query.from_user.id in chat_manager.user_chats:
-            chat_id = chat_manager.user_chats[query.from_user.id]
-            chat_manager.remove_user(chat_id, query.from_user.id)
-            await query.edit_message_text("✅ Left the chat room", parse_mode="Markdown")
-        else:
-            await query.edit_message_text("❌ You're not in any chat room", parse_mode="Markdown")
-    
-    # Profile editing callbacks
-    elif query.data.startswith('edit_'):
-        field = query.data.replace('edit_', '')
-        
-        if field == 'name':
-            context.user_data[f"waiting_new_name_{query.from_user.id}"] = True
-            await query.edit_message_text(
-                "📝 *CHANGE NAME*\n\n"
-                "Please enter your new full name:\n\n"
-                "*Format:* First Name Last Name\n"
-                "*Example:* John Doe\n\n"
-                "Enter new name:",
-                parse_mode="Markdown"
-            )
-        
-        elif field == 'phone':
-            context.user_data[f"waiting_new_phone_{query.from_user.id}"] = True
-            await query.edit_message_text(
-                "📱 *CHANGE PHONE*\n\n"
-                "Please enter your new phone number:\n\n"
-                "*Format:* +1234567890\n"
-                "*Example:* +1234567890\n\n"
-                "Enter new phone:",
-                parse_mode="Markdown"
-            )
-        
-        elif field == 'email':
-            context.user_data[f"waiting_new_email_{query.from_user.id}"] = True
-            await query.edit_message_text(
-                "📧 *CHANGE EMAIL*\n\n"
-                "Please enter your new email address:\n\n"
-                "*Format:* your.email@example.com\n"
-                "*Example:* john.doe@example.com\n\n"
-                "Enter new email:",
-                parse_mode="Markdown"
-            )
-        
-        elif field == 'password':
-            if 'user_id' not in context.user_data:
-                await query.edit_message_text("🔒 Please login first: `/login`", parse_mode="Markdown")
-                return
-            
-            context.user_data[f"change_password_{query.from_user.id}"] = True
-            await query.edit_message_text(
-                "🔐 *CHANGE PASSWORD*\n\n"
-                "Please enter your current password:",
-                parse_mode="Markdown"
-            )
+    data = query.data
+    logger.info(f"Button pressed: {data}")
     
-    elif query.data == 'cancel_edit':
-        await query.edit_message_text("❌ Profile edit cancelled.", parse_mode="Markdown")
+    text = CALLBACK_TEXTS.get(data)
+    if text is not None:
+        await query.edit_message_text(text, parse_mode="Markdown")
+        return
     
-    elif query.data == 'help':
-        await help_command(update, context)
+    prompt = CALLBACK_PROMPTS.get(data)
+    if prompt is not None:
+        flag, text = prompt
+        context.user_data[flag] = True
+        await query.edit_message_text(text, parse_mode="Markdown")
+        return
     
-    elif query.data == 'about':
-        await about_command(update, context)
+    handler = CALLBACK_HANDLERS.get(data)
+    if handler is None:
+        handler = next((h for prefix, h in CALLBACK_PREFIX_HANDLERS if data.startswith(prefix)), None)
+    if handler is not None:
+        await handler(update, context)
+        return
     
-    else:
-        await query.edit_message_text(
-            "🤔 *Not sure what you clicked!*\n\n"
-            "Try these commands:\n"
-            "• `/image` - Create images\n"
-            "• `/music` - Find songs\n"
-            "• `/joke` - Get a laugh\n"
-            "• `/donate` - Support bot\n\n"
-            "Or just chat with me! 💬",
-            parse_mode="Markdown"
-        )
+    await query.edit_message_text(UNKNOWN_CALLBACK_TEXT, parse_mode="Markdown")
 
 # ========================
 # MESSAGE HANDLER
 # ========================
+# Natural-language triggers; each is one regex pass over the lowercased message
+IMAGE_TRIGGER_RE = re.compile("|".join(map(re.escape, ["create image", "generate image", "draw", "paint", "picture of", "image of"])))
+MUSIC_TRIGGER_RE = re.compile("|".join(map(re.escape, ["play music", "find song", "music by", "listen to", "song by"])))
+TXID_PREFIXES = ('TXID', 'BMC-')  # donation transaction references
+GUEST_REMINDER_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Register Now", callback_data='register'),
+     InlineKeyboardButton("🔐 Login", callback_data='login')],
+    [InlineKeyboardButton("💡 See Benefits", callback_data='help'),
+     InlineKeyboardButton("❌ Dismiss", callback_data='dismiss_reminder')]
+])
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
@@ -3517,6 +4442,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         logger.info(f"User {user.id}: {user_message[:50]}")
         
+        # Pending /forgotpassword choice; an expired one is dropped and the message handled normally
+        reset_choice_until = context.user_data.get("reset_choice_until")
+        if reset_choice_until:
+            if time.monotonic() < reset_choice_until:
+                await handle_contact_support(update, context)
+                return
+            context.user_data.pop("reset_choice_until", None)
+        
         # Check if user is in a chat room
         if user.id in chat_manager.user_chats:
             chat_id = chat_manager.user_chats[user.id]
@@ -3545,25 +4478,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Session verification
         if 'session_id' in context.user_data:
             session_id = context.user_data['session_id']
-            user_data, message = user_db.verify_session(session_id)
+            user_data, message = await asyncio.to_thread(user_db.verify_session, session_id)
             if user_data:
                 context.user_data.update(user_data)
         
         # Guest tracking and reminders
         if 'user_id' not in context.user_data:
-            should_remind, reminder_type = user_db.track_guest_activity(user.id)
+            should_remind, reminder_type = await asyncio.to_thread(user_db.track_guest_activity, user.id)
             
             if should_remind and reminder_type in ['first', 'followup']:
-                stats = get_enhanced_stats()
+                stats = await asyncio.to_thread(get_enhanced_stats)
                 reminder = random.choice(GUEST_REMINDERS[reminder_type])
                 
                 # Get message count
-                conn = sqlite3.connect(user_db.db_file)
-                cursor = conn.cursor()
-                cursor.execute('SELECT message_count FROM guest_tracking WHERE telegram_id = ?', (user.id,))
-                result = cursor.fetchone()
-                message_count = result[0] if result else 0
-                conn.close()
+                message_count = await asyncio.to_thread(user_db.get_guest_message_count, user.id)
                 
                 # Format reminder
                 reminder = reminder.format(
@@ -3571,19 +4499,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     count=message_count
                 )
                 
-                keyboard = [
-                    [InlineKeyboardButton("📝 Register Now", callback_data='register'),
-                     InlineKeyboardButton("🔐 Login", callback_data='login')],
-                    [InlineKeyboardButton("💡 See Benefits", callback_data='help'),
-                     InlineKeyboardButton("❌ Dismiss", callback_data='dismiss_reminder')]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(reminder, parse_mode="Markdown", reply_markup=reply_markup)
+                await update.message.reply_text(reminder, parse_mode="Markdown", reply_markup=GUEST_REMINDER_KEYBOARD)
         
         # Check for custom donation amount
-        if context.user_data.get(f"waiting_custom_{user.id}"):
-            context.user_data.pop(f"waiting_custom_{user.id}", None)
+        if context.user_data.get("waiting_custom"):
+            context.user_data.pop("waiting_custom", None)
             
             try:
                 amount = float(user_message)
@@ -3591,28 +4511,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await update.message.reply_text("❌ Minimum donation is $1. Please enter a valid amount.")
                     return
                 
-                context.user_data[f"selected_amount_{user.id}"] = amount
-                
-                payment_text = f"""
-✅ *Selected: ${amount:.2f}*
-
-Now choose your payment method:
-
-1. **PayPal** - Secure payment with card or PayPal balance
-2. **Buy Me Coffee** - Simple one-click donation
-
-*After payment, click "✅ I've Paid" below and send your Transaction ID.*
-"""
+                context.user_data["selected_amount"] = amount
                 
-                keyboard = [
-                    [InlineKeyboardButton("💳 PayPal Payment", url='https://www.paypal.com/ncp/payment/HCPVDSSXRL4K8'),
-                     InlineKeyboardButton("☕ Buy Me Coffee", url='https://www.buymeacoffee.com/StarAI')],
-                    [InlineKeyboardButton("✅ I've Paid", callback_data='i_donated'),
-                     InlineKeyboardButton("🔙 Change Amount", callback_data='donate')]
-                ]
-                
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(payment_text, parse_mode="Markdown", reply_markup=reply_markup, disable_web_page_preview=True)
+                payment_text = PAYMENT_TEMPLATE.format(amount=f"{amount:.2f}")
+                await update.message.reply_text(payment_text, parse_mode="Markdown", reply_markup=PAYMENT_KEYBOARD, disable_web_page_preview=True)
                 return
                 
             except ValueError:
@@ -3620,13 +4522,14 @@ Now choose your payment method:
                 return
         
         # Check for transaction ID
-        if user_message.startswith('TXID') or user_message.startswith('BMC-'):
+        if user_message.startswith(TXID_PREFIXES):
             if 'user_id' in context.user_data:
                 user_id = context.user_data['user_id']
-                amount = context.user_data.get(f"selected_amount_{user.id}", 0)
+                amount = context.user_data.get("selected_amount", 0)
                 
                 if amount > 0:
-                    success = user_db.add_donation(
+                    success = await asyncio.to_thread(
+                        user_db.add_donation,
                         user_id=user_id,
                         username=user.username or "No username",
                         first_name=user.first_name,
@@ -3653,7 +4556,7 @@ Now choose your payment method:
 
 Use `/mydonations` to check your status.
 """
-                        context.user_data.pop(f"selected_amount_{user.id}", None)
+                        context.user_data.pop("selected_amount", None)
                     else:
                         response = "❌ Error recording donation. Please try again."
                     
@@ -3661,8 +4564,8 @@ Use `/mydonations` to check your status.
                     return
         
         # Handle support type messages
-        if context.user_data.get(f"support_type_{user.id}"):
-            issue_type = context.user_data.pop(f"support_type_{user.id}")
+        if context.user_data.get("support_type"):
+            issue_type = context.user_data.pop("support_type")
             issue_types = {
                 'password': "Password Reset/Login Issue",
                 'account': "Account Management Issue",
@@ -3676,9 +4579,9 @@ Use `/mydonations` to check your status.
             return
         
         # Handle chat room creation
-        if context.user_data.get(f"waiting_chat_name_{user.id}"):
+        if context.user_data.get("waiting_chat_name"):
             chat_name = user_message
-            context.user_data.pop(f"waiting_chat_name_{user.id}", None)
+            context.user_data.pop("waiting_chat_name", None)
             
             chat_id = chat_manager.create_chat_room(user.id, chat_name)
             
@@ -3696,9 +4599,9 @@ Use `/mydonations` to check your status.
             return
         
         # Handle chat room join
-        if context.user_data.get(f"waiting_chat_code_{user.id}"):
+        if context.user_data.get("waiting_chat_code"):
             chat_id = user_message.strip()
-            context.user_data.pop(f"waiting_chat_code_{user.id}", None)
+            context.user_data.pop("waiting_chat_code", None)
             
             if chat_manager.add_user_to_chat(chat_id, user.id):
                 chat_info = chat_manager.active_chats.get(chat_id, {})
@@ -3712,7 +4615,7 @@ Use `/mydonations` to check your status.
                                 chat_id=u_id,
                                 text=f"👋 *{user.first_name} has joined the chat!*"
                             )
-                        except:
+                        except TelegramError:
                             pass
                 
                 await update.message.reply_text(
@@ -3728,9 +4631,9 @@ Use `/mydonations` to check your status.
             return
         
         # Handle profile editing
-        if context.user_data.get(f"waiting_new_name_{user.id}"):
+        if context.user_data.get("waiting_new_name"):
             new_name = user_message
-            context.user_data.pop(f"waiting_new_name_{user.id}", None)
+            context.user_data.pop("waiting_new_name", None)
             
             if 'user_id' in context.user_data:
                 user_id = context.user_data['user_id']
@@ -3744,9 +4647,9 @@ Use `/mydonations` to check your status.
                     )
                     return
                 
-                success = user_db.update_user_profile(user_id, 'first_name', name_parts[0])
+                success = await asyncio.to_thread(user_db.update_user_profile, user_id, 'first_name', name_parts[0])
                 if len(name_parts) > 1:
-                    user_db.update_user_profile(user_id, 'last_name', ' '.join(name_parts[1:]))
+                    await asyncio.to_thread(user_db.update_user_profile, user_id, 'last_name', ' '.join(name_parts[1:]))
                 
                 if success:
                     context.user_data['first_name'] = name_parts[0]
@@ -3755,15 +4658,15 @@ Use `/mydonations` to check your status.
                     await update.message.reply_text("❌ Failed to update name", parse_mode="Markdown")
             return
         
-        if context.user_data.get(f"waiting_new_phone_{user.id}"):
+        if context.user_data.get("waiting_new_phone"):
             new_phone = user_message
-            context.user_data.pop(f"waiting_new_phone_{user.id}", None)
+            context.user_data.pop("waiting_new_phone", None)
             
             if 'user_id' in context.user_data:
                 user_id = context.user_data['user_id']
                 
-                if re.match(r'^\+?[1-9]\d{1,14}$', new_phone):
-                    success = user_db.update_user_profile(user_id, 'phone', new_phone)
+                if PHONE_RE.fullmatch(new_phone):
+                    success = await asyncio.to_thread(user_db.update_user_profile, user_id, 'phone', new_phone)
                     if success:
                         await update.message.reply_text(f"✅ Phone updated to: {new_phone}", parse_mode="Markdown")
                     else:
@@ -3776,15 +4679,15 @@ Use `/mydonations` to check your status.
                     )
             return
         
-        if context.user_data.get(f"waiting_new_email_{user.id}"):
+        if context.user_data.get("waiting_new_email"):
             new_email = user_message
-            context.user_data.pop(f"waiting_new_email_{user.id}", None)
+            context.user_data.pop("waiting_new_email", None)
             
             if 'user_id' in context.user_data:
                 user_id = context.user_data['user_id']
                 
-                if re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', new_email):
-                    success = user_db.update_user_profile(user_id, 'email', new_email)
+                if EMAIL_RE.fullmatch(new_email):
+                    success = await asyncio.to_thread(user_db.update_user_profile, user_id, 'email', new_email)
                     if success:
                         await update.message.reply_text(f"✅ Email updated to: {new_email}", parse_mode="Markdown")
                     else:
@@ -3798,9 +4701,9 @@ Use `/mydonations` to check your status.
             return
         
         # Handle password change
-        if context.user_data.get(f"change_password_{user.id}"):
+        if context.user_data.get("change_password"):
             if 'user_id' not in context.user_data:
-                context.user_data.pop(f"change_password_{user.id}", None)
+                context.user_data.pop("change_password", None)
                 await update.message.reply_text("🔒 Please login first: `/login`", parse_mode="Markdown")
                 return
             
@@ -3818,10 +4721,12 @@ Use `/mydonations` to check your status.
                 # This is the new password
                 new_password = user_message
                 current_password = context.user_data.pop('current_password')
-                context.user_data.pop(f"change_password_{user.id}", None)
+                context.user_data.pop("change_password", None)
                 
                 user_id = context.user_data['user_id']
-                success, message = user_db.change_user_password(user_id, current_password, new_password)
+                success, message = await user_db.run_kdf(
+                    user_db.change_user_password, user_id, current_password, new_password, context.user_data.get('session_id')
+                )
                 
                 if success:
                     await update.message.reply_text(f"✅ {message}", parse_mode="Markdown")
@@ -3830,9 +4735,9 @@ Use `/mydonations` to check your status.
                 return
         
         # Handle password reset
-        if context.user_data.get(f"reset_in_progress_{user.id}"):
+        if context.user_data.get("reset_in_progress"):
             new_password = user_message
-            reset_token = context.user_data.get(f"reset_token_{user.id}")
+            reset_token = context.user_data.get("reset_token")
             
             if len(new_password) < 6:
                 await update.message.reply_text(
@@ -3842,12 +4747,12 @@ Use `/mydonations` to check your status.
                 )
                 return
             
-            telegram_id, message = user_db.verify_reset_token(reset_token)
+            telegram_id, message = await asyncio.to_thread(user_db.verify_reset_token, reset_token)
             
             if telegram_id:
-                success, message = user_db.reset_password(telegram_id, new_password)
-                context.user_data.pop(f"reset_in_progress_{user.id}", None)
-                context.user_data.pop(f"reset_token_{user.id}", None)
+                success, message = await user_db.run_kdf(user_db.reset_password, telegram_id, new_password)
+                context.user_data.pop("reset_in_progress", None)
+                context.user_data.pop("reset_token", None)
                 
                 if success:
                     await update.message.reply_text(
@@ -3864,33 +4769,33 @@ Use `/mydonations` to check your status.
         
         # Handle admin actions
         if user.id in ADMIN_IDS:
-            if context.user_data.get(f"admin_search_{user.id}"):
+            if context.user_data.get("admin_search"):
                 search_query = user_message
-                context.user_data.pop(f"admin_search_{user.id}", None)
+                context.user_data.pop("admin_search", None)
                 await admin_search_users_command(update, context, search_query)
                 return
             
-            if context.user_data.get(f"admin_delete_{user.id}"):
+            if context.user_data.get("admin_delete"):
                 try:
                     target_user_id = int(user_message)
-                    success, message = user_db.delete_user(target_user_id)
-                    context.user_data.pop(f"admin_delete_{user.id}", None)
+                    success, message = await asyncio.to_thread(user_db.delete_user, target_user_id)
+                    context.user_data.pop("admin_delete", None)
                     await update.message.reply_text(f"{'✅' if success else '❌'} {message}", parse_mode="Markdown")
                 except ValueError:
                     await update.message.reply_text("❌ Invalid user ID.", parse_mode="Markdown")
                 return
             
-            if context.user_data.get(f"admin_reset_{user.id}"):
+            if context.user_data.get("admin_reset"):
                 try:
                     target_user_id = int(user_message)
-                    success, message = user_db.admin_reset_password(target_user_id)
-                    context.user_data.pop(f"admin_reset_{user.id}", None)
+                    success, message = await user_db.run_kdf(user_db.admin_reset_password, target_user_id)
+                    context.user_data.pop("admin_reset", None)
                     await update.message.reply_text(f"{'✅' if success else '❌'} {message}", parse_mode="Markdown")
                 except ValueError:
                     await update.message.reply_text("❌ Invalid user ID.", parse_mode="Markdown")
                 return
             
-            if context.user_data.get(f"admin_ban_{user.id}"):
+            if context.user_data.get("admin_ban"):
                 parts = user_message.split()
                 if len(parts) < 1:
                     await update.message.reply_text("❌ Please enter user ID and action (ban/unban)", parse_mode="Markdown")
@@ -3899,8 +4804,8 @@ Use `/mydonations` to check your status.
                 try:
                     target_user_id = int(parts[0])
                     action = parts[1] if len(parts) > 1 else "ban"
-                    success, message = user_db.ban_user(target_user_id, action)
-                    context.user_data.pop(f"admin_ban_{user.id}", None)
+                    success, message = await asyncio.to_thread(user_db.ban_user, target_user_id, action)
+                    context.user_data.pop("admin_ban", None)
                     await update.message.reply_text(f"{'✅' if success else '❌'} {message}", parse_mode="Markdown")
                 except ValueError:
                     await update.message.reply_text("❌ Invalid user ID.", parse_mode="Markdown")
@@ -3909,85 +4814,58 @@ Use `/mydonations` to check your status.
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
         if 'user_id' in context.user_data:
-            user_db.update_user_stats(context.user_data['user_id'], 'total_messages')
-            user_db.update_user_stats(context.user_data['user_id'], 'commands_used')
+            user_db.update_user_stats(context.user_data['user_id'], 'total_messages', 'commands_used')
+        
+        lowered = user_message.lower()
         
         # Image requests
-        image_keywords = ["create image", "generate image", "draw", "paint", "picture of", "image of"]
-        if any(keyword in user_message.lower() for keyword in image_keywords):
-            prompt = user_message
-            for keyword in image_keywords:
-                if keyword in user_message.lower():
-                    parts = user_message.lower().split(keyword)
-                    if len(parts) > 1:
-                        prompt = parts[1].strip()
-                        break
+        match = IMAGE_TRIGGER_RE.search(lowered)
+        if match:
+            prompt = lowered[match.end():].strip()
             
             if not prompt or len(prompt) < 2:
                 prompt = "a beautiful artwork"
             
-            msg = await update.message.reply_text(f"🎨 *Creating:* `{prompt}`...", parse_mode="Markdown")
-            image_path = generate_image(prompt)
+            if not allow_media_request(user.id, "image"):
+                await update.message.reply_text(RATE_LIMITED_TEXT, parse_mode="Markdown")
+                return
             
-            if image_path and os.path.exists(image_path) and os.path.getsize(image_path) > 1000:
-                try:
-                    with open(image_path, 'rb') as photo:
-                        await update.message.reply_photo(photo=photo, caption=f"✨ *Generated:* `{prompt}`\n*By StarAI* 🎨", parse_mode="Markdown")
-                    try:
-                        await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=msg.message_id)
-                    except:
-                        pass
-                except Exception as e:
-                    logger.error(f"Error sending image: {e}")
-                    await msg.edit_text("❌ Couldn't send image. Try `/image` command.")
-                finally:
-                    try:
-                        if os.path.exists(image_path):
-                            os.unlink(image_path)
-                    except:
-                        pass
-            else:
-                await msg.edit_text("❌ Image creation failed. Try: `/image <description>`")
+            msg = await update.message.reply_text(f"🎨 *Creating:* `{prompt}`...", parse_mode="Markdown")
+            await enqueue_media_job(
+                update.effective_chat.id, msg.message_id, "image",
+                (prompt, f"✨ *Generated:* `{prompt}`\n*By StarAI* 🎨", "❌ Image creation failed. Try: `/image <description>`")
+            )
             return
         
         # Music requests
-        music_keywords = ["play music", "find song", "music by", "listen to", "song by"]
-        if any(keyword in user_message.lower() for keyword in music_keywords):
-            query = user_message
-            for keyword in music_keywords:
-                if keyword in user_message.lower():
-                    parts = user_message.lower().split(keyword)
-                    if len(parts) > 1:
-                        query = parts[1].strip()
-                        break
+        match = MUSIC_TRIGGER_RE.search(lowered)
+        if match:
+            query = lowered[match.end():].strip()
             
             if not query:
                 query = "popular music"
             
-            msg = await update.message.reply_text(f"🎵 *Searching:* `{query}`...", parse_mode="Markdown")
-            results = search_music(query)
-            
-            if len(results) > 0 and "Use:" not in results[0]:
-                response = "🎶 *Music Results:*\n\n"
-                for result in results:
-                    response += f"{result}\n\n"
-                response += "💡 *Note:* YouTube links for listening."
-            else:
-                response = "❌ *No results found.* Try: `/music <song name>`"
+            if not allow_media_request(user.id, "music"):
+                await update.message.reply_text(RATE_LIMITED_TEXT, parse_mode="Markdown")
+                return
             
-            await msg.edit_text(response, parse_mode="Markdown")
+            msg = await update.message.reply_text(f"🎵 *Searching:* `{query}`...", parse_mode="Markdown")
+            await enqueue_media_job(
+                update.effective_chat.id, msg.message_id, "music",
+                (query, "💡 *Note:* YouTube links for listening.", "❌ *No results found.* Try: `/music <song name>`")
+            )
             return
         
         # Fun commands
-        if "joke" in user_message.lower() and ("tell" in user_message.lower() or "give" in user_message.lower()):
+        if "joke" in lowered and ("tell" in lowered or "give" in lowered):
             await joke_command(update, context)
             return
         
-        if "fact" in user_message.lower():
+        if "fact" in lowered:
             await fact_command(update, context)
             return
         
-        if "quote" in user_message.lower():
+        if "quote" in lowered:
             await quote_command(update, context)
             return
         
@@ -3996,18 +4874,25 @@ Use `/mydonations` to check your status.
             user_db.update_user_stats(context.user_data['user_id'], 'ai_chats')
         
         if client:
-            conversation = get_user_conversation(user.id)
-            conversation.append({"role": "user", "content": user_message})
-            
-            response = client.chat.completions.create(
-                messages=conversation,
-                model="llama-3.1-8b-instant",
-                temperature=0.8,
-                max_tokens=600
-            )
-            
-            ai_response = response.choices[0].message.content
-            update_conversation(user.id, "assistant", ai_response)
+            conversation, summary = await load_chat_state(user.id)
+            conversation = update_conversation(conversation, "user", user_message)
+            messages, summary = await build_chat_messages(conversation, summary)
+            cache_key = build_state_key(AI_MODEL, messages)
+            ai_response = await get_cached_ai_response(cache_key)
+            fresh_response = None
+            
+            if not ai_response:
+                response = await asyncio.to_thread(
+                    client.chat.completions.create,
+                    messages=messages,
+                    model=AI_MODEL,
+                    temperature=0.8,
+                    max_tokens=600
+                )
+                
+                ai_response = fresh_response = response.choices[0].message.content
+            conversation = update_conversation(conversation, "assistant", ai_response)
+            await save_chat_state(user.id, conversation, summary, cache_key, fresh_response)
             await update.message.reply_text(ai_response, parse_mode="Markdown")
         else:
             await update.message.reply_text(
@@ -4034,130 +4919,184 @@ I can still help you with:
 # ========================
 # MAIN FUNCTION
 # ========================
-def main():
-    print("=" * 60)
-    print("🌟 STARAI - COMPLETE BOT WITH ALL FEATURES")
-    print("=" * 60)
+# ========================
+# HANDLER TABLES
+# ========================
+TEXT_NON_CMD = filters.TEXT & ~filters.COMMAND
+
+ACCOUNT_COMMANDS = (
+    ("login", login_command),
+    ("logout", logout_command),
+    ("profile", profile_command),
+    ("reset", reset_password_command),
+    ("forgotpassword", forgot_password),
+    ("editprofile", editprofile_command),
+)
+
+SUPPORT_COMMANDS = (
+    ("support", support_command),
+    ("mytickets", mytickets_command),
+    ("messages", messages_command),
+    ("ticket", ticket_command),
+)
+
+# FIXED ADMIN COMMANDS - THESE ARE THE ONES THAT WERE BROKEN
+ADMIN_COMMANDS = (
+    ("admin", admin_command),           # Fixed
+    ("adminusers", admin_users_command), # Fixed
+    ("reply", reply_command),           # Fixed
+    ("adminsupport", admin_support_command), # Fixed
+)
+
+FEATURE_COMMANDS = (
+    ("chatroom", chatroom_command),
+)
+
+BOT_COMMANDS = (
+    ("start", start),
+    ("help", help_command),
+    ("image", image_command),
+    ("music", music_command),
+    ("joke", joke_command),
+    ("fact", fact_command),
+    ("quote", quote_command),
+    ("clear", clear_command),
+    ("donate", donate_command),
+    ("mydonations", mydonations_command),
+    ("about", about_command),
+)
+
+COMMANDS = ACCOUNT_COMMANDS + SUPPORT_COMMANDS + ADMIN_COMMANDS + FEATURE_COMMANDS + BOT_COMMANDS
+
+def build_application():
+    """Application with every handler registered; shared by polling and the ASGI webhook"""
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .rate_limiter(AIORateLimiter(overall_max_rate=28, group_max_rate=20, max_retries=2))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
-    if not TELEGRAM_TOKEN:
-        print("❌ ERROR: TELEGRAM_TOKEN not found in environment variables!")
-        print("Set in Heroku: Settings → Config Vars → Add TELEGRAM_TOKEN")
-        return
+    # Registration conversation handler
+    registration_handler = ConversationHandler(
+        entry_points=[CommandHandler('register', start_registration)],
+        states={
+            NAME: [MessageHandler(TEXT_NON_CMD, get_name)],
+            PHONE: [MessageHandler(TEXT_NON_CMD, get_phone)],
+            EMAIL: [MessageHandler(TEXT_NON_CMD, get_email)],
+            PASSWORD: [MessageHandler(TEXT_NON_CMD, get_password)],
+            CONFIRM_PASSWORD: [MessageHandler(TEXT_NON_CMD, confirm_password)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel_registration)],
+    )
     
-    print(f"✅ Bot Token Loaded: {TELEGRAM_TOKEN[:10]}...")
-    print(f"✅ Admin IDs: {ADMIN_IDS}")
+    # Add conversation handlers
+    app.add_handler(registration_handler)
     
-    if not GROQ_API_KEY:
-        print("⚠️ WARNING: GROQ_API_KEY missing - AI chat limited")
-    else:
-        print("✅ Groq AI: Enabled")
+    # Add all command handlers
+    for command, handler in COMMANDS:
+        app.add_handler(CommandHandler(command, handler))
+    
+    # Add callback query handler
+    app.add_handler(CallbackQueryHandler(button_callback))
+    
+    # Add message handler (must be last)
+    app.add_handler(MessageHandler(TEXT_NON_CMD, handle_message))
     
-    print("✅ Telegram Bot: Ready")
-    print("👑 Admin Commands: FIXED & WORKING")
-    print("✅ /adminusers - User management")
-    print("✅ /admin support - Support tickets")
-    print("✅ /reply - Send messages to users")
-    print("✅ /admin stats - Statistics")
-    print("=" * 60)
+    return app
+
+def main():
+    if not TELEGRAM_TOKEN:
+        logger.error("❌ TELEGRAM_TOKEN not found in environment variables! "
+                     "Set in Heroku: Settings → Config Vars → Add TELEGRAM_TOKEN")
+        return
     
     try:
-        app = Application.builder().token(TELEGRAM_TOKEN).build()
-        
-        # Registration conversation handler
-        registration_handler = ConversationHandler(
-            entry_points=[CommandHandler('register', start_registration)],
-            states={
-                NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_name)],
-                PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_phone)],
-                EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_email)],
-                PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_password)],
-                CONFIRM_PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_password)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel_registration)],
-        )
-        
-        # Password reset conversation handler
-        reset_handler = ConversationHandler(
-            entry_points=[CommandHandler('forgotpassword', forgot_password)],
-            states={
-                CONTACT_SUPPORT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_contact_support)],
-            },
-            fallbacks=[],
-        )
-        
-        # Add conversation handlers
-        app.add_handler(registration_handler)
-        app.add_handler(reset_handler)
-        
-        # Command categories
-        account_commands = [
-            ("login", login_command),
-            ("logout", logout_command),
-            ("profile", profile_command),
-            ("reset", reset_password_command),
-            ("editprofile", editprofile_command),
-        ]
-        
-        support_commands = [
-            ("support", support_command),
-            ("mytickets", mytickets_command),
-            ("messages", messages_command),
-            ("ticket", ticket_command),
-        ]
-        
-        # FIXED ADMIN COMMANDS - THESE ARE THE ONES THAT WERE BROKEN
-        admin_commands = [
-            ("admin", admin_command),           # Fixed
-            ("adminusers", admin_users_command), # Fixed
-            ("reply", reply_command),           # Fixed
-            ("adminsupport", admin_support_command), # Fixed
-        ]
+        app = build_application()
         
-        feature_commands = [
-            ("chatroom", chatroom_command),
-        ]
-        
-        bot_commands = [
-            ("start", start),
-            ("help", help_command),
-            ("image", image_command),
-            ("music", music_command),
-            ("joke", joke_command),
-            ("fact", fact_command),
-            ("quote", quote_command),
-            ("clear", clear_command),
-            ("donate", donate_command),
-            ("mydonations", mydonations_command),
-            ("about", about_command),
-        ]
-        
-        # Add all command handlers
-        all_commands = account_commands + support_commands + admin_commands + feature_commands + bot_commands
-        
-        for command, handler in all_commands:
-            app.add_handler(CommandHandler(command, handler))
-        
-        # Add callback query handler
-        app.add_handler(CallbackQueryHandler(button_callback))
-        
-        # Add message handler (must be last)
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        
-        print("✅ StarAI is running with ALL FEATURES!")
-        print("✅ Admin commands FIXED and WORKING")
-        print("✅ /adminusers - Now lists users without errors")
-        print("✅ /reply - Now sends messages properly")
-        print("✅ /admin support - Shows support tickets")
-        print("✅ Token security: Using environment variables")
-        print("🔧 Send /start to begin")
-        print("=" * 60)
+        logger.info("\n".join([
+            "=" * 60,
+            "🌟 STARAI - COMPLETE BOT WITH ALL FEATURES",
+            f"✅ Bot Token Loaded: {TELEGRAM_TOKEN[:10]}...",
+            f"✅ Admin IDs: {sorted(ADMIN_IDS)}",
+            "✅ Groq AI: Enabled" if GROQ_API_KEY else "⚠️ WARNING: GROQ_API_KEY missing - AI chat limited",
+            "🔧 Send /start to begin",
+            "=" * 60,
+        ]))
         
         app.run_polling()
         
     except Exception as e:
-        print(f"❌ Failed to start: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"❌ Failed to start: {e}")
+
+# ========================
+# WEBHOOK (ASGI)
+# ========================
+# uvicorn bot:asgi --loop uvloop
+# Exactly one worker: context.user_data, ConversationHandler states, login throttles outside Redis,
+# media buckets/queues, the UserDB caches and the buffered stats all live in this process.
+WEBHOOK_LOCK_FILE = os.path.join(tempfile.gettempdir(), "starai_webhook.lock")
+
+def acquire_webhook_lock():
+    """Refuse to start a second webhook worker on this host"""
+    lock = open(WEBHOOK_LOCK_FILE, "w")
+    if fcntl is None:
+        logger.warning("⚠️ fcntl unavailable - run the webhook with a single worker")
+        return lock
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise RuntimeError("Another StarAI webhook worker is running; start uvicorn with a single worker")
+    return lock
+
+@asynccontextmanager
+async def lifespan(server):
+    lock = acquire_webhook_lock()
+    try:
+        application = build_application()
+        await application.initialize()
+        await post_init(application)
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}/telegram",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await application.start()
+        server.state.telegram = application
+        
+        yield
+        
+        await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+    finally:
+        lock.close()
+
+async def telegram_webhook(request):
+    application = request.app.state.telegram
+    if WEBHOOK_SECRET:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return Response(status_code=403)
+    
+    update = Update.de_json(orjson.loads(await request.body()), application.bot)
+    await application.update_queue.put(update)
+    return Response()
+
+async def health_check(request):
+    return PlainTextResponse("ok")
+
+asgi = Starlette(
+    routes=[
+        Route("/telegram", telegram_webhook, methods=["POST"]),
+        Route("/health", health_check),
+    ],
+    lifespan=lifespan,
+)
 
 if __name__ == '__main__':
     main()